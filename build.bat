@@ -47,6 +47,8 @@ py -3.13 -m PyInstaller --onefile ^
     --hidden-import=pywebview.platforms.winforms ^
     --hidden-import=clr ^
     --hidden-import=pythonnet ^
+    --hidden-import=cts310ii ^
+    --hidden-import=tcpos_parser ^
     --collect-all pywebview ^
     --collect-all bottle ^
     fiscal_printer_hub.py
@@ -0,0 +1,222 @@
+"""
+Shared configuration service
+
+config.json is parsed and validated once and handed out as an immutable
+snapshot. The file mtime is checked at most every `check_interval` seconds;
+a changed file is reloaded atomically (an invalid edit keeps the previous
+snapshot) and the registered change callbacks are called.
+"""
+
+import os
+import sys
+import json
+import time
+import datetime
+import threading
+from types import MappingProxyType
+from logger_module import logger
+
+
+if getattr(sys, 'frozen', False):
+    base_dir = os.path.dirname(sys.executable)
+
+elif __file__:
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+config_path = os.path.join(base_dir, 'config.json')
+check_interval = 1  # seconds between mtime checks
+
+# section: required keys
+required_keys = {
+    "pos": ("name",),
+    "printer": ("name",),
+    "client": ("NKF",),
+    "miscellaneous": ("default_client_name", "default_client_crib"),
+}
+
+_lock = threading.RLock()
+_snapshot = None
+_mtime = None
+_last_check = 0
+_callbacks = []
+
+
+def freeze(value):
+    """
+    Returns a read-only copy: dicts become mappingproxies, lists tuples.
+    """
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    """
+    Returns a plain, mutable copy of a snapshot (or part of it).
+    """
+    if isinstance(value, MappingProxyType) or isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple) or isinstance(value, list):
+        return [thaw(v) for v in value]
+    return value
+
+
+def validate(config):
+    """
+    Returns a list of problems, empty when the config is usable.
+    """
+    if not isinstance(config, dict):
+        return ["config root must be an object"]
+
+    errors = []
+    for section, keys in required_keys.items():
+        if not isinstance(config.get(section), dict):
+            errors.append(f"missing section '{section}'")
+            continue
+        for key in keys:
+            if key not in config[section]:
+                errors.append(f"missing '{section}.{key}'")
+
+    # a single transactions folder or a list of sources
+    pos = config.get("pos")
+    if isinstance(pos, dict):
+        sources = pos.get("sources")
+        if sources:
+            if not isinstance(sources, list):
+                errors.append("'pos.sources' must be a list")
+            else:
+                for index, source in enumerate(sources):
+                    if not isinstance(source, dict) or "transactions_folder" not in source:
+                        errors.append(f"missing 'pos.sources[{index}].transactions_folder'")
+        elif "transactions_folder" not in pos:
+            errors.append("missing 'pos.transactions_folder' or 'pos.sources'")
+
+    return errors
+
+
+def apply_defaults(config):
+    if "fiscal_tools" not in config:
+        config["fiscal_tools"] = {
+            "Z_report_from": datetime.date.today().strftime("%Y-%m-%d"),
+            "last_z_report_print_time": None
+        }
+
+    return config
+
+
+def _read():
+    mtime = os.stat(config_path).st_mtime_ns
+    with open(config_path, encoding="utf-8") as json_file:
+        config = json.load(json_file)
+
+    errors = validate(config)
+    if errors:
+        raise ValueError("Invalid config.json: " + ", ".join(errors))
+
+    return freeze(apply_defaults(config)), mtime
+
+
+def reload(force=False):
+    """
+    Reloads config.json when its mtime changed (or always with force).
+    Returns True when a new snapshot was installed.
+    """
+    global _snapshot, _mtime, _last_check
+
+    with _lock:
+        _last_check = time.monotonic()
+        try:
+            if not force and _snapshot is not None and os.stat(config_path).st_mtime_ns == _mtime:
+                return False
+
+            snapshot, mtime = _read()
+
+        except Exception as e:
+            if _snapshot is None:
+                raise
+            logger.error(f"Config reload failed, keeping the previous config: {e}")
+            # do not retry the same broken file on every check
+            try:
+                _mtime = os.stat(config_path).st_mtime_ns
+            except OSError:
+                pass
+            return False
+
+        old, _snapshot, _mtime = _snapshot, snapshot, mtime
+        callbacks = list(_callbacks)
+
+    if old is not None:
+        logger.info("Config reloaded")
+        for callback in callbacks:
+            try:
+                callback(old, snapshot)
+            except Exception as e:
+                logger.error(f"Config change callback error: {e}")
+
+    return True
+
+
+def get():
+    """
+    Returns the current immutable config snapshot.
+    """
+    if _snapshot is None or time.monotonic() - _last_check >= check_interval:
+        reload()
+
+    return _snapshot
+
+
+def on_change(callback):
+    """
+    Registers callback(old, new), called after every reload.
+    """
+    with _lock:
+        _callbacks.append(callback)
+
+
+def start_watching():
+    """
+    Reloads in the background so change callbacks fire without a get() call.
+    """
+    def watch():
+        while True:
+            time.sleep(check_interval)
+            try:
+                reload()
+            except Exception as e:
+                logger.error(f"Config watch error: {e}")
+
+    threading.Thread(target=watch, name="config-watch", daemon=True).start()
+
+
+def save(config):
+    """
+    Atomically replaces config.json (temp file + rename) and reloads it.
+    """
+    config = thaw(config)
+    errors = validate(config)
+    if errors:
+        raise ValueError("Invalid config: " + ", ".join(errors))
+
+    with _lock:
+        temp_path = config_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as json_file:
+            json.dump(config, json_file, indent=2)
+            json_file.flush()
+            os.fsync(json_file.fileno())
+        os.replace(temp_path, config_path)
+
+        reload(force=True)
+
+
+def update_section(section, values):
+    """
+    Merges values into one section of the config and saves it.
+    """
+    with _lock:
+        config = thaw(get())
+        config.setdefault(section, {}).update(values)
+        save(config)
@@ -1,11 +1,16 @@
 import os
 import serial.tools.list_ports
+import serial.tools.list_ports_common
 import json
 import datetime
 import serial
 import time
+import copy
 import sys
-from logger_module import logger
+import threading
+from logger_module import logger, lazy_json, debug_enabled
+import config_service
+import serial_trace
 
 
 """
@@ -24,6 +29,16 @@ elif __file__:
 serial_timeout = 5  # seconds
 COM_PORT = None
 BAUD_RATE = 9600
+printer_fingerprint = None  # port and USB identity of the spotted printer
+fiscal_information = None  # cached static printer data, see refresh_fiscal_information
+fiscal_info_cache_path = os.path.join(base_dir, 'fiscal_info.json')
+fiscal_info_max_age = 24 * 3600  # seconds before a reconnect reads the cached fiscal information again
+
+# held for every command, and for a whole document so nothing interleaves with it
+serial_lock = threading.RLock()
+
+# last communication failure (port gone, no answer), None while the printer answers
+serial_error = None
 
 # symbols in hex
 STX = "02"  # start of transmission
@@ -126,11 +141,6 @@ states_codes = {
 }
 
 
-def load_config():
-    with open(os.path.join(base_dir, 'config.json')) as json_file:
-        return json.load(json_file)
-
-
 def convert_to_tax(string):
     # 0600 to 6.00 float
     return float(string[0:2] + "." + string[2:4])
@@ -200,72 +210,109 @@ def hex_cmd_to_bytes(hex_cmd):
         return None
 
 
-def send_to_serial(hex_cmd, wait_for_response=True):
+def send_to_serial(hex_cmd, wait_for_response=True, dump_on_failure=True, nak_expected=False):
+    """
+    Sends one command and returns the raw hex response, None on a serial
+    error. The serial trace is dumped after a NAK, a timeout or an error
+    unless dump_on_failure is False; nak_expected keeps the dump for
+    timeouts and errors only, for commands whose NAK is a normal answer
+    (nothing to cancel, document not found, end of a report sequence).
+    """
+    global serial_error
+
     try:
-        # logger.debug(f"Command: {hex_cmd}")
-        if DEBUG:
-            logger.debug("Ignoring serial send")
-            return f"{STX}{ETX}{ACK}"
-
-        # convert the command to bytes
-        bytes_cmd = hex_cmd_to_bytes(hex_cmd)
-
-        if bytes_cmd is not None:
-            # send the command
-            ser = serial.Serial(COM_PORT, BAUD_RATE)
-            ser.timeout = 3.0  # different to the timeout set in the global scope
-            ser.write(bytes_cmd)
-
-            if wait_for_response:
-                # wait for response
-                et = time.time() + serial_timeout
-                data = ""
-                while time.time() < et:
-                    data += ser.read(1).hex()
-                    if data.endswith(ETX + ACK) or data.endswith(NAK):
-                        break
-
-                logger.debug(f"Response length: {len(data)}")
-                # logger.debug(data)
-                return data
+        with serial_lock:
+            # logger.debug(f"Command: {hex_cmd}")
+            code = hex_cmd[2:4]
+            serial_trace.record(serial_trace.TX, code, hex_cmd)
+            if DEBUG:
+                logger.debug("Ignoring serial send")
+                return f"{STX}{ETX}{ACK}"
+
+            # convert the command to bytes
+            bytes_cmd = hex_cmd_to_bytes(hex_cmd)
+
+            if bytes_cmd is not None:
+                # send the command
+                started = time.perf_counter()
+                ser = serial.Serial(COM_PORT, BAUD_RATE)
+                ser.timeout = 3.0  # different to the timeout set in the global scope
+                ser.write(bytes_cmd)
+
+                if wait_for_response:
+                    # wait for response
+                    et = time.time() + serial_timeout
+                    data = ""
+                    while time.time() < et:
+                        data += ser.read(1).hex()
+                        if data.endswith(ETX + ACK) or data.endswith(NAK):
+                            break
+
+                    if data.endswith(ETX + ACK):
+                        outcome = "ack"
+                    elif data.endswith(NAK):
+                        outcome = "nak"
+                    else:
+                        outcome = "timeout"
+                    serial_trace.record(serial_trace.RX, code, data, time.perf_counter() - started, outcome)
+                    if outcome != "ack" and dump_on_failure and not (outcome == "nak" and nak_expected):
+                        serial_trace.auto_dump(f"{outcome} on command {code} ({COM_PORT})")
+
+                    logger.debug("Response length: %s", len(data))
+                    # logger.debug(data)
+                    serial_error = None if data else "no response from printer"
+                    return data
 
     except Exception as e:
         logger.error("Serial sending error: " + str(e))
-        exit()
+        serial_trace.record(serial_trace.RX, hex_cmd[2:4] if hex_cmd else None, None, None, "error")
+        if dump_on_failure:
+            serial_trace.auto_dump(f"serial error on {COM_PORT}: {e}")
+        serial_error = str(e)
         return None
 
 
 def spot_printer():
-    global COM_PORT
+    global COM_PORT, printer_fingerprint
 
     try:
         if DEBUG:
             logger.debug("DEBUG mode, ignoring printer")
             return True
 
-        while 1:
-            logger.debug("Spotting printer...")
-            ports = serial.tools.list_ports.comports()
-
-            if len(ports) > 0:
-                for port in reversed(ports):
-                    COM_PORT = port.name
-                    logger.debug(f"Checking {COM_PORT} port...")
-                    code = "21"
-                    cmd = f"{STX}{code}{ETX}"
-                    response = send_to_serial(cmd)
-
-                    if is_success_response(response):
-                        logger.debug(f"Found printer on {COM_PORT}..")
-                        return True
-
-            raise Exception("Printer not found...")
-            time.sleep(1)
+        # COM_PORT changes while probing, keep other senders out until it is settled
+        with serial_lock:
+            while 1:
+                logger.debug("Spotting printer...")
+                # a fixed port (e.g. an emulated printer) skips the discovery
+                configured_port = config_service.get()['printer'].get('port')
+                if configured_port:
+                    ports = [serial.tools.list_ports_common.ListPortInfo(configured_port, skip_link_detection=True)]
+                else:
+                    ports = serial.tools.list_ports.comports()
+
+                if len(ports) > 0:
+                    for port in reversed(ports):
+                        COM_PORT = port.device
+                        logger.debug(f"Checking {COM_PORT} port...")
+                        code = "21"
+                        cmd = f"{STX}{code}{ETX}"
+                        # probing other devices fails by design, do not dump those
+                        response = send_to_serial(cmd, dump_on_failure=False)
+
+                        if is_success_response(response):
+                            logger.debug(f"Found printer on {COM_PORT}..")
+                            printer_fingerprint = f"{port.device}|{port.hwid}"
+                            return True
+
+                raise Exception("Printer not found...")
+                time.sleep(1)
 
     except Exception as e:
         logger.error("Error: " + str(e))
 
-    COM_PORT = None
+    with serial_lock:
+        COM_PORT = None
     return False
 
 
@@ -467,7 +514,7 @@ def decode_sub_or_total_response(data):
 
         }
 
-        logger.debug(json.dumps(a, indent=4))
+        logger.debug("%s", lazy_json(a))
         return a
 
     except Exception as e:
@@ -476,6 +523,51 @@ def decode_sub_or_total_response(data):
     return None
 
 
+# the four document groups of a Z report record, each: total, tax 1-10, accumulated amount
+z_report_sections = ("invoice_final_consumer", "invoice_fiscal_credit",
+                     "credit_note_final_consumer", "credit_note_fiscal_credit")
+
+
+def decode_z_report(data):
+    """
+    Decode one Z report record, as returned by 0x76 and 0xA2 (page 58)
+    """
+    try:
+        data = data[2:-4]
+        data = data.upper()
+        fields = [hex_to_string(field) for field in data.split(FS)]
+
+        report_date = datetime.datetime.strptime(fields[2] + fields[3], '%d%m%Y%H%M%S')
+        business_date = datetime.datetime.strptime(fields[4], '%d%m%Y').date()
+
+        z_report = {
+            "number": int(fields[1]),
+            "report_datetime": report_date.strftime('%Y-%m-%d %H:%M:%S'),
+            "business_date": business_date.isoformat(),
+            "initial_nkk": fields[5].strip(),
+            "final_nkk": fields[6].strip(),
+        }
+
+        # fields 8-55: 12 amounts per section
+        for index, section in enumerate(z_report_sections):
+            amounts = [string_number_to_number(value, decimals=2) for value in fields[7 + index * 12:19 + index * 12]]
+            z_report[section] = {
+                "total": amounts[0],
+                "taxes": amounts[1:11],
+                "accumulated": amounts[11],
+            }
+
+        z_report["no_sale_documents"] = int(fields[55])
+        z_report["cancelled_documents"] = int(fields[56])
+
+        return z_report
+
+    except Exception as e:
+        logger.error("Error while decoding Z report: " + str(e))
+
+    return None
+
+
 #!END DECODERS SECTION
 
 #########################################################################################
@@ -537,6 +629,27 @@ def get_fiscal_information():
     return None
 
 
+def get_current_z_number():
+    """
+    Returns the current Z report number of the fiscal period information
+    (0x72, field 1). It changes with every Z report, also one closed from the
+    printer keypad. None when the printer cannot be asked.
+    """
+    try:
+        code = "72"
+        cmd = f"{STX}{code}{ETX}"
+        response = send_to_serial(cmd)
+
+        if is_success_response(response):
+            return int(hex_to_string(response[2:-4].upper().split(FS)[0]))
+
+        raise Exception(f"Failed to get fiscal period information, response: {response}")
+    except Exception as e:
+        logger.error("Error: " + str(e))
+
+    return None
+
+
 def get_printer_status():
     try:
         code = "3F"
@@ -578,15 +691,15 @@ def cancel_document(reason="Completed operation"):
     try:
         code = "46"
         cmd = f"{STX}{code}{ETX}"
-        response = send_to_serial(cmd)
+        response = send_to_serial(cmd, nak_expected=True)
 
         if response == f"0707{ACK}":
-            logger.debug(f"Document canceled successfully, reason: {reason}")
+            logger.debug("Document canceled successfully, reason: %s", reason)
             return True
 
         # NAK response means no document to cancel (printer in standby) - this is OK
         if response == NAK:
-            logger.debug(f"No document to cancel (printer in standby)")
+            logger.debug("No document to cancel (printer in standby)")
             return True
 
         raise Exception(f"Failed to cancel document, response: {response}")
@@ -609,17 +722,18 @@ def prepare_document(fiscal_object):
         cmd = cmd[:-2]
         cmd += ETX
 
-        logger.debug(f"Document command: {cmd}")
+        logger.debug("Document command: %s", cmd)
 
         response = send_to_serial(cmd)
 
         if is_success_response(response):
             document_number = decode_document_number(response)
             logger.debug("Document prepared successfully")
-            logger.debug(f"Document number: {document_number}")
+            logger.debug("Document number: %s", document_number)
             return document_number
 
-        logger.debug(json.dumps(get_printer_state(), indent=4))
+        if debug_enabled():
+            logger.debug(json.dumps(get_printer_state(), indent=4))
 
 
         raise Exception(f"Failed to prepare document, response: {response}")
@@ -643,7 +757,7 @@ def add_item_to_document(item):
         cmd = cmd[:-2] + "1C321C32"
         cmd += ETX
 
-        logger.debug(f"Item command: {cmd}")
+        logger.debug("Item command: %s", cmd)
 
         response = send_to_serial(cmd)
 
@@ -655,7 +769,8 @@ def add_item_to_document(item):
             logger.debug("Item added to document successfully")
             return True
 
-        logger.debug(json.dumps(get_printer_state(), indent=4))
+        if debug_enabled():
+            logger.debug(json.dumps(get_printer_state(), indent=4))
 
         raise Exception(f"Failed to add item to document, response: {response}")
 
@@ -676,17 +791,18 @@ def document_sub_or_total(type):
     try:
         code = "42"
         cmd = f"{STX}{code}{FS}{type}{ETX}"
-        logger.debug(f"Document subtotal/total command: {cmd}")
+        logger.debug("Document subtotal/total command: %s", cmd)
 
         response = send_to_serial(cmd)
 
         if is_success_response(response):
             a = "subtotal" if type == "0" else "total"
-            logger.debug(f"Document {a} amount calculation updated successfully")
+            logger.debug("Document %s amount calculation updated successfully", a)
             totals = decode_sub_or_total_response(response)
             return totals  # document totals, subtotal, taxes, etc
 
-        logger.debug(json.dumps(get_printer_state(), indent=4))
+        if debug_enabled():
+            logger.debug(json.dumps(get_printer_state(), indent=4))
 
         raise Exception(f"Failed to update document subtotal, response: {response}")
 
@@ -710,8 +826,8 @@ def discount_surcharge_service(data):
         cmd = cmd[:-2]
         cmd += ETX
 
-        logger.info(f"Discount/surcharge/service data: {json.dumps(data, indent=2)}")
-        logger.debug(f"Discount/surcharge/service command: {cmd}")
+        logger.info("Discount/surcharge/service data: %s", lazy_json(data, indent=2))
+        logger.debug("Discount/surcharge/service command: %s", cmd)
 
         response = send_to_serial(cmd)
 
@@ -719,7 +835,8 @@ def discount_surcharge_service(data):
             logger.debug("Discount/surcharge/service added successfully")
             return response  # document subtotal after discount, etc
 
-        logger.debug(json.dumps(get_printer_state(), indent=4))
+        if debug_enabled():
+            logger.debug(json.dumps(get_printer_state(), indent=4))
 
         raise Exception(f"Failed to add discount/surcharge/service, response: {response}")
 
@@ -744,7 +861,7 @@ def payment(data):
         cmd = cmd[:-2]
         cmd += ETX
 
-        logger.debug(f"Payment method command: {cmd}")
+        logger.debug("Payment method command: %s", cmd)
 
         response = send_to_serial(cmd)
 
@@ -756,7 +873,8 @@ def payment(data):
             logger.debug("Payment method added successfully")
             return response  # amount left to pay, change
 
-        logger.debug(json.dumps(get_printer_state(), indent=4))
+        if debug_enabled():
+            logger.debug(json.dumps(get_printer_state(), indent=4))
 
         raise Exception(f"Failed to add payment method, response: {response}")
 
@@ -774,10 +892,10 @@ def close_document(reason="Completed operation"):
         code = "45"
         cmd = f"{STX}{code}{ETX}"
 
-        logger.debug(f"Close document command: {cmd}")
+        logger.debug("Close document command: %s", cmd)
 
         response = send_to_serial(cmd)
-        logger.debug(f"Close document response: {response}")
+        logger.debug("Close document response: %s", response)
 
         if is_success_response(response):
             """
@@ -785,16 +903,18 @@ def close_document(reason="Completed operation"):
             070707070702303034333732303030303030303033341c3331300306
             """
 
-            logger.debug(f"Document closed successfully, reason: {reason}")
+            logger.debug("Document closed successfully, reason: %s", reason)
             return response  # document number and total amount
         else:
             # get the printer state
-            logger.debug(json.dumps(get_printer_state(), indent=4))
+            if debug_enabled():
+                logger.debug(json.dumps(get_printer_state(), indent=4))
 
         if cancel_document(f"Document canceled due to an error in close document reason: {reason}"):
             logger.debug("Document canceled successfully due to a error in close document")
             close_document("Document canceled due to an error in close document")
 
+        serial_trace.auto_dump("close document failed")
         raise Exception(f"Failed to close document, response: {response}")
 
     except Exception as e:
@@ -816,21 +936,21 @@ def add_comment(comment):
         code = "4A"  # Command for comment line
         cmd = f"{STX}{code}{FS}{text_hex}{ETX}"
 
-        logger.debug(f"Adding comment: {comment}")
+        logger.debug("Adding comment: %s", comment)
 
         # Send the command to the printer
         response = send_to_serial(cmd)
 
         # Check for success (either full response or just ACK)
         if is_success_response(response) or response == ACK:
-            logger.debug(f"Comment added successfully")
+            logger.debug("Comment added successfully")
             return True
         else:
-            logger.error(f"Failed to add comment, response: {response}")
+            logger.error("Failed to add comment, response: %s", response)
             return False
 
     except Exception as e:
-        logger.error(f"Error while adding comment: {str(e)}")
+        logger.error("Error while adding comment: %s", e)
         return False
 
 
@@ -869,114 +989,223 @@ def split_comment_into_lines(comment, max_chars=48):
     return lines
 
 
-def print_document(items, payments, service_charge, tips, trans_num="", is_credit_note=False, discount=None, comment="", customer=None):
-    try:
-        config = load_config()
-        # page 30 of the protocol
-        # Use TransNum as POS reference if available
-        pos_reference = trans_num if trans_num else "1001"
-
-        # Use customer name and code if provided, otherwise use defaults
-        customer_name = config["miscellaneous"]["default_client_name"]
-        customer_crib = config["miscellaneous"]["default_client_crib"]
-        has_customer = False
-
-        if customer:
-            has_customer = True
-            if customer.get("name"):
-                customer_name = customer["name"]
-                logger.info(f"Using customer name: {customer_name}")
-            if customer.get("code"):
-                customer_crib = customer["code"]
-                logger.info(f"Using customer CRIB: {customer_crib}")
-
-        # Document type based on customer presence and credit note status:
-        # No customer: 1 = Invoice Final Consumer, 3 = Credit Note For Invoice Final Consumer
-        # With customer: 2 = Invoice Fiscal Credit, 4 = Credit Note For Invoice With Fiscal Value
-        if has_customer:
-            doc_type = "4" if is_credit_note else "2"
-        else:
-            doc_type = "3" if is_credit_note else "1"
+def build_document(items, payments, service_charge, tips, trans_num="", is_credit_note=False, discount=None, comment="", customer=None):
+    """
+    Prepares everything print_built_document() sends to the printer (document
+    type, header, items, comment lines) without touching the serial port, so
+    the next receipt can be built while the current one is printing.
+    """
+    config = config_service.get()
+    # page 30 of the protocol
+    # Use TransNum as POS reference if available
+    pos_reference = trans_num if trans_num else "1001"
+
+    # Use customer name and code if provided, otherwise use defaults
+    customer_name = config["miscellaneous"]["default_client_name"]
+    customer_crib = config["miscellaneous"]["default_client_crib"]
+    has_customer = False
+
+    if customer:
+        has_customer = True
+        if customer.get("name"):
+            customer_name = customer["name"]
+            logger.info("Using customer name: %s", customer_name)
+        if customer.get("code"):
+            customer_crib = customer["code"]
+            logger.info("Using customer CRIB: %s", customer_crib)
+
+    # Document type based on customer presence and credit note status:
+    # No customer: 1 = Invoice Final Consumer, 3 = Credit Note For Invoice Final Consumer
+    # With customer: 2 = Invoice Fiscal Credit, 4 = Credit Note For Invoice With Fiscal Value
+    if has_customer:
+        doc_type = "4" if is_credit_note else "2"
+    else:
+        doc_type = "3" if is_credit_note else "1"
+
+    if is_credit_note:
+        logger.info("Processing CREDIT NOTE (Type %s) - TransNum: %s", doc_type, trans_num)
+    else:
+        logger.info("Processing INVOICE (Type %s) - TransNum: %s", doc_type, trans_num)
+
+    fiscal_object = {
+        "type": doc_type,  # "1" for sale, "3" for return/credit note
+        "branch": "9001",
+        "POS": pos_reference,  # TCPOS Transaction Number
+        "customer_name": customer_name,
+        "customer_CRIB": customer_crib,
+        "NKF": config["client"]["NKF"],
+        "NKF_affected": config["client"]["NKF"],
+    }
+
+    # page 32 of the protocol
+    """
 
-        if is_credit_note:
-            logger.info(f"Processing CREDIT NOTE (Type {doc_type}) - TransNum: {trans_num}")
-        else:
-            logger.info(f"Processing INVOICE (Type {doc_type}) - TransNum: {trans_num}")
-
-        fiscal_object = {
-            "type": doc_type,  # "1" for sale, "3" for return/credit note
-            "branch": "9001",
-            "POS": pos_reference,  # TCPOS Transaction Number
-            "customer_name": customer_name,
-            "customer_CRIB": customer_crib,
-            "NKF": config["client"]["NKF"],
-            "NKF_affected": config["client"]["NKF"],
+        {
+            "type": "00",
+            "extra_description_1": "",
+            "extra_description_2": "",
+            "item_description": "c",
+            "product_code": "123",
+            "quantity": "800",
+            "unit_price": "155",
+            "tax": "1",  # tax id
+            "discount_type": "1",
+            "discount_amount": "100",
+            "discount_percent": "01050",  # 10.50%
+        }
+    """
+    items_list = [
+        {
+            "type": "01",
+            "extra_description_1": "",
+            "extra_description_2": "",
+            "item_description": "a",
+            "product_code": "123",
+            "quantity": "2000",  # 2.000
+            "unit_price": "155",  # 1.55
+            "unit": "Units",  # Units Kilos Grams Pounds Boxes
+            "tax": "1",  # tax id
+            "discount_type": "0",
+            "discount_amount": "000",
+            "discount_percent": "000",  # 10.50%
         }
+    ]
+
+    for item in items:
+        # Use space as product code to hide article number on printout
+        item['product_code'] = " "
+
+    comments = []
+    # Add TCPOS check number as a comment line before closing
+    if trans_num:
+        comments.append(f"TCPOS Check #{trans_num}")
+
+    # Add multi-line comment from transaction if present
+    if comment:
+        comments.append("------------------------------------------------")
+        comments.extend(split_comment_into_lines(comment, max_chars=48))
+        comments.append("------------------------------------------------")
+
+    return {
+        "trans_num": trans_num,
+        "doc_type": doc_type,
+        "fiscal_object": fiscal_object,
+        "has_customer": has_customer,
+        "items": items,
+        "service_charge": service_charge,
+        "discount": discount,
+        "payments": payments,
+        "tips": tips,
+        "comments": comments,
+    }
+
+
+# document types that return money: 3 and 4, see build_document
+credit_note_types = ("3", "4")
+
+
+def receipt_summary(doc_type, totals, paid):
+    """
+    What a printed receipt adds to the fiscal day, for the sales rollups:
+    document type, total, sales and tax per printer tax id (as calculated by
+    the printer) and amount per payment method. paid holds (type, method,
+    amount) of the payments and tips. None when the totals could not be decoded.
+    """
+    if totals is None:
+        return None
 
-        # page 32 of the protocol
-        """
+    method_names = {code: name for name, code in payment_methods.items()}
+    payments = {}
+    for payment_type, method, amount in paid:
+        value = string_number_to_number(amount, decimals=2)
+        if payment_type != payment_types["pay/donation"]:
+            value = -value
+        name = method_names.get(method, method)
+        payments[name] = round(payments.get(name, 0) + value, 2)
+
+    taxes = {}
+    for tax_id in range(1, 11):
+        sales, tax = totals[f"total_sale_tax_{tax_id}"], totals[f"total_tax_{tax_id}"]
+        if sales or tax:
+            taxes[str(tax_id)] = {"sales": sales, "tax": tax}
+
+    return {
+        "doc_type": doc_type,
+        "is_credit_note": doc_type in credit_note_types,
+        "total": totals["document_total"],
+        "exempt": totals["total_exempt"],
+        "taxes": taxes,
+        "payments": payments,
+    }
+
+
+def print_built_document(document, on_opened=None):
+    """
+    Sends a document prepared by build_document() to the printer.
+    on_opened(document_number) is called as soon as the printer opened the
+    document, before any item is sent. The document is not changed, a spooled
+    one can be sent again.
+    """
+    with serial_lock:
+        return _print_built_document(copy.deepcopy(document), on_opened)
 
-            {
-                "type": "00",
-                "extra_description_1": "",
-                "extra_description_2": "",
-                "item_description": "c",
-                "product_code": "123",
-                "quantity": "800",
-                "unit_price": "155",
-                "tax": "1",  # tax id
-                "discount_type": "1",
-                "discount_amount": "100",
-                "discount_percent": "01050",  # 10.50%
-            }
-        """
-        items_list = [
-            {
-                "type": "01",
-                "extra_description_1": "",
-                "extra_description_2": "",
-                "item_description": "a",
-                "product_code": "123",
-                "quantity": "2000",  # 2.000
-                "unit_price": "155",  # 1.55
-                "unit": "Units",  # Units Kilos Grams Pounds Boxes
-                "tax": "1",  # tax id
-                "discount_type": "0",
-                "discount_amount": "000",
-                "discount_percent": "000",  # 10.50%
-            }
-        ]
 
+def _print_built_document(document, on_opened):
+    # serial time per command group, returned with the result
+    timings = {}
+    marks = [time.perf_counter()]
+
+    def lap(group):
+        marks.append(time.perf_counter())
+        timings[group] = marks[-1] - marks[-2]
+
+    def check_online(step):
+        # every further command would wait serial_timeout for an offline printer
+        if serial_error:
+            raise Exception(f"Printer unavailable at {step}: {serial_error}")
+
+    # payment() hex-encodes its fields in place, keep the plain values for the summary
+    paid = [(pay["type"], pay["method"], pay["amount"]) for pay in document["payments"] + document["tips"]]
+
+    try:
         # cancel any document before printing a new one
-        cancel_document()
+        if not cancel_document():
+            check_online("cancel")
 
         # time.sleep(1)
 
         if 1:
-            document_number = prepare_document(fiscal_object)
+            document_number = prepare_document(document["fiscal_object"])
             # logger.debug(f"Document number: {document_number}")
+            if not document_number:
+                check_online("open")
+                raise Exception("Failed to open document")
+            if on_opened:
+                on_opened(document_number)
+            lap("serial_open")
 
         # Add separator line after customer details (header) and before items
-        if has_customer:
+        if document["has_customer"]:
             add_comment("------------------------------------------------")
 
         # time.sleep(1)
 
-        for item in items:
-            # Use space as product code to hide article number on printout
-            item['product_code'] = " "
+        for item in document["items"]:
             add_item_to_document(item)
+            check_online("items")
+        lap("serial_items")
 
         # time.sleep(1)
 
-        if service_charge:
+        if document["service_charge"]:
             data = {
                 "type": "0",
                 "description": "Discount",
                 "amount": "000",
                 "percent": "1000",
             }
-            discount_surcharge_service(service_charge)
+            discount_surcharge_service(document["service_charge"])
+            check_online("service charge")
 
             """
             02431c301c446973636f756e741c3030301c3130303003
@@ -989,17 +1218,21 @@ def print_document(items, payments, service_charge, tips, trans_num="", is_credi
         # Calculate SUBTOTAL first
         if 1:
             subtotal = document_sub_or_total(string_to_hex("0"))
+            check_online("subtotal")
 
         # Apply discount at SUBTOTAL level (after items, before total)
+        discount = document["discount"]
         if discount:
             discount_surcharge_service(discount)
-            logger.info(f"Applied transaction discount: {discount['description']} - {discount['amount']}")
+            logger.info("Applied transaction discount: %s - %s", discount['description'], discount['amount'])
         else:
             logger.debug("No transaction discount to apply")
 
         # Now calculate TOTAL (after discount)
         if 1:
             total = document_sub_or_total(string_to_hex("1"))
+            check_online("total")
+        lap("serial_totals")
 
         # time.sleep(1)
 
@@ -1015,8 +1248,9 @@ def print_document(items, payments, service_charge, tips, trans_num="", is_credi
             02441C311C30331C50617964656269741C3230303003
             """
 
-            for pay in payments:
+            for pay in document["payments"]:
                 payment(pay)
+                check_online("payments")
 
         # time.sleep(1)
 
@@ -1030,33 +1264,47 @@ def print_document(items, payments, service_charge, tips, trans_num="", is_credi
             payment(tip)
 
         if 1:
-            for tip in tips:
+            for tip in document["tips"]:
                 payment(tip)
+                check_online("tips")
+        lap("serial_payments")
 
         # time.sleep(1)
 
-        # Add TCPOS check number as a comment line before closing
-        if trans_num:
-            add_comment(f"TCPOS Check #{trans_num}")
-
-        # Add multi-line comment from transaction if present
-        if comment:
-            add_comment("------------------------------------------------")
-            comment_lines = split_comment_into_lines(comment, max_chars=48)
-            for line in comment_lines:
-                add_comment(line)
-            add_comment("------------------------------------------------")
+        # TCPOS check number and transaction comment before closing
+        for line in document["comments"]:
+            add_comment(line)
+            check_online("comments")
+        lap("serial_comments")
 
         if 1:
-            close_document()
+            if close_document() is None:
+                raise Exception("Failed to close document")
+        lap("serial_close")
+        timings["serial_total"] = marks[-1] - marks[0]
 
         # time.sleep(1)
 
+        return {
+            "success": True,
+            "document_number": document_number,
+            "timings": timings,
+            "summary": receipt_summary(document["doc_type"], total, paid),
+        }
 
     except Exception as e:
         logger.error("Error while printing document: " + str(e))
+        return {"success": False, "error": str(e)}
 
-    return None
+
+def print_document(items, payments, service_charge, tips, trans_num="", is_credit_note=False, discount=None, comment="", customer=None):
+    try:
+        document = build_document(items, payments, service_charge, tips, trans_num, is_credit_note, discount, comment, customer)
+    except Exception as e:
+        logger.error("Error while building document: " + str(e))
+        return {"success": False, "error": str(e)}
+
+    return print_built_document(document)
 
 
 def print_x_report():
@@ -1111,7 +1359,12 @@ def print_z_report(close_fiscal_day=False):
 
         if is_success_response(response):
             logger.info(f"Z Report printed successfully ({action})")
-            return {"success": True}
+            # output field 1: number of the Z report just closed
+            try:
+                report_number = int(hex_to_string(response[2:-4].upper().split(FS)[0]))
+            except ValueError:
+                report_number = None
+            return {"success": True, "report_number": report_number}
         else:
             # Provide helpful error message
             error_msg = "Failed to print Z Report"
@@ -1124,7 +1377,7 @@ def print_z_report(close_fiscal_day=False):
         return {"success": False, "error": str(e)}
 
 
-def print_z_report_by_date(start_date, end_date=None):
+def print_z_report_by_date(start_date, end_date=None, progress=None, cancel=None):
     """Print Z Reports for a date range
 
     Note: This function uses the combined Z reports protocol (0x74)
@@ -1133,10 +1386,20 @@ def print_z_report_by_date(start_date, end_date=None):
     Args:
         start_date: Start date for the range (datetime.date object)
         end_date: End date for the range (defaults to today if not provided)
+        progress: Optional progress(reports_done, reports_expected) callback;
+            one report per day in the range is expected
+        cancel: Optional threading.Event; when set, the sequence is ended with 0x77
+            before the next report
 
     Returns:
         dict: Response with success status, message, and report count
     """
+    # the whole 0x74/0x76/0x77 sequence is one conversation, receipts wait for it
+    with serial_lock:
+        return _print_z_report_by_date(start_date, end_date, progress, cancel)
+
+
+def _print_z_report_by_date(start_date, end_date, progress, cancel):
     try:
         if end_date is None:
             end_date = datetime.date.today()
@@ -1162,10 +1425,17 @@ def print_z_report_by_date(start_date, end_date=None):
             return {"success": False, "error": f"Failed to initialize Z reports by date. The printer may not have Z reports for this date range, or the dates may be invalid."}
 
         reports_count = 0
+        expected_count = (end_date - start_date).days + 1
+        cancelled = False
         while True:
+            if cancel is not None and cancel.is_set():
+                cancelled = True
+                logger.info(f"Z reports by date cancelled after {reports_count} report(s)")
+                break
+
             get_code = "76"  # get_next_z_report command
             get_cmd = f"{STX}{get_code}{ETX}"
-            report_response = send_to_serial(get_cmd)
+            report_response = send_to_serial(get_cmd, nak_expected=True)
 
             if report_response and report_response.endswith(NAK):
                 logger.info(f"Retrieved {reports_count} Z report(s)")
@@ -1173,6 +1443,8 @@ def print_z_report_by_date(start_date, end_date=None):
 
             if is_success_response(report_response):
                 reports_count += 1
+                if progress is not None:
+                    progress(reports_count, max(expected_count, reports_count))
             else:
                 logger.warning("Failed to get next Z report")
                 break
@@ -1184,6 +1456,14 @@ def print_z_report_by_date(start_date, end_date=None):
         if is_success_response(end_response):
             logger.info("Combined Z reports completed")
 
+        if cancelled:
+            return {
+                "success": False,
+                "cancelled": True,
+                "error": f"Cancelled after {reports_count} Z report(s)",
+                "reports_count": reports_count
+            }
+
         if reports_count > 0:
             message = f"Printed {reports_count} Z report(s) from {start_date_str} to {end_date_str}"
             logger.info(message)
@@ -1230,7 +1510,7 @@ def print_z_report_by_number(report_number):
 
         get_code = "76"  # get_next_z_report command
         get_cmd = f"{STX}{get_code}{ETX}"
-        report_response = send_to_serial(get_cmd)
+        report_response = send_to_serial(get_cmd, nak_expected=True)
 
         end_code = "77"  # z_reports_end command
         end_cmd = f"{STX}{end_code}{ETX}"
@@ -1256,16 +1536,25 @@ def print_z_report_by_number(report_number):
         return {"success": False, "error": str(e)}
 
 
-def print_z_report_by_number_range(start_number, end_number):
+def print_z_report_by_number_range(start_number, end_number, progress=None, cancel=None):
     """Print Z Reports by sequential number range
 
     Args:
         start_number: The starting sequential Z report number
         end_number: The ending sequential Z report number
+        progress: Optional progress(reports_done, reports_expected) callback
+        cancel: Optional threading.Event; when set, the sequence is ended with 0x77
+            before the next report
 
     Returns:
         dict: Response with success status and message
     """
+    # the whole 0x75/0x76/0x77 sequence is one conversation, receipts wait for it
+    with serial_lock:
+        return _print_z_report_by_number_range(start_number, end_number, progress, cancel)
+
+
+def _print_z_report_by_number_range(start_number, end_number, progress, cancel):
     try:
         logger.info(f"Generating Z Reports by number range: {start_number} to {end_number}")
 
@@ -1288,8 +1577,14 @@ def print_z_report_by_number_range(start_number, end_number):
         reports_printed = 0
         expected_count = end_number - start_number + 1
 
+        cancelled = False
         for i in range(expected_count):
-            report_response = send_to_serial(get_cmd)
+            if cancel is not None and cancel.is_set():
+                cancelled = True
+                logger.info(f"Z reports by number range cancelled after {reports_printed} report(s)")
+                break
+
+            report_response = send_to_serial(get_cmd, nak_expected=True)
 
             if report_response and report_response.endswith(NAK):
                 logger.warning(f"Z report not found at position {i+1}")
@@ -1298,6 +1593,8 @@ def print_z_report_by_number_range(start_number, end_number):
             if is_success_response(report_response):
                 reports_printed += 1
                 logger.info(f"Z report {i+1}/{expected_count} printed")
+                if progress is not None:
+                    progress(reports_printed, expected_count)
             else:
                 logger.warning(f"Failed to print Z report at position {i+1}")
                 break
@@ -1307,6 +1604,14 @@ def print_z_report_by_number_range(start_number, end_number):
         end_cmd = f"{STX}{end_code}{ETX}"
         send_to_serial(end_cmd)
 
+        if cancelled:
+            return {
+                "success": False,
+                "cancelled": True,
+                "error": f"Cancelled after {reports_printed} Z report(s)",
+                "reports_printed": reports_printed
+            }
+
         if reports_printed > 0:
             logger.info(f"{reports_printed} Z reports printed successfully")
             return {
@@ -1325,6 +1630,125 @@ def print_z_report_by_number_range(start_number, end_number):
         return {"success": False, "error": str(e)}
 
 
+def read_z_reports(start_number, end_number, progress=None, cancel=None):
+    """Read Z Reports from the fiscal memory without printing them
+
+    Uses the memory audit commands: 0xA0 selects the range, 0xA2 returns
+    the next Z report and 0xA7 ends the read.
+
+    Args:
+        start_number: The starting sequential Z report number
+        end_number: The ending sequential Z report number
+        progress: Optional progress(reports_done, reports_expected) callback
+        cancel: Optional threading.Event; when set, the read is ended with 0xA7
+            before the next report
+
+    Returns:
+        dict: Response with success status and the decoded reports
+    """
+    # the whole 0xA0/0xA2/0xA7 sequence is one conversation, receipts wait for it
+    with serial_lock:
+        return _read_z_reports(start_number, end_number, progress, cancel)
+
+
+def _read_z_reports(start_number, end_number, progress, cancel):
+    try:
+        logger.info(f"Reading Z Reports from fiscal memory: {start_number} to {end_number}")
+
+        start_hex = string_to_hex(str(start_number).zfill(4))
+        end_hex = string_to_hex(str(end_number).zfill(4))
+
+        code = "A0"  # read_fiscal_memory_by_number command
+        cmd = f"{STX}{code}{FS}{start_hex}{FS}{end_hex}{ETX}"
+        response = send_to_serial(cmd)
+
+        if not is_success_response(response):
+            logger.warning(f"No Z reports in fiscal memory for range {start_number} to {end_number}")
+            return {"success": False, "error": "No Z reports found in the specified range"}
+
+        get_code = "A2"  # read_next_z_report command
+        get_cmd = f"{STX}{get_code}{ETX}"
+
+        reports = []
+        expected_count = end_number - start_number + 1
+
+        cancelled = False
+        for i in range(expected_count):
+            if cancel is not None and cancel.is_set():
+                cancelled = True
+                logger.info(f"Z report read cancelled after {len(reports)} report(s)")
+                break
+
+            report_response = send_to_serial(get_cmd, nak_expected=True)
+
+            if report_response and report_response.endswith(NAK):
+                break
+
+            z_report = decode_z_report(report_response) if is_success_response(report_response) else None
+            if z_report is None:
+                logger.warning(f"Failed to read Z report at position {i+1}")
+                break
+
+            reports.append(z_report)
+            if progress is not None:
+                progress(len(reports), expected_count)
+
+        end_code = "A7"  # read_memory_end command
+        end_cmd = f"{STX}{end_code}{ETX}"
+        send_to_serial(end_cmd)
+
+        if cancelled:
+            return {
+                "success": False,
+                "cancelled": True,
+                "error": f"Cancelled after {len(reports)} Z report(s)",
+                "reports": reports
+            }
+
+        if reports:
+            logger.info(f"Read {len(reports)} Z report(s) from fiscal memory")
+            return {"success": True, "reports": reports}
+        else:
+            logger.warning("No Z reports found in the specified range")
+            return {"success": False, "error": "No Z reports found in the specified range"}
+
+    except Exception as e:
+        logger.error(f"Error reading Z Reports: {e}")
+        return {"success": False, "error": str(e)}
+
+
+def search_document(document_number, doc_type):
+    """
+    Looks a closed document up in the transaction memory without printing
+    (0xA8 mode '0' - no copy).
+    Returns True when found, False when the printer answers NAK (not found)
+    and None when the printer could not be asked.
+    """
+    try:
+        code = "A8"
+        mode_hex = string_to_hex("0")
+        doc_type_hex = string_to_hex(f"{int(doc_type):02d}")
+        doc_num_hex = string_to_hex(str(document_number))
+        cmd = f"{STX}{code}{FS}{mode_hex}{FS}{doc_type_hex}{FS}{doc_num_hex}{ETX}"
+
+        response = send_to_serial(cmd, nak_expected=True)
+
+        if is_success_response(response):
+            logger.debug(f"Document {document_number} (type {doc_type}) found in transaction memory")
+            return True
+
+        if response and response.endswith(NAK):
+            logger.debug(f"Document {document_number} (type {doc_type}) not found")
+            return False
+
+        raise Exception(f"Failed to search document, response: {response}")
+
+    except Exception as e:
+        logger.error(f"Error searching document: {e}")
+
+    return None
+
+
 def reprint_document(document_number):
     """Re-print a document/ticket (NO SALE - copy only)
 
@@ -1360,7 +1784,7 @@ def reprint_document(document_number):
             logger.debug(f"Trying document type {doc_type}:")
             logger.debug(f"  Full command: {cmd}")
 
-            response = send_to_serial(cmd)
+            response = send_to_serial(cmd, nak_expected=True)
 
             if response and not response.endswith(NAK):
                 # Found it!
@@ -1388,6 +1812,177 @@ def reprint_document(document_number):
 #*END COMMANDS SECTION
 
 
+def log_fiscal_information(fiscal_information):
+    """
+    Logs the fiscal information and alerts about fields that were never configured.
+    """
+    # check if the printer was configured
+    # if CRIB doesn't starts with ?
+    if fiscal_information['CRIB'].startswith("?"):
+        logger.error("ALERT: Printer CRIB is not configured")
+    else:
+        logger.info(f"CRIB: {fiscal_information['CRIB']}")
+
+    if fiscal_information['business_name'].startswith("?"):
+        logger.error("ALERT: Printer business name is not configured")
+    else:
+        logger.info(f"Business name: {fiscal_information['business_name']}")
+
+    if fiscal_information['phone_number'].startswith("?"):
+        logger.error("ALERT: Printer phone number is not configured")
+    else:
+        logger.info(f"Phone number: {fiscal_information['phone_number']}")
+
+    if fiscal_information['address1'].startswith("?"):
+        logger.error("ALERT: Printer address1 is not configured")
+    else:
+        logger.info(f"Address: {fiscal_information['address1']}")
+
+    if fiscal_information['address2'].startswith("?"):
+        logger.error("ALERT: Printer address2 is not configured")
+    else:
+        logger.info(f"Address: {fiscal_information['address2']}")
+
+    logger.info("TAX settings:")
+    logger.info(f"    Tax 1: {fiscal_information['tax1']}")
+    logger.info(f"    Tax 2: {fiscal_information['tax2']}")
+    logger.info(f"    Tax 3: {fiscal_information['tax3']}")
+    logger.info(f"    Tax 4: {fiscal_information['tax4']}")
+    logger.info(f"    Tax 5: {fiscal_information['tax5']}")
+    logger.info(f"    Tax 6: {fiscal_information['tax6']}")
+    logger.info(f"    Tax 7: {fiscal_information['tax7']}")
+    logger.info(f"    Tax 8: {fiscal_information['tax8']}")
+    logger.info(f"    Tax 9: {fiscal_information['tax9']}")
+    logger.info(f"    Tax 10: {fiscal_information['tax10']}")
+
+    """
+    CRIB: 102314329
+    Business name:                     Kome BV
+    Phone number: 4650413
+    4.
+    Address: Johan van Walbeeckplein 6
+    Address:
+    TAX settings:
+        Tax 1: 6.0
+        Tax 2: 7.0
+        Tax 3: 9.0
+        Tax 4: 0.0
+        Tax 5: 0.0
+        Tax 6: 0.0
+        Tax 7: 0.0
+        Tax 8: 0.0
+        Tax 9: 0.0
+        Tax 10: 0.0
+
+    """
+
+
+def tax_ids_from_fiscal_information(fiscal_information):
+    """
+    Maps the configured tax rates to the printer tax ids, {"6": "1", "7": "2", "9": "3"}.
+    Unused (0%) slots are left out; a rate configured twice keeps its first id.
+    """
+    mapping = {}
+    for tax_id in range(1, 11):
+        rate = fiscal_information.get(f"tax{tax_id}")
+        if rate:
+            mapping.setdefault(f"{rate:g}", str(tax_id))
+    return mapping
+
+
+def apply_fiscal_information(information):
+    """
+    Makes the fiscal information current and feeds its tax rates to tax_ids.
+    """
+    global fiscal_information, tax_ids
+    fiscal_information = information
+
+    mapping = tax_ids_from_fiscal_information(information)
+    if not mapping:
+        logger.warning("No tax rates configured in the printer, keeping the default tax mapping")
+        return
+
+    # replaced as a whole, never changed in place: a parse running meanwhile keeps a complete mapping
+    tax_ids = mapping
+
+
+def load_fiscal_information_cache():
+    """
+    Returns the cache entry, {"fingerprint", "updated_at", "fiscal_information"},
+    when it belongs to the connected printer.
+    """
+    try:
+        with open(fiscal_info_cache_path, encoding="utf-8") as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+
+    if cache.get("fingerprint") != printer_fingerprint:
+        logger.info("Fiscal information cache belongs to another printer, ignoring it")
+        return None
+
+    return cache if cache.get("fiscal_information") else None
+
+
+def save_fiscal_information_cache(information):
+    cache = {
+        "fingerprint": printer_fingerprint,
+        "updated_at": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "fiscal_information": information,
+    }
+    with open(fiscal_info_cache_path + ".tmp", "w", encoding="utf-8") as cache_file:
+        json.dump(cache, cache_file, indent=2)
+    os.replace(fiscal_info_cache_path + ".tmp", fiscal_info_cache_path)
+
+
+def refresh_fiscal_information():
+    """
+    Reads the fiscal information from the printer and updates the cache.
+    Runs in the background; serial access is serialized by serial_lock, so it
+    simply queues between receipts.
+    """
+    try:
+        information = get_fiscal_information()
+        if not information:
+            return None
+
+        if information != fiscal_information:
+            log_fiscal_information(information)
+            apply_fiscal_information(information)
+            save_fiscal_information_cache(information)
+            logger.info(f"Printer tax mapping: {tax_ids}")
+        else:
+            logger.debug("Fiscal information unchanged")
+
+        return information
+
+    except Exception as e:
+        logger.error(f"Error refreshing fiscal information: {e}")
+        return None
+
+
+def cache_age(cache):
+    """
+    Seconds since the fiscal information cache was written, infinite when unknown.
+    """
+    try:
+        updated_at = datetime.datetime.strptime(cache["updated_at"], '%Y-%m-%d %H:%M:%S')
+    except (KeyError, TypeError, ValueError):
+        return float("inf")
+    return (datetime.datetime.now() - updated_at).total_seconds()
+
+
+def log_printer_diagnostics():
+    try:
+        logger.info("Printer state:")
+        logger.info(json.dumps(get_printer_state(), indent=4))
+
+        logger.info("Printer status:")
+        logger.info(json.dumps(get_printer_status(), indent=4))
+    except Exception as e:
+        logger.error(f"Error reading printer diagnostics: {e}")
+
+
 def cts310ii_main():
     spotted = spot_printer()
     if not spotted:
@@ -1398,15 +1993,9 @@ def cts310ii_main():
         print_document(1)
 
     if 1 and not DEBUG:
-        # get printer state
-        logger.info("Printer state:")
-        logger.info(json.dumps(get_printer_state(), indent=4))
-
-
-    if 1 and not DEBUG:
-        printer_status = get_printer_status()
-        logger.info("Printer status:")
-        logger.info(json.dumps(printer_status, indent=4))
+        # state and status are only logged: they queue on serial_lock behind the
+        # startup commands and the first receipts instead of delaying printer_ready
+        threading.Thread(target=log_printer_diagnostics, name="printer-diagnostics", daemon=True).start()
 
 
     if 1 and not DEBUG:
@@ -1427,76 +2016,21 @@ def cts310ii_main():
 
 
     if 1 and not DEBUG:
-        fiscal_information = get_fiscal_information()
-
-        if fiscal_information:
-            # check if the printer was configured
-            # if CRIB doesn't starts with ?
-            if fiscal_information['CRIB'].startswith("?"):
-                logger.error("ALERT: Printer CRIB is not configured")
-            else:
-                logger.info(f"CRIB: {fiscal_information['CRIB']}")
-
-            if fiscal_information['business_name'].startswith("?"):
-                logger.error("ALERT: Printer business name is not configured")
-            else:
-                logger.info(f"Business name: {fiscal_information['business_name']}")
-
-            if fiscal_information['phone_number'].startswith("?"):
-                logger.error("ALERT: Printer phone number is not configured")
-            else:
-                logger.info(f"Phone number: {fiscal_information['phone_number']}")
-
-            if fiscal_information['address1'].startswith("?"):
-                logger.error("ALERT: Printer address1 is not configured")
-            else:
-                logger.info(f"Address: {fiscal_information['address1']}")
-
-            if fiscal_information['address2'].startswith("?"):
-                logger.error("ALERT: Printer address2 is not configured")
-            else:
-                logger.info(f"Address: {fiscal_information['address2']}")
-
-            logger.info("TAX settings:")
-            logger.info(f"    Tax 1: {fiscal_information['tax1']}")
-            logger.info(f"    Tax 2: {fiscal_information['tax2']}")
-            logger.info(f"    Tax 3: {fiscal_information['tax3']}")
-            logger.info(f"    Tax 4: {fiscal_information['tax4']}")
-            logger.info(f"    Tax 5: {fiscal_information['tax5']}")
-            logger.info(f"    Tax 6: {fiscal_information['tax6']}")
-            logger.info(f"    Tax 7: {fiscal_information['tax7']}")
-            logger.info(f"    Tax 8: {fiscal_information['tax8']}")
-            logger.info(f"    Tax 9: {fiscal_information['tax9']}")
-            logger.info(f"    Tax 10: {fiscal_information['tax10']}")
-
-            """
-            CRIB: 102314329
-            Business name:                     Kome BV
-            Phone number: 4650413
-            4.
-            Address: Johan van Walbeeckplein 6
-            Address:
-            TAX settings:
-                Tax 1: 6.0
-                Tax 2: 7.0
-                Tax 3: 9.0
-                Tax 4: 0.0
-                Tax 5: 0.0
-                Tax 6: 0.0
-                Tax 7: 0.0
-                Tax 8: 0.0
-                Tax 9: 0.0
-                Tax 10: 0.0
-
-            """
+        # static data (CRIB, business name, tax rates) never changes on its own: it is
+        # cached per device and refreshed in the background instead of asked here
+        cache = load_fiscal_information_cache()
+        if cache:
+            cached = cache["fiscal_information"]
+            apply_fiscal_information(cached)
+            logger.info(f"Fiscal information loaded from cache (CRIB {cached['CRIB']})")
+            if cache_age(cache) > fiscal_info_max_age:
+                threading.Thread(target=refresh_fiscal_information, name="fiscal-info-refresh", daemon=True).start()
+        else:
+            # receipts are parsed once the printer is ready, with its tax rates
+            refresh_fiscal_information()
 
     return True
 
 
-
-
-
-
-
-
-
+# Printer driver interface, see registry.py
+connect = cts310ii_main
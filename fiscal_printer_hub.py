@@ -6,27 +6,39 @@ if sys.version_info[:2] != (3, 13):
     print(f"ERROR: This application requires Python 3.13")
     print(f"Current version: Python {sys.version_info.major}.{sys.version_info.minor}")
     print(f"\nPlease run with: py -3.13 fiscal_printer_hub.py")
-    input("Press Enter to exit...")
+    if sys.stdin and sys.stdin.isatty():
+        input("Press Enter to exit...")
     sys.exit(1)
 
 import threading
+import signal
 import time
-import json
+import datetime
 import queue
-from logger_module import logger
-from pystray import Menu as menu, MenuItem as item
-import pystray
-from PIL import Image, ImageDraw
+from logger_module import logger, stop_logging
+import config_service
+import registry
 
-# Queue for main thread communication
-modal_queue = queue.Queue()
+startup_started = time.perf_counter()
+startup_timings = {}  # phase: seconds since start
 
-# Pre-import webview at startup for faster modal opening
-try:
-    import webview
-    logger.info("Webview module pre-loaded for faster UI")
-except Exception as e:
-    logger.warning(f"Could not pre-load webview module: {e}")
+# --headless (or "headless": true in the miscellaneous config section) runs only
+# the config, watcher, parser and printer pipeline: no tray icon, no webview
+headless = "--headless" in sys.argv[1:]
+shutdown_timeout = 30  # seconds to let a receipt being printed finish on shutdown
+
+# Messages for the main thread: (kind, payload). pywebview needs the main
+# thread, so while Fiscal Tools is open the queue waits until its window
+# closes; close_ui() ends the window for a shutdown.
+main_queue = queue.Queue()
+
+OPEN_UI = 'open_ui'
+SHUTDOWN = 'shutdown'
+RELOAD_CONFIG = 'reload_config'
+RUN_REPORT = 'run_report'
+
+ui_window = None  # open Fiscal Tools window
+tray_icon = None
 
 
 if getattr(sys, 'frozen', False):
@@ -38,133 +50,289 @@ else:
     base_dir = resource_dir
 
 
-def load_config():
-    with open(os.path.join(base_dir, 'config.json')) as json_file:
-        return json.load(json_file)
+def startup_phase(name):
+    """Records and logs the time from start until a startup phase is ready"""
+    startup_timings[name] = time.perf_counter() - startup_started
+    logger.info(f"Startup: {name} ready after {startup_timings[name] * 1000:.0f} ms")
+
+
+def post(kind, payload=None):
+    """Sends a message to the main thread, or starts a worker for background_handlers"""
+    if kind in background_handlers:
+        threading.Thread(target=handle, args=(kind, payload), name=f"hub-{kind}", daemon=True).start()
+        return
+    main_queue.put((kind, payload))
+
+
+def close_ui():
+    """Closes the Fiscal Tools window, which hands the main thread back to the dispatcher"""
+    if ui_window is not None:
+        try:
+            ui_window.destroy()
+        except Exception as e:
+            logger.warning(f"Could not close Fiscal Tools window: {e}")
 
 
 def close_app():
-    os._exit(0)
+    """Handler for Quit menu item"""
+    # the main thread is inside webview.start while the window is open
+    close_ui()
+    post(SHUTDOWN)
 
 
 def print_x_report_menu():
     """Handler for Print X-Report menu item"""
-    try:
-        logger.info("X-Report triggered from tray menu")
-        import cts310ii
-        result = cts310ii.print_x_report()
-        if result.get("success"):
-            logger.info("X-Report printed successfully from tray menu")
-        else:
-            logger.warning(f"X-Report failed from tray menu: {result.get('error')}")
-    except Exception as e:
-        logger.error(f"Error printing X-Report from tray menu: {e}")
+    logger.info("X-Report triggered from tray menu")
+    post(RUN_REPORT, {"report": "x"})
 
 
 def print_z_report_menu():
     """Handler for Print Z-Report menu item"""
+    logger.info("Z-Report triggered from tray menu")
+    post(RUN_REPORT, {"report": "z"})
+
+
+def reload_config_menu():
+    """Handler for Reload Config menu item"""
+    post(RELOAD_CONFIG)
+
+
+def dump_serial_trace_menu():
+    """Handler for Dump Serial Trace menu item"""
     try:
-        logger.info("Z-Report triggered from tray menu")
-        import cts310ii
-        result = cts310ii.print_z_report(close_fiscal_day=True)
-        if result.get("success"):
-            logger.info("Z-Report printed successfully from tray menu")
-        else:
-            logger.warning(f"Z-Report failed from tray menu: {result.get('error')}")
+        import serial_trace
+        path = serial_trace.dump("requested from tray menu")
+        logger.info(f"Serial trace dumped from tray menu: {path}")
     except Exception as e:
-        logger.error(f"Error printing Z-Report from tray menu: {e}")
+        logger.error(f"Error dumping serial trace from tray menu: {e}")
 
 
 def open_fiscal_tools():
     """Handler for Fiscal Tools menu item - signals main thread to open pywebview modal"""
+    logger.info("Fiscal Tools requested - signaling main thread")
+    post(OPEN_UI)
+
+
+def run_tray():
+    """Builds and runs the tray icon; pystray and PIL are only loaded here"""
+    from pystray import Menu as menu, MenuItem as item
+    import pystray
+    from PIL import Image
+
+    icon_menu = menu(
+        item('TCpos/BABPrintHub', None, enabled=False),
+        menu.SEPARATOR,
+        item('Fiscal Tools', open_fiscal_tools),
+        menu.SEPARATOR,
+        item('Print X-Report', print_x_report_menu),
+        item('Print Z-Report', print_z_report_menu),
+        menu.SEPARATOR,
+        item('Dump Serial Trace', dump_serial_trace_menu),
+        item('Reload Config', reload_config_menu),
+        menu.SEPARATOR,
+        item('Quit BAB PrintHub', close_app)
+    )
+
+    global tray_icon
+    tray_icon = pystray.Icon(
+        name='BAB PrintHub',
+        icon=Image.open(os.path.join(resource_dir, 'logo.png')),
+        title='BAB PrintHub',
+        menu=icon_menu
+    )
+
+    startup_phase("tray icon")
+    tray_icon.run()
+
+
+def initialize_printer(printer_ready):
+    """Finds and initializes the printer; receipts are spooled until printer_ready is set"""
     try:
-        logger.info("Fiscal Tools requested - signaling main thread")
-        modal_queue.put('open')
+        printer = registry.get_printer(config['printer']['name'])
     except Exception as e:
-        logger.error(f"Error signaling Fiscal Tools: {e}")
-
-
-icon_menu = menu(
-    item('TCpos/BABPrintHub', None, enabled=False),
-    menu.SEPARATOR,
-    item('Fiscal Tools', open_fiscal_tools),
-    menu.SEPARATOR,
-    item('Print X-Report', print_x_report_menu),
-    item('Print Z-Report', print_z_report_menu),
-    menu.SEPARATOR,
-    item('Quit BAB PrintHub', close_app)
-)
-
-icon_obj = pystray.Icon(
-    name='BAB PrintHub',
-    icon=Image.open(os.path.join(resource_dir, 'logo.png')),
-    title='BAB PrintHub',
-    menu=icon_menu
-)
-
-# icon_tray_thread = threading.Thread(target=icon_obj.run, daemon=True)
-# icon_tray_thread.start()
-
-logger.debug("Starting fiscal printer hub...")
-config = load_config()
-logger.debug("Config loaded...")
-
+        logger.error(f"Could not load printer driver: {e}")
+        return
 
-logger.debug("Identifying printer...")
-if config['printer']['name'] == 'cts310ii':
-    import cts310ii
-    while not cts310ii.cts310ii_main():
+    while not printer.connect():
         time.sleep(1)
 
+    printer_ready.set()
+    startup_phase("printer")
 
-logger.debug("Identifying POS...")
-if config['pos']['name'] == 'tcpos':
-    import tcpos_parser
 
-    tcpos_thread = threading.Thread(target=tcpos_parser.files_watchdog, daemon=True)
-    tcpos_thread.start()
+def warm_up_webview():
+    """Loads webview in the background so the first Fiscal Tools window opens fast"""
+    try:
+        import webview
+        startup_phase("webview")
+    except Exception as e:
+        logger.warning(f"Could not pre-load webview module: {e}")
 
-    logger.debug("Started TCPOS watchdog...")
 
-# Move tray icon to background thread to keep main thread free for pywebview
-icon_thread = threading.Thread(target=icon_obj.run, daemon=True)
-icon_thread.start()
+def open_ui(payload):
+    """Opens Fiscal Tools; blocks the main thread until the window closes"""
+    global ui_window
+    if headless:
+        return {"success": False, "error": "Fiscal Tools is not available in headless mode"}
 
-logger.info("Tray icon started in background thread")
-logger.info("Main thread ready for pywebview modal requests")
+    logger.info("Opening Fiscal Tools UI (pywebview) in main thread")
 
-# Main thread loop - listens for modal open requests
-while True:
+    import webview
+    from salesbook_webview_ui import FiscalToolsAPI, HTML_TEMPLATE
+
+    api = FiscalToolsAPI()
+    ui_window = webview.create_window(
+        'Fiscal Tools - BAB PrintHub',
+        html=HTML_TEMPLATE,
+        width=800,
+        height=700,
+        resizable=True,
+        background_color='#ffffff',
+        js_api=api
+    )
+    api.window = ui_window
+
+    # Blocks until window closes (runs in main thread)
     try:
-        signal = modal_queue.get(timeout=0.1)
-        if signal == 'open':
+        webview.start(gui='edgechromium')
+    except:
+        logger.warning("EdgeChromium not available, trying mshtml")
+        webview.start(gui='mshtml')
+    finally:
+        ui_window = None
+
+    logger.info("Fiscal Tools UI closed")
+    return {"success": True}
+
+
+def reload_config(payload):
+    changed = config_service.reload(force=True)
+    logger.info("Config reloaded from tray menu" if changed else "Config reload failed, see previous errors")
+    return {"success": changed}
+
+
+def run_report(payload):
+    """Prints an X or Z report; payload {"report": "x" | "z"}"""
+    printer = registry.get_printer(config_service.get()['printer']['name'])
+    report = payload.get("report")
+    if report == "x":
+        result = printer.print_x_report()
+    elif report == "z":
+        result = printer.print_z_report(close_fiscal_day=True)
+        if result.get("success"):
+            import sales_rollup
+            import z_archive
+            sales_rollup.get_rollups().close_day(result.get("report_number"))
+            z_archive.archive_after_close(printer, result.get("report_number"))
             try:
-                logger.info("Opening Fiscal Tools UI (pywebview) in main thread")
-
-                from salesbook_webview_ui import FiscalToolsAPI, HTML_TEMPLATE
-
-                api = FiscalToolsAPI()
-                window = webview.create_window(
-                    'Fiscal Tools - BAB PrintHub',
-                    html=HTML_TEMPLATE,
-                    width=800,
-                    height=700,
-                    resizable=True,
-                    background_color='#ffffff',
-                    js_api=api
-                )
-                api.window = window
-
-                # Blocks until window closes (runs in main thread)
-                try:
-                    webview.start(gui='edgechromium')
-                except:
-                    logger.warning("EdgeChromium not available, trying mshtml")
-                    webview.start(gui='mshtml')
-
-                logger.info("Fiscal Tools UI closed")
-
+                config_service.update_section("fiscal_tools", {"last_z_report_print_time": datetime.datetime.now().isoformat()})
             except Exception as e:
-                logger.error(f"Error opening Fiscal Tools: {e}")
-    except queue.Empty:
-        pass
\ No newline at end of file
+                logger.error(f"Error saving last Z report time: {e}")
+    else:
+        return {"success": False, "error": f"Unknown report: {report}"}
+
+    if result.get("success"):
+        logger.info(f"{report.upper()}-Report printed successfully")
+    else:
+        logger.warning(f"{report.upper()}-Report failed: {result.get('error')}")
+    return result
+
+
+def shutdown(payload):
+    logger.info("Shutting down BAB PrintHub")
+    if tray_icon is not None:
+        try:
+            tray_icon.stop()
+        except Exception as e:
+            logger.warning(f"Could not stop tray icon: {e}")
+
+    # a document is printed under the serial lock: wait for it and keep the lock,
+    # so no new document is started before the process exits
+    serial_lock = getattr(registry.loaded_printer(), 'serial_lock', None)
+    if serial_lock is not None and not serial_lock.acquire(timeout=shutdown_timeout):
+        logger.warning(f"Printer still busy after {shutdown_timeout}s, exiting anyway")
+
+    return {"success": True}
+
+
+def handle_signal(signum, frame):
+    # Python runs signal handlers on the main thread between bytecodes; inside the
+    # pywebview GUI loop that can be delayed until the loop next calls into Python
+    logger.info(f"Received {signal.Signals(signum).name}")
+    close_ui()
+    post(SHUTDOWN)
+
+
+handlers = {
+    OPEN_UI: open_ui,
+    SHUTDOWN: shutdown,
+    RELOAD_CONFIG: reload_config,
+    RUN_REPORT: run_report,
+}
+
+# handlers that need not run on the main thread get a worker right away, so they
+# do not wait for an open Fiscal Tools window (and slow serial work keeps the UI free)
+background_handlers = (RUN_REPORT, RELOAD_CONFIG)
+
+
+def handle(kind, payload):
+    try:
+        handler = handlers.get(kind)
+        if handler is None:
+            raise ValueError(f"Unknown message: {kind}")
+        handler(payload or {})
+    except Exception as e:
+        logger.error(f"Error handling {kind}: {e}")
+
+
+def run_main_loop(wake_interval=None):
+    """Main thread dispatcher, sleeps until a message arrives"""
+    while True:
+        try:
+            kind, payload = main_queue.get(timeout=wake_interval)
+        except queue.Empty:
+            continue
+
+        handle(kind, payload)
+        if kind == SHUTDOWN:
+            break
+
+
+logger.debug("Starting fiscal printer hub...")
+config = config_service.get()
+config_service.start_watching()
+headless = headless or bool(config.get('miscellaneous', {}).get('headless', False))
+startup_phase("config")
+
+signal.signal(signal.SIGINT, handle_signal)
+signal.signal(signal.SIGTERM, handle_signal)
+
+# Transactions are watched and spooled first, the printer comes up in the background
+printer_ready = threading.Event()
+
+logger.debug("Identifying POS...")
+pos = registry.get_pos(config['pos']['name'])
+pos_thread = threading.Thread(target=pos.watch, args=(printer_ready,), name="pos-watch", daemon=True)
+pos_thread.start()
+
+startup_phase(f"{config['pos']['name']} watchdog")
+
+logger.debug("Identifying printer...")
+threading.Thread(target=initialize_printer, args=(printer_ready,), name="printer-init", daemon=True).start()
+
+if headless:
+    logger.info("Running headless, stop with Ctrl+C or SIGTERM")
+    # on Windows a blocked queue wait does not see Ctrl+C before Python 3.14
+    run_main_loop(wake_interval=1 if os.name == 'nt' else None)
+else:
+    # Tray icon in a background thread to keep main thread free for pywebview
+    threading.Thread(target=run_tray, name="tray", daemon=True).start()
+    threading.Thread(target=warm_up_webview, name="webview-warm-up", daemon=True).start()
+
+    logger.info("Main thread ready for pywebview modal requests")
+    run_main_loop()
+
+# spooled receipts and the processing state are durable, only the log needs flushing
+stop_logging()
+os._exit(0)
+
@@ -0,0 +1,305 @@
+"""
+Event-driven folder watcher for the TCPOS transactions folder
+
+Uses inotify on Linux and ReadDirectoryChangesW on Windows (both through
+ctypes, no extra dependencies) and falls back to periodic polling elsewhere.
+Change events are debounced per path and delivered to a callback; a periodic
+reconciliation request (path None) lets the caller rescan for missed events.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from logger_module import logger
+
+
+# inotify masks (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+INOTIFY_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+
+# ReadDirectoryChangesW (winbase.h / winnt.h)
+FILE_LIST_DIRECTORY = 0x0001
+FILE_SHARE_ALL = 0x00000001 | 0x00000002 | 0x00000004
+OPEN_EXISTING = 3
+FILE_FLAG_BACKUP_SEMANTICS = 0x02000000
+FILE_NOTIFY_CHANGE_FILE_NAME = 0x00000001
+FILE_NOTIFY_CHANGE_DIR_NAME = 0x00000002
+FILE_NOTIFY_CHANGE_SIZE = 0x00000008
+FILE_NOTIFY_CHANGE_LAST_WRITE = 0x00000010
+WINDOWS_NOTIFY_FILTER = (FILE_NOTIFY_CHANGE_FILE_NAME | FILE_NOTIFY_CHANGE_DIR_NAME |
+                         FILE_NOTIFY_CHANGE_SIZE | FILE_NOTIFY_CHANGE_LAST_WRITE)
+
+
+class FolderWatcher:
+    """
+    Watches a folder tree and calls on_change(path) for every changed file
+    once it has been quiet for `debounce` seconds. Every `reconcile_interval`
+    seconds, and whenever the OS reports lost events, on_change(None) is
+    called so the caller can run a full scan.
+
+    Files that already exist when the watcher starts are not reported, the
+    caller does its own initial scan.
+
+    Where every directory needs its own watch (inotify), subdirectories(path)
+    may return the subdirectories to watch at start without listing the
+    directory (e.g. from stored scan watermarks), [] to leave an old subtree
+    unwatched below path, or None to list it.
+    """
+
+    def __init__(self, folder, on_change, suffixes=('.xml',), debounce=0.05, reconcile_interval=60, poll_interval=1,
+                 subdirectories=None):
+        self.folder = os.path.abspath(folder)
+        self.on_change = on_change
+        self.suffixes = suffixes
+        self.debounce = debounce
+        self.reconcile_interval = reconcile_interval
+        self.poll_interval = poll_interval
+        self.subdirectories = subdirectories
+        self.backend = None
+
+        self._pending = {}  # path: monotonic time of the last event
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+        self._win_handle = None
+
+    def start(self):
+        if sys.platform.startswith('linux'):
+            self.backend = 'inotify'
+            target = self._run_inotify
+        elif os.name == 'nt':
+            self.backend = 'ReadDirectoryChangesW'
+            target = self._run_windows
+        else:
+            self.backend = 'polling'
+            target = self._run_polling
+
+        for name, run in (("watcher", target), ("debounce", self._run_dispatcher), ("reconcile", self._run_reconcile)):
+            thread = threading.Thread(target=run, name=f"folder-{name}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        logger.info(f"Watching {self.folder} using {self.backend}")
+
+    def stop(self):
+        self._stop.set()
+        with self._condition:
+            self._condition.notify_all()
+
+        if self._win_handle is not None:
+            # unblock the pending ReadDirectoryChangesW call
+            ctypes.windll.kernel32.CancelIoEx(self._win_handle, None)
+
+    def request_reconcile(self):
+        self._notify(None)
+
+    def _notify(self, path):
+        if path is not None and not path.endswith(self.suffixes):
+            return
+
+        with self._condition:
+            self._pending[path] = time.monotonic()
+            self._condition.notify()
+
+    def _emit(self, path):
+        try:
+            self.on_change(path)
+        except Exception as e:
+            logger.error(f"Folder watcher callback error: {e}")
+
+    def _run_dispatcher(self):
+        """
+        Delivers each path once no new event arrived for `debounce` seconds.
+        """
+        while not self._stop.is_set():
+            ready = []
+            with self._condition:
+                while not self._pending and not self._stop.is_set():
+                    self._condition.wait()
+
+                now = time.monotonic()
+                next_due = None
+                for path, last_event in list(self._pending.items()):
+                    due = last_event + self.debounce
+                    if due <= now:
+                        ready.append(path)
+                        del self._pending[path]
+                    elif next_due is None or due < next_due:
+                        next_due = due
+
+                if not ready and next_due is not None:
+                    self._condition.wait(next_due - now)
+
+            for path in ready:
+                self._emit(path)
+
+    def _run_reconcile(self):
+        while not self._stop.wait(self.reconcile_interval):
+            self._notify(None)
+
+    def _fallback_to_polling(self, reason):
+        logger.warning(f"Folder watcher {self.backend} unavailable ({reason}), falling back to polling")
+        self.backend = 'polling'
+        self._run_polling()
+
+    def _run_polling(self):
+        # every poll is a reconciliation scan
+        while not self._stop.wait(self.poll_interval):
+            self._notify(None)
+
+    def _run_inotify(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        except (OSError, AttributeError) as e:
+            return self._fallback_to_polling(e)
+
+        watches = {}  # watch descriptor: directory
+
+        def add_watch(directory):
+            wd = libc.inotify_add_watch(fd, os.fsencode(directory), INOTIFY_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+            watches[wd] = directory
+
+        def add_tree(directory, notify_files=True):
+            add_watch(directory)
+
+            # at start the caller may know the subdirectories, a new directory is always listed
+            children = None
+            if self.subdirectories is not None and not notify_files:
+                children = self.subdirectories(directory)
+
+            if children is None:
+                children = []
+                try:
+                    with os.scandir(directory) as entries:
+                        for entry in entries:
+                            if entry.is_dir():
+                                children.append(entry.path)
+                            elif notify_files:
+                                # files created in a new directory before its watch existed
+                                self._notify(entry.path)
+                except FileNotFoundError:
+                    return
+
+            for child in children:
+                try:
+                    add_tree(child, notify_files)
+                except FileNotFoundError:
+                    pass  # removed meanwhile
+
+        try:
+            add_tree(self.folder, notify_files=False)
+        except OSError as e:
+            os.close(fd)
+            return self._fallback_to_polling(e)
+
+        header = struct.Struct('iIII')
+        try:
+            while not self._stop.is_set():
+                readable, _, _ = select.select([fd], [], [], 1.0)
+                if not readable:
+                    continue
+
+                try:
+                    data = os.read(fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+
+                offset = 0
+                while offset + header.size <= len(data):
+                    wd, mask, cookie, length = header.unpack_from(data, offset)
+                    name = data[offset + header.size:offset + header.size + length].rstrip(b'\0')
+                    offset += header.size + length
+
+                    if mask & IN_Q_OVERFLOW:
+                        logger.warning("Folder watcher event queue overflow, reconciling")
+                        self._notify(None)
+                        continue
+
+                    if mask & IN_IGNORED:
+                        watches.pop(wd, None)
+                        continue
+
+                    directory = watches.get(wd)
+                    if directory is None or not name:
+                        continue
+
+                    path = os.path.join(directory, os.fsdecode(name))
+                    if mask & IN_ISDIR:
+                        if mask & (IN_CREATE | IN_MOVED_TO):
+                            try:
+                                add_tree(path)
+                            except OSError as e:
+                                logger.error(f"Folder watcher could not watch {path}: {e}")
+                                self._notify(None)
+                        continue
+
+                    self._notify(path)
+        finally:
+            os.close(fd)
+
+    def _run_windows(self):
+        from ctypes import wintypes
+
+        kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+        kernel32.CreateFileW.restype = wintypes.HANDLE
+        kernel32.CreateFileW.argtypes = [wintypes.LPCWSTR, wintypes.DWORD, wintypes.DWORD, wintypes.LPVOID,
+                                         wintypes.DWORD, wintypes.DWORD, wintypes.HANDLE]
+        kernel32.ReadDirectoryChangesW.argtypes = [wintypes.HANDLE, wintypes.LPVOID, wintypes.DWORD, wintypes.BOOL,
+                                                   wintypes.DWORD, ctypes.POINTER(wintypes.DWORD), wintypes.LPVOID,
+                                                   wintypes.LPVOID]
+
+        handle = kernel32.CreateFileW(self.folder, FILE_LIST_DIRECTORY, FILE_SHARE_ALL, None,
+                                      OPEN_EXISTING, FILE_FLAG_BACKUP_SEMANTICS, None)
+        if handle is None or handle == wintypes.HANDLE(-1).value:
+            return self._fallback_to_polling(ctypes.WinError(ctypes.get_last_error()))
+
+        self._win_handle = handle
+        buffer = ctypes.create_string_buffer(64 * 1024)
+        bytes_returned = wintypes.DWORD()
+
+        try:
+            while not self._stop.is_set():
+                ok = kernel32.ReadDirectoryChangesW(handle, buffer, len(buffer), True, WINDOWS_NOTIFY_FILTER,
+                                                    ctypes.byref(bytes_returned), None, None)
+                if not ok:
+                    if self._stop.is_set():
+                        break
+                    logger.error(f"ReadDirectoryChangesW failed: {ctypes.WinError(ctypes.get_last_error())}")
+                    self._notify(None)
+                    time.sleep(self.poll_interval)
+                    continue
+
+                if bytes_returned.value == 0:
+                    # buffer overflow, the events are lost
+                    logger.warning("Folder watcher event buffer overflow, reconciling")
+                    self._notify(None)
+                    continue
+
+                offset = 0
+                while True:
+                    next_offset, action, name_length = struct.unpack_from('III', buffer.raw, offset)
+                    name = buffer.raw[offset + 12:offset + 12 + name_length].decode('utf-16-le')
+                    self._notify(os.path.join(self.folder, name))
+                    if next_offset == 0:
+                        break
+                    offset += next_offset
+        finally:
+            self._win_handle = None
+            kernel32.CloseHandle(handle)
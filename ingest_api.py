@@ -0,0 +1,264 @@
+"""
+Loopback HTTP/JSON ingestion API
+
+Optional alternative to the transactions folder for local integrations:
+
+    POST /transactions          TCPOS XML body (application/xml), or JSON: one
+                                {"id"?, "xml": "..."} / {"id"?, "transaction": {...}}
+                                object or a list of them
+                                -> 202 {"accepted": [{"id", "status_url"}], "rejected": [...]}
+    GET  /transactions/<id>     -> {"id", "status", "trans_num", "document_number", "error"}
+                                ?wait=<seconds> blocks until the receipt is final
+
+Every accepted transaction is written to base_dir/ingest/<id>.xml|.json, so it
+is tracked by the processing state like a watched file and survives a restart,
+and is handed straight to the print pipeline without waiting for the watcher.
+The ingest folder is not watched, so failed transactions are submitted again
+from here with the processing state's backoff; until their attempts are used
+up they are reported as "retrying".
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+import processing_state
+from logger_module import logger
+
+
+if getattr(sys, 'frozen', False):
+    base_dir = os.path.dirname(sys.executable)
+
+elif __file__:
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+host = '127.0.0.1'  # loopback only, the API has no authentication
+port = 8765
+max_body_size = 10 * 1024 * 1024  # bytes per request
+max_wait = 60  # seconds a status request may block with ?wait
+retry_check_interval = 5  # seconds between checks for failed transactions due for another attempt
+
+RETRYING = 'retrying'  # reported for a failed transaction that will be submitted again
+
+valid_id = re.compile(r'[A-Za-z0-9_.-]{1,64}')
+
+
+class IngestAPI:
+    def __init__(self, submit, state, directory=None, host=host, port=port):
+        """
+        submit(path) validates a written transaction and hands it to the
+        pipeline, raising ValueError when it cannot be printed. It returns
+        False when the transaction is already in the pipeline.
+        """
+        self.submit = submit
+        self.state = state
+        self.directory = directory or os.path.join(base_dir, 'ingest')
+        self.address = (host, port)
+        self._finished = threading.Condition()
+        self._accept_lock = threading.Lock()  # makes the id check and the store one step
+        self._server = None
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def start(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                api.handle_post(self)
+
+            def do_GET(self):
+                api.handle_get(self)
+
+            def log_message(self, format, *args):
+                logger.debug("Ingest API: " + format % args)
+
+        self._server = ThreadingHTTPServer(self.address, Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="ingest-api", daemon=True).start()
+        threading.Thread(target=self._retry_failed, name="ingest-retry", daemon=True).start()
+        logger.info(f"Ingest API listening on http://{self.address[0]}:{self._server.server_port}")
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+    def finished(self, path):
+        """
+        Called by the pipeline when a transaction reached a final state.
+        """
+        with self._finished:
+            self._finished.notify_all()
+
+    def pending(self):
+        """
+        Returns the stored transactions that have no final state yet, failed
+        ones with attempts left included, oldest first.
+        """
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                 if name.endswith(('.xml', '.json'))]
+        paths = [path for path in paths if self._retrying(path) or self.state.status(path) is None]
+        return sorted(paths, key=os.path.getmtime)
+
+    def _retrying(self, path):
+        return self.state.status(path) == processing_state.FAILED and self.state.can_retry(path)
+
+    def _retry_failed(self):
+        while self._server is not None:
+            time.sleep(retry_check_interval)
+            try:
+                for path in self.pending():
+                    if not self._retrying(path) or not self.state.retry_due(path):
+                        continue
+                    try:
+                        if self.submit(path):
+                            logger.info(f"Retrying ingest transaction: {os.path.basename(path)}")
+                    except Exception as e:
+                        # counts as one more failed attempt
+                        self.state.record(path, processing_state.FAILED, error=str(e))
+                        logger.warning(f"Ingest transaction not resubmitted ({e}): {os.path.basename(path)}")
+            except Exception as e:
+                logger.error(f"Error retrying ingest transactions: {e}")
+
+    def _path(self, transaction_id):
+        for extension in ('.xml', '.json'):
+            path = os.path.join(self.directory, transaction_id + extension)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _store(self, transaction_id, extension, content):
+        path = os.path.join(self.directory, transaction_id + extension)
+        with open(path + '.tmp', 'wb') as transaction_file:
+            transaction_file.write(content)
+            transaction_file.flush()
+            os.fsync(transaction_file.fileno())
+        os.replace(path + '.tmp', path)
+        return path
+
+    def accept(self, entry):
+        """
+        Stores and submits one transaction, returns its id.
+        """
+        transaction_id = str(entry.get("id") or uuid.uuid4().hex)
+        if not valid_id.fullmatch(transaction_id):
+            raise ValueError(f"invalid id: {transaction_id}")
+
+        if "xml" in entry:
+            extension, content = '.xml', entry["xml"].encode('utf-8')
+        elif "transaction" in entry:
+            extension, content = '.json', json.dumps(entry["transaction"]).encode('utf-8')
+        else:
+            raise ValueError("expected 'xml' or 'transaction'")
+
+        # requests are handled concurrently: check, store and submit under one lock
+        with self._accept_lock:
+            # idempotent: a resubmitted id is reported, not printed again
+            if self._path(transaction_id):
+                return transaction_id
+
+            path = self._store(transaction_id, extension, content)
+            try:
+                self.submit(path)
+            except Exception:
+                os.remove(path)
+                raise
+
+        return transaction_id
+
+    def status(self, transaction_id):
+        path = self._path(transaction_id)
+        if path is None:
+            return None
+
+        row = self.state.get(path)
+        if row is None:
+            return {"id": transaction_id, "status": "queued", "trans_num": None, "document_number": None, "error": None}
+
+        return {
+            "id": transaction_id,
+            "status": RETRYING if self._retrying(path) else row["status"],
+            "trans_num": row["trans_num"],
+            "document_number": row["document_number"],
+            "error": row["error"],
+        }
+
+    def handle_post(self, request):
+        if urlsplit(request.path).path.rstrip('/') != '/transactions':
+            return self._reply(request, 404, {"error": "not found"})
+
+        try:
+            length = int(request.headers.get('Content-Length') or 0)
+            if length < 0:
+                raise ValueError(length)
+        except ValueError:
+            return self._reply(request, 400, {"error": "invalid Content-Length"})
+        if length > max_body_size:
+            return self._reply(request, 413, {"error": f"body larger than {max_body_size} bytes"})
+        body = request.rfile.read(length)
+
+        content_type = (request.headers.get('Content-Type') or '').split(';')[0].strip()
+        try:
+            if content_type.endswith('xml') or body.lstrip().startswith(b'<'):
+                entries = [{"id": parse_qs(urlsplit(request.path).query).get('id', [None])[0], "xml": body.decode('utf-8')}]
+            else:
+                entries = json.loads(body)
+                if isinstance(entries, dict):
+                    entries = entries.get("transactions", [entries])
+                if not isinstance(entries, list):
+                    raise ValueError("expected an object or a list")
+        except ValueError as e:
+            return self._reply(request, 400, {"error": str(e)})
+
+        accepted, rejected = [], []
+        for index, entry in enumerate(entries):
+            try:
+                if not isinstance(entry, dict):
+                    raise ValueError("expected an object")
+                transaction_id = self.accept(entry)
+                accepted.append({"id": transaction_id, "status_url": f"/transactions/{transaction_id}"})
+            except Exception as e:
+                rejected.append({"index": index, "id": entry.get("id") if isinstance(entry, dict) else None, "error": str(e)})
+
+        if rejected:
+            logger.warning(f"Ingest API rejected {len(rejected)} of {len(entries)} transactions")
+        self._reply(request, 202 if accepted else 400, {"accepted": accepted, "rejected": rejected})
+
+    def handle_get(self, request):
+        url = urlsplit(request.path)
+        parts = url.path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'transactions' or not valid_id.fullmatch(parts[1]):
+            return self._reply(request, 404, {"error": "not found"})
+
+        try:
+            wait = min(float(parse_qs(url.query).get('wait', ['0'])[0]), max_wait)
+        except ValueError:
+            return self._reply(request, 400, {"error": "invalid wait"})
+
+        deadline = time.monotonic() + wait
+        with self._finished:
+            while True:
+                status = self.status(parts[1])
+                remaining = deadline - time.monotonic()
+                if status is None or status["status"] in processing_state.DONE_STATUSES + (processing_state.FAILED,) or remaining <= 0:
+                    break
+                self._finished.wait(remaining)
+
+        if status is None:
+            return self._reply(request, 404, {"error": "unknown id"})
+        self._reply(request, 200, status)
+
+    def _reply(self, request, code, payload):
+        body = json.dumps(payload).encode('utf-8')
+        request.send_response(code)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
@@ -0,0 +1,118 @@
+"""
+Background jobs for long printer operations
+
+A job runs function(*args, progress=..., cancel=...) in its own thread. The
+function reports progress(done, expected) and checks the cancel event between
+steps; its return value (a {"success": ...} dict) is the job result. Every
+change is passed to on_event(job) so the caller can push it to the UI.
+"""
+
+import time
+import uuid
+import threading
+from logger_module import logger
+
+
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+keep_finished = 20  # finished jobs kept for status requests
+
+
+class Job:
+    def __init__(self, kind, on_event=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.state = RUNNING
+        self.done = 0
+        self.expected = None
+        self.result = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self._on_event = on_event
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "done": self.done,
+            "expected": self.expected,
+            "result": self.result,
+            "elapsed": round((self.finished_at or time.time()) - self.started_at, 1),
+        }
+
+    def _emit(self):
+        if self._on_event is None:
+            return
+        try:
+            self._on_event(self.to_dict())
+        except Exception as e:
+            logger.debug(f"Job {self.id} event not delivered: {e}")
+
+    def progress(self, done, expected=None):
+        self.done = done
+        self.expected = expected
+        self._emit()
+
+
+class JobManager:
+    def __init__(self, on_event=None):
+        self.on_event = on_event
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def start(self, kind, function, *args):
+        """
+        Runs function in the background, returns the job id right away.
+        """
+        job = Job(kind, lambda event: self.on_event and self.on_event(event))
+
+        with self._lock:
+            self._jobs[job.id] = job
+            finished = [j for j in self._jobs.values() if j.state != RUNNING]
+            for old in sorted(finished, key=lambda j: j.finished_at)[:-keep_finished or None]:
+                del self._jobs[old.id]
+
+        def run():
+            try:
+                result = function(*args, progress=job.progress, cancel=job.cancel_event)
+            except Exception as e:
+                logger.error(f"Job {job.kind} ({job.id}) failed: {e}")
+                result = {"success": False, "error": str(e)}
+
+            job.result = result
+            if job.cancel_event.is_set() and not result.get("success"):
+                job.state = CANCELLED
+            else:
+                job.state = DONE if result.get("success") else FAILED
+            job.finished_at = time.time()
+            logger.info(f"Job {job.kind} ({job.id}) {job.state}")
+            job._emit()
+
+        logger.info(f"Job {kind} ({job.id}) started")
+        threading.Thread(target=run, name=f"job-{kind}-{job.id}", daemon=True).start()
+        job._emit()
+        return job.id
+
+    def cancel(self, job_id):
+        """
+        Asks a running job to stop after its current step.
+        """
+        job = self._jobs.get(job_id)
+        if job is None or job.state != RUNNING:
+            return False
+        job.cancel_event.set()
+        logger.info(f"Job {job.kind} ({job.id}) cancellation requested")
+        return True
+
+    def get(self, job_id):
+        job = self._jobs.get(job_id)
+        return job.to_dict() if job else None
+
+    def running(self):
+        with self._lock:
+            return [job.to_dict() for job in self._jobs.values() if job.state == RUNNING]
@@ -1,7 +1,15 @@
-
 import os
+import re
 import sys
+import gzip
+import copy
+import json
+import time
+import queue
+import atexit
 import logging
+import threading
+import logging.handlers
 
 
 if getattr(sys, 'frozen', False):
@@ -12,16 +20,271 @@ elif __file__:
 
 logger_level = logging.INFO
 
+logs_dir = os.path.join(base_dir, 'logs')  # rotated, compressed logs and index.json
+log_max_bytes = 10 * 1024 * 1024  # log.log is rotated when it grows past this, and at midnight
+log_retention_days = 30  # rotated logs older than this are deleted
+log_max_total_bytes = 500 * 1024 * 1024  # oldest rotated logs are deleted above this total
+
+
+class DailyRotatingFileHandler(logging.handlers.BaseRotatingHandler):
+    """
+    Writes log.log and moves it to logs/log-<day>.<n>.log when it passes
+    max_bytes or when the day changes. Rotated files are compressed, indexed
+    by day and pruned by the compressor thread, away from the writer.
+    """
+
+    def __init__(self, filename, directory, max_bytes=0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        super().__init__(filename, 'a', encoding='utf-8', delay=False)
+
+        # day of the records in the current file
+        try:
+            self.day = time.strftime('%Y-%m-%d', time.localtime(os.path.getmtime(self.baseFilename)))
+        except OSError:
+            self.day = time.strftime('%Y-%m-%d')
+
+        # rotated files left uncompressed by a previous run
+        for name in sorted(os.listdir(directory)):
+            if _rotated_name.fullmatch(name):
+                _compress_queue.put(os.path.join(directory, name))
+        _compress_queue.put(None)
+
+    def shouldRollover(self, record):
+        if self.stream is None:
+            return False
+        if time.strftime('%Y-%m-%d', time.localtime(record.created)) != self.day:
+            return self.stream.tell() > 0
+        return bool(self.max_bytes) and self.stream.tell() >= self.max_bytes
+
+    def doRollover(self):
+        self.stream.close()
+        self.stream = None
+
+        sequence = 1
+        for name in os.listdir(self.directory):
+            match = _rotated_name.fullmatch(name) or _compressed_name.fullmatch(name)
+            if match and match[1] == self.day:
+                sequence = max(sequence, int(match[2]) + 1)
+        target = os.path.join(self.directory, f"log-{self.day}.{sequence:03d}.log")
+
+        try:
+            os.replace(self.baseFilename, target)
+            _compress_queue.put(target)
+        except OSError:
+            pass  # keep appending to the current file
+
+        self.day = time.strftime('%Y-%m-%d')
+        self.stream = self._open()
+
+
+_rotated_name = re.compile(r'log-(\d{4}-\d{2}-\d{2})\.(\d+)\.log')
+_compressed_name = re.compile(r'log-(\d{4}-\d{2}-\d{2})\.(\d+)\.log\.gz')
+_line_start = re.compile(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),\d+ - ([A-Z]+) - ')
+_index_lock = threading.Lock()
+_compress_queue = queue.SimpleQueue()
+
+
+def _index_path():
+    return os.path.join(logs_dir, 'index.json')
+
+
+def load_index():
+    """
+    Returns {day: [{file, first, last, size, levels}, ...]} of the rotated logs.
+    """
+    try:
+        with open(_index_path(), encoding='utf-8') as index_file:
+            return json.load(index_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_index(index):
+    with open(_index_path() + '.tmp', 'w', encoding='utf-8') as index_file:
+        json.dump(index, index_file, indent=2, sort_keys=True)
+    os.replace(_index_path() + '.tmp', _index_path())
+
+
+def _compress(path):
+    """
+    Gzips one rotated file, counting its records per level for the index.
+    """
+    day = _rotated_name.fullmatch(os.path.basename(path))[1]
+    levels = {}
+    first = last = None
+
+    with open(path, 'rb') as source, gzip.open(path + '.gz.tmp', 'wb') as target:
+        for line in source:
+            target.write(line)
+            match = _line_start.match(line.decode('utf-8', 'replace'))
+            if match:
+                first = first or match[1]
+                last = match[1]
+                levels[match[2]] = levels.get(match[2], 0) + 1
+
+    os.replace(path + '.gz.tmp', path + '.gz')
+    os.remove(path)
+
+    entry = {"file": os.path.basename(path) + '.gz', "first": first, "last": last,
+             "size": os.path.getsize(path + '.gz'), "levels": levels}
+    with _index_lock:
+        index = load_index()
+        files = [e for e in index.get(day, []) if e["file"] != entry["file"]]
+        index[day] = sorted(files + [entry], key=lambda e: e["file"])
+        _save_index(index)
+
+
+def _prune():
+    """
+    Applies log_retention_days and log_max_total_bytes to the compressed logs.
+    """
+    cutoff = time.strftime('%Y-%m-%d', time.localtime(time.time() - log_retention_days * 86400))
+    files = sorted(name for name in os.listdir(logs_dir) if _compressed_name.fullmatch(name))
+    total = sum(os.path.getsize(os.path.join(logs_dir, name)) for name in files)
+
+    removed = []
+    for name in files:
+        if _compressed_name.fullmatch(name)[1] >= cutoff and total <= log_max_total_bytes:
+            break
+        total -= os.path.getsize(os.path.join(logs_dir, name))
+        os.remove(os.path.join(logs_dir, name))
+        removed.append(name)
+
+    if removed:
+        with _index_lock:
+            index = load_index()
+            for day in list(index):
+                index[day] = [e for e in index[day] if e["file"] not in removed]
+                if not index[day]:
+                    del index[day]
+            _save_index(index)
+
+
+def _compressor():
+    while True:
+        path = _compress_queue.get()
+        try:
+            if path is not None:
+                _compress(path)
+            _prune()
+        except Exception as e:
+            # logging from here would only queue more work for this thread
+            sys.stderr.write(f"Log compression error: {e}\n")
+
+
+threading.Thread(target=_compressor, name="log-compressor", daemon=True).start()
+
+
+class lazy_json:
+    """
+    Log argument dumped as JSON only when the record is actually emitted:
+    logger.debug("Payments: %s", lazy_json(payments))
+    """
+    __slots__ = ('value', 'indent')
+
+    def __init__(self, value, indent=4):
+        self.value = value
+        self.indent = indent
+
+    def __str__(self):
+        try:
+            return json.dumps(self.value, indent=self.indent, default=str)
+        except Exception:
+            return repr(self.value)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records unformatted. The stock QueueHandler.prepare() builds the
+    message (msg % args, lazy_json included) on the logging thread; here the
+    listener thread does it. Arguments that can still change after the call,
+    like the dicts payment() hex-encodes in place, are copied first.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        if isinstance(record.args, dict):
+            record.args = _snapshot(record.args)
+        elif record.args:
+            record.args = tuple(_snapshot(arg) for arg in record.args)
+        return record
+
+
+def _snapshot(value):
+    if isinstance(value, lazy_json):
+        return lazy_json(_snapshot(value.value), value.indent)
+    if isinstance(value, (dict, list, set)):
+        return copy.deepcopy(value)
+    return value
+
+
 logger = logging.getLogger()
 formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 logger.setLevel(logger_level)
-file_handler = logging.FileHandler(os.path.join(base_dir, 'log.log'))
+file_handler = DailyRotatingFileHandler(os.path.join(base_dir, 'log.log'), logs_dir, log_max_bytes)
 file_handler.setLevel(logger_level)
 file_handler.setFormatter(formatter)
 console_handler = logging.StreamHandler()
 console_handler.setLevel(logger_level)
 console_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
 
+# Callers only put records on the queue; the listener thread formats them and
+# does the disk and console writes, away from the serial and parse paths.
+log_queue = queue.SimpleQueue()
+queue_handler = DeferredQueueHandler(log_queue)
+logger.addHandler(queue_handler)
+listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+listener.start()
+
+
+def stop_logging():
+    """
+    Writes the records still queued and stops the writer thread.
+    """
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+atexit.register(stop_logging)
+
+
+def debug_enabled():
+    return logger.isEnabledFor(logging.DEBUG)
+
+
+def read_logs(day, min_level=logging.DEBUG):
+    """
+    Yields the lines logged on day (YYYY-MM-DD) at min_level or above,
+    using the index to open only that day's files.
+    """
+    paths = [os.path.join(logs_dir, entry["file"]) for entry in load_index().get(day, [])]
+    for name in sorted(os.listdir(logs_dir)):
+        match = _rotated_name.fullmatch(name)
+        if match and match[1] == day:
+            paths.append(os.path.join(logs_dir, name))  # not compressed yet
+    if file_handler.day == day:
+        paths.append(file_handler.baseFilename)
+
+    for path in paths:
+        try:
+            log_file = gzip.open(path, 'rt', encoding='utf-8', errors='replace') if path.endswith('.gz') \
+                else open(path, encoding='utf-8', errors='replace')
+        except OSError:
+            continue
 
+        with log_file:
+            keep = False
+            for line in log_file:
+                match = _line_start.match(line)
+                if match:
+                    if match[1][:10] != day:
+                        keep = False
+                        continue
+                    keep = logging.getLevelName(match[2]) >= min_level
+                # traceback lines follow the record they belong to
+                if keep:
+                    yield line
@@ -0,0 +1,144 @@
+"""
+Receipt latency and throughput metrics
+
+The pipeline reports one record per printed receipt with its stage timings
+(detection, parse, build, spool wait, serial time per command group, total).
+snapshot() returns rolling receipts per minute and p50/p95/p99 per timing over
+the last `window` seconds; start_stats_writer() dumps it to stats.json.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from collections import deque
+from logger_module import logger
+
+
+if getattr(sys, 'frozen', False):
+    base_dir = os.path.dirname(sys.executable)
+
+elif __file__:
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+window = 300  # seconds of receipts kept for the rolling figures
+stats_interval = 30  # seconds between stats.json writes
+
+_lock = threading.Lock()
+_receipts = deque()  # (finished_at, record)
+_counters = {}
+_gauges = {}  # name: function returning the current value
+_started_at = time.time()
+
+
+def percentile(sorted_values, percent):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, round(percent / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def _expire(now):
+    while _receipts and _receipts[0][0] < now - window:
+        _receipts.popleft()
+
+
+def record_receipt(source, trans_num, timings):
+    """
+    Adds a printed receipt. timings maps a stage name to seconds.
+    """
+    now = time.time()
+    record = {"source": source, "trans_num": trans_num, "timings": timings}
+
+    with _lock:
+        _receipts.append((now, record))
+        _counters["receipts"] = _counters.get("receipts", 0) + 1
+        _expire(now)
+
+
+def increment(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def register_gauge(name, function):
+    """
+    Registers a value read on every snapshot, e.g. the spool depth.
+    """
+    with _lock:
+        _gauges[name] = function
+
+
+def snapshot():
+    now = time.time()
+    with _lock:
+        _expire(now)
+        records = [record for _, record in _receipts]
+        first = _receipts[0][0] if _receipts else now
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+
+    # rate over the window, or since start while the window is not full yet
+    elapsed = max(min(window, now - _started_at), 1)
+    timings = {}
+    for record in records:
+        for name, value in record["timings"].items():
+            if value is not None:
+                timings.setdefault(name, []).append(value)
+
+    latency = {}
+    for name, values in timings.items():
+        values.sort()
+        latency[name] = {
+            "p50": round(percentile(values, 50), 4),
+            "p95": round(percentile(values, 95), 4),
+            "p99": round(percentile(values, 99), 4),
+            "max": round(values[-1], 4),
+        }
+
+    gauge_values = {}
+    for name, function in gauges.items():
+        try:
+            gauge_values[name] = function()
+        except Exception as e:
+            gauge_values[name] = None
+            logger.debug(f"Gauge {name} failed: {e}")
+
+    return {
+        "time": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now)),
+        "window": window,
+        "receipts_in_window": len(records),
+        "receipts_per_minute": round(len(records) * 60 / elapsed, 2),
+        "oldest_in_window": round(now - first, 1),
+        "latency": latency,
+        "counters": counters,
+        "gauges": gauge_values,
+        "last": records[-1] if records else None,
+    }
+
+
+def write_stats(path=None):
+    path = path or os.path.join(base_dir, 'stats.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as stats_file:
+        json.dump(snapshot(), stats_file, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def start_stats_writer(interval=None, path=None):
+    """
+    Writes snapshot() to stats.json every `interval` seconds in the background.
+    """
+    def run():
+        while True:
+            time.sleep(interval or stats_interval)
+            try:
+                write_stats(path)
+            except Exception as e:
+                logger.error(f"Error writing stats: {e}")
+
+    threading.Thread(target=run, name="metrics-writer", daemon=True).start()
@@ -0,0 +1,318 @@
+"""
+Processing state store for transaction files
+
+Replaces the .processed/.skipped marker files next to every XML with one
+SQLite database in base_dir. All statuses are loaded into an in-memory index
+at startup so the watchdog can check a file without touching the disk.
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+from logger_module import logger
+
+
+if getattr(sys, 'frozen', False):
+    base_dir = os.path.dirname(sys.executable)
+
+elif __file__:
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+PROCESSED = 'processed'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+# final failures a retry cannot fix (the printer refused the document, or an
+# earlier print could not be confirmed); only a rewritten file is tried again
+REJECTED = 'rejected'
+
+# statuses that are final, failed transactions are retried
+DONE_STATUSES = (PROCESSED, SKIPPED, REJECTED)
+
+retry_delay = 60  # seconds before a failed transaction is retried, doubled per failure
+max_attempts = 5  # failures after which a transaction is left alone until its file changes
+
+# receipt states: prepared before the first printer command, committed after
+# the document is closed, aborted when the printer confirms it was never closed
+PREPARED = 'prepared'
+COMMITTED = 'committed'
+ABORTED = 'aborted'
+
+LEGACY_MARKERS = ('.processed', '.skipped')
+
+
+def normalize_path(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+class ProcessingState:
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.path.join(base_dir, 'processing_state.db')
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS transactions (
+                path TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                trans_num TEXT,
+                document_number TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                first_seen TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS receipts (
+                key TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                trans_num TEXT,
+                doc_type TEXT,
+                state TEXT NOT NULL,
+                document_number TEXT,
+                prepared_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS directories (
+                path TEXT PRIMARY KEY,
+                mtime REAL NOT NULL,
+                subtree_mtime REAL NOT NULL,
+                settled INTEGER NOT NULL,
+                children TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS migrations (
+                scope TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                completed_at TEXT NOT NULL,
+                PRIMARY KEY (scope, version)
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        if "content_hash" not in [row[1] for row in self._connection.execute("PRAGMA table_info(transactions)")]:
+            self._connection.execute("ALTER TABLE transactions ADD COLUMN content_hash TEXT")
+        self._connection.commit()
+
+        # path: status
+        self._index = dict(self._connection.execute("SELECT path, status FROM transactions"))
+
+        # path: (consecutive failures, time of the last one) of failed transactions
+        self._failures = {}
+        for path, attempts, updated_at in self._connection.execute(
+                "SELECT path, attempts, updated_at FROM transactions WHERE status = ?", (FAILED,)):
+            self._failures[path] = (attempts, time.mktime(time.strptime(updated_at, '%Y-%m-%d %H:%M:%S')))
+
+        # path: scan watermark of the transactions folder tree
+        self._directories = {}
+        for path, mtime, subtree_mtime, settled, children in self._connection.execute(
+                "SELECT path, mtime, subtree_mtime, settled, children FROM directories"):
+            self._directories[path] = {
+                "mtime": mtime,
+                "subtree_mtime": subtree_mtime,
+                "settled": bool(settled),
+                "children": json.loads(children),
+            }
+
+        # scope: completed migration versions
+        self._migrations = {}
+        for scope, version in self._connection.execute("SELECT scope, version FROM migrations"):
+            self._migrations.setdefault(scope, set()).add(version)
+
+        logger.info(f"Processing state loaded: {len(self._index)} transactions, {len(self._directories)} directories")
+
+    def status(self, path):
+        return self._index.get(normalize_path(path))
+
+    def is_done(self, path):
+        return self._index.get(normalize_path(path)) in DONE_STATUSES
+
+    def can_retry(self, path):
+        """
+        False once a failed transaction used up its max_attempts.
+        """
+        failures = self._failures.get(normalize_path(path))
+        return failures is None or failures[0] < max_attempts
+
+    def retry_due(self, path):
+        """
+        True unless the transaction failed and its retry delay has not passed
+        (retry_delay, doubled per failure) or it used up its attempts.
+        """
+        failures = self._failures.get(normalize_path(path))
+        if failures is None:
+            return True
+        count, failed_at = failures
+        return count < max_attempts and time.time() >= failed_at + retry_delay * 2 ** (count - 1)
+
+    def get(self, path):
+        """
+        Returns the stored row for a transaction file as a dict, or None.
+        """
+        with self._lock:
+            cursor = self._connection.execute(
+                "SELECT path, status, trans_num, document_number, error, attempts, first_seen, updated_at, content_hash "
+                "FROM transactions WHERE path = ?", (normalize_path(path),))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([column[0] for column in cursor.description], row))
+
+    def record(self, path, status, trans_num=None, document_number=None, error=None, content_hash=None):
+        key = normalize_path(path)
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+
+        with self._lock:
+            self._connection.execute("""
+                INSERT INTO transactions (path, status, trans_num, document_number, error, attempts, first_seen, updated_at, content_hash)
+                VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    status = excluded.status,
+                    trans_num = COALESCE(excluded.trans_num, trans_num),
+                    document_number = COALESCE(excluded.document_number, document_number),
+                    error = excluded.error,
+                    attempts = attempts + 1,
+                    updated_at = excluded.updated_at,
+                    content_hash = COALESCE(excluded.content_hash, content_hash)
+            """, (key, status, trans_num, document_number, error, now, now, content_hash))
+            self._connection.commit()
+            self._index[key] = status
+            if status == FAILED:
+                self._failures[key] = (self._failures.get(key, (0, None))[0] + 1, time.time())
+            else:
+                self._failures.pop(key, None)
+
+    def get_receipt(self, key):
+        """
+        Returns the receipt stored under key (transaction GUID + content hash), or None.
+        """
+        with self._lock:
+            cursor = self._connection.execute(
+                "SELECT key, path, trans_num, doc_type, state, document_number, prepared_at, updated_at "
+                "FROM receipts WHERE key = ?", (key,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([column[0] for column in cursor.description], row))
+
+    def prepared_receipts(self):
+        with self._lock:
+            cursor = self._connection.execute(
+                "SELECT key, path, trans_num, doc_type, state, document_number, prepared_at, updated_at "
+                "FROM receipts WHERE state = ?", (PREPARED,))
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def prepare_receipt(self, key, path, trans_num, doc_type):
+        """
+        Phase one, written before the first command of the document is sent.
+        """
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO receipts (key, path, trans_num, doc_type, state, document_number, prepared_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, NULL, ?, ?)", (key, normalize_path(path), trans_num, doc_type, PREPARED, now, now))
+            self._connection.commit()
+
+    def update_receipt(self, key, state=None, document_number=None):
+        """
+        Stores the document number once the printer opened the document,
+        and phase two (committed) or aborted.
+        """
+        with self._lock:
+            self._connection.execute(
+                "UPDATE receipts SET state = COALESCE(?, state), document_number = COALESCE(?, document_number), "
+                "updated_at = ? WHERE key = ?", (state, document_number, time.strftime('%Y-%m-%d %H:%M:%S'), key))
+            self._connection.commit()
+
+    def get_directory(self, path):
+        """
+        Returns the watermark stored by the last scan of a directory, or None.
+        """
+        return self._directories.get(normalize_path(path))
+
+    def save_directories(self, directories):
+        """
+        Stores directory watermarks, {path: {mtime, subtree_mtime, settled, children}}.
+        """
+        rows = []
+        for path, entry in directories.items():
+            key = normalize_path(path)
+            self._directories[key] = entry
+            rows.append((key, entry["mtime"], entry["subtree_mtime"], int(entry["settled"]), json.dumps(entry["children"])))
+
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO directories (path, mtime, subtree_mtime, settled, children) VALUES (?, ?, ?, ?, ?)", rows)
+            self._connection.commit()
+
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+            self._connection.commit()
+
+    def run_migrations(self, scope, migrations):
+        """
+        Runs the (version, name, function) steps not completed yet for scope
+        (e.g. the transactions folder), in version order. Each completed step is
+        recorded so it never runs again; a failing step stops the later ones
+        and is retried on the next start.
+        """
+        completed = self._migrations.setdefault(scope, set())
+        todo = [migration for migration in sorted(migrations, key=lambda m: m[0]) if migration[0] not in completed]
+        if not todo:
+            return True
+
+        for version, name, function in todo:
+            logger.info(f"Running migration {version} ({name})...")
+            start = time.time()
+            try:
+                function(scope)
+            except Exception as e:
+                logger.error(f"Migration {version} ({name}) failed: {e}")
+                return False
+
+            with self._lock:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO migrations (scope, version, name, completed_at) VALUES (?, ?, ?, ?)",
+                    (scope, version, name, time.strftime('%Y-%m-%d %H:%M:%S')))
+                self._connection.commit()
+            completed.add(version)
+            logger.info(f"Migration {version} complete in {time.time() - start:.1f}s")
+
+        return True
+
+    def import_marker_files(self, transactions_folder):
+        """
+        Imports legacy <file>.xml.processed / <file>.xml.skipped markers.
+        The marker files are left in place so older versions keep working.
+        """
+        rows = []
+        for root, dirs, files in os.walk(transactions_folder):
+            for file in files:
+                for marker in LEGACY_MARKERS:
+                    if file.endswith('.xml' + marker):
+                        path = os.path.join(root, file[:-len(marker)])
+                        key = normalize_path(path)
+                        if key not in self._index:
+                            stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(os.path.getmtime(os.path.join(root, file))))
+                            rows.append((key, marker[1:], stamp, stamp))
+
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO transactions (path, status, first_seen, updated_at) VALUES (?, ?, ?, ?)", rows)
+            self._connection.commit()
+            for key, status, _, _ in rows:
+                self._index[key] = status
+
+        return len(rows)
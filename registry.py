@@ -0,0 +1,111 @@
+"""
+Printer driver and POS source registry
+
+config printer.name and pos.name select an implementation by name. Built-in
+ones are listed below; other packages add theirs with entry points in the
+"babprinthub.printers" / "babprinthub.pos" groups pointing at a module (or
+any object) with the interface functions. Only the selected implementation
+is imported, on first use.
+
+Printer drivers provide connect, build_document, print_built_document,
+print_document, search_document, reprint_document, print_x_report and
+print_z_report; optionally print_z_report_by_date / _by_number /
+_by_number_range, read_z_reports (decoded Z reports without printing, for the
+Z archive), get_current_z_number (notices Z reports closed outside the hub),
+serial_error (why the printer is unreachable), spot_printer (find it again),
+serial_lock and tax_ids (VAT percent: printer tax id).
+A print_built_document result may carry a "summary" of the receipt for the
+sales rollups (see sales_rollup.py) and a print_z_report result the
+"report_number" of the closed report.
+
+POS sources provide watch(printer_ready) and parse(path).
+"""
+
+import importlib
+import threading
+from importlib import metadata
+from logger_module import logger
+
+
+PRINTER_GROUP = "babprinthub.printers"
+POS_GROUP = "babprinthub.pos"
+
+PRINTER_INTERFACE = ("connect", "build_document", "print_built_document", "print_document",
+                     "search_document", "reprint_document", "print_x_report", "print_z_report")
+POS_INTERFACE = ("watch", "parse")
+
+# name: module
+builtin = {
+    PRINTER_GROUP: {"cts310ii": "cts310ii"},
+    POS_GROUP: {"tcpos": "tcpos_parser"},
+}
+
+_interfaces = {PRINTER_GROUP: PRINTER_INTERFACE, POS_GROUP: POS_INTERFACE}
+_loaded = {}  # (group, name): implementation
+_lock = threading.RLock()
+
+
+def _entry_point(group, name):
+    try:
+        for entry_point in metadata.entry_points(group=group):
+            if entry_point.name == name:
+                return entry_point
+    except Exception as e:
+        logger.warning(f"Could not read {group} entry points: {e}")
+    return None
+
+
+def available(group):
+    """
+    Returns the names that can be loaded for a group, built-in ones first.
+    """
+    names = list(builtin.get(group, {}))
+    try:
+        names += [entry_point.name for entry_point in metadata.entry_points(group=group) if entry_point.name not in names]
+    except Exception as e:
+        logger.warning(f"Could not read {group} entry points: {e}")
+    return names
+
+
+def load(group, name):
+    """
+    Imports and returns the implementation registered under name, once.
+    """
+    with _lock:
+        if (group, name) in _loaded:
+            return _loaded[(group, name)]
+
+        if name in builtin.get(group, {}):
+            implementation = importlib.import_module(builtin[group][name])
+        else:
+            entry_point = _entry_point(group, name)
+            if entry_point is None:
+                raise LookupError(f"Unknown {group} '{name}', available: {', '.join(available(group))}")
+            implementation = entry_point.load()
+
+        missing = [function for function in _interfaces[group] if not callable(getattr(implementation, function, None))]
+        if missing:
+            raise TypeError(f"{group} '{name}' is missing {', '.join(missing)}")
+
+        _loaded[(group, name)] = implementation
+        logger.debug(f"Loaded {group} '{name}'")
+        return implementation
+
+
+def get_printer(name):
+    return load(PRINTER_GROUP, name)
+
+
+def get_pos(name):
+    return load(POS_GROUP, name)
+
+
+def loaded_printer():
+    """
+    Returns the printer driver loaded so far, or None.
+    """
+    with _lock:
+        for (group, name), implementation in _loaded.items():
+            if group == PRINTER_GROUP:
+                return implementation
+    return None
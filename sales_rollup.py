@@ -0,0 +1,305 @@
+"""
+Sales rollups per fiscal day
+
+Every printed receipt's summary (document type, total, sales and tax per
+printer tax id, amount per payment method, see the printer driver's
+receipt_summary) is stored in sales_rollup.db and added to the rollup of the
+open fiscal day, which is kept in memory and saved with it. Fiscal Tools shows
+the open day as an X report style summary without asking the printer. A
+Z report closes the day; the next receipt opens a new one. A day also keeps
+the printer's current Z report number from when it opened, so a Z report
+closed elsewhere (the printer keypad, another program) is noticed by
+check_z_number() and closes the stale day.
+
+The receipt summaries are the history: recompute() rebuilds the rollups
+from them.
+"""
+
+import os
+import sys
+import json
+import time
+import copy
+import sqlite3
+import threading
+from logger_module import logger
+
+
+if getattr(sys, 'frozen', False):
+    base_dir = os.path.dirname(sys.executable)
+
+elif __file__:
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+render_width = 48  # characters per line, as on the receipt paper
+
+doc_type_names = {
+    "1": "Invoice Final Consumer",
+    "2": "Invoice Fiscal Credit",
+    "3": "Credit Note Final Consumer",
+    "4": "Credit Note Fiscal Credit",
+}
+
+
+def empty_rollup():
+    return {
+        "receipts": 0,
+        "net_total": 0.0,  # invoices minus credit notes
+        "doc_types": {},  # doc type: {"count", "total"}
+        "sales": {"total": 0.0, "exempt": 0.0, "taxes": {}},  # taxes: tax id: {"sales", "tax"}
+        "credit_notes": {"count": 0, "total": 0.0, "exempt": 0.0, "taxes": {}},
+        "payments": {},  # method: amount, refunds of credit notes subtracted
+    }
+
+
+def add_receipt(rollup, summary):
+    """
+    Adds one receipt summary to a rollup, in place.
+    """
+    credit_note = summary["is_credit_note"]
+    sign = -1 if credit_note else 1
+
+    rollup["receipts"] += 1
+    rollup["net_total"] = round(rollup["net_total"] + sign * summary["total"], 2)
+
+    doc_type = rollup["doc_types"].setdefault(summary["doc_type"], {"count": 0, "total": 0.0})
+    doc_type["count"] += 1
+    doc_type["total"] = round(doc_type["total"] + summary["total"], 2)
+
+    group = rollup["credit_notes"] if credit_note else rollup["sales"]
+    if credit_note:
+        group["count"] += 1
+    group["total"] = round(group["total"] + summary["total"], 2)
+    group["exempt"] = round(group["exempt"] + summary["exempt"], 2)
+    for tax_id, amounts in summary["taxes"].items():
+        totals = group["taxes"].setdefault(tax_id, {"sales": 0.0, "tax": 0.0})
+        totals["sales"] = round(totals["sales"] + amounts["sales"], 2)
+        totals["tax"] = round(totals["tax"] + amounts["tax"], 2)
+
+    for method, amount in summary["payments"].items():
+        rollup["payments"][method] = round(rollup["payments"].get(method, 0) + sign * amount, 2)
+
+
+class SalesRollups:
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.path.join(base_dir, 'sales_rollup.db')
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS fiscal_days (
+                day INTEGER PRIMARY KEY AUTOINCREMENT,
+                opened_at TEXT NOT NULL,
+                closed_at TEXT,
+                z_number INTEGER,
+                opened_z INTEGER,
+                rollup TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS receipts (
+                key TEXT PRIMARY KEY,
+                day INTEGER NOT NULL,
+                document_number TEXT,
+                trans_num TEXT,
+                printed_at TEXT NOT NULL,
+                summary TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS receipts_day ON receipts (day);
+        """)
+        if "opened_z" not in [row[1] for row in self._connection.execute("PRAGMA table_info(fiscal_days)")]:
+            self._connection.execute("ALTER TABLE fiscal_days ADD COLUMN opened_z INTEGER")
+        self._connection.commit()
+
+        # the open fiscal day, None until its first receipt
+        self._day = None
+        row = self._connection.execute(
+            "SELECT day, opened_at, opened_z, rollup FROM fiscal_days WHERE closed_at IS NULL ORDER BY day DESC LIMIT 1").fetchone()
+        if row:
+            self._day = {"day": row[0], "opened_at": row[1], "opened_z": row[2], "rollup": json.loads(row[3])}
+
+    def record(self, key, summary, document_number=None, trans_num=None):
+        """
+        Adds a printed receipt to the open fiscal day. A receipt key recorded
+        before (a reprocessed transaction) is ignored.
+        """
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            if self._day is None:
+                cursor = self._connection.execute(
+                    "INSERT INTO fiscal_days (opened_at, rollup) VALUES (?, ?)", (now, json.dumps(empty_rollup())))
+                self._day = {"day": cursor.lastrowid, "opened_at": now, "opened_z": None, "rollup": empty_rollup()}
+
+            cursor = self._connection.execute(
+                "INSERT OR IGNORE INTO receipts (key, day, document_number, trans_num, printed_at, summary) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, self._day["day"], document_number, trans_num, now, json.dumps(summary)))
+            if cursor.rowcount == 0:
+                self._connection.commit()
+                return False
+
+            add_receipt(self._day["rollup"], summary)
+            self._connection.execute(
+                "UPDATE fiscal_days SET rollup = ? WHERE day = ?", (json.dumps(self._day["rollup"]), self._day["day"]))
+            self._connection.commit()
+            return True
+
+    def current(self):
+        """
+        Returns the open fiscal day, {"day", "opened_at", "opened_z", "rollup"};
+        an empty rollup when no receipt was printed since the last Z report.
+        """
+        with self._lock:
+            if self._day is None:
+                return {"day": None, "opened_at": None, "opened_z": None, "rollup": empty_rollup()}
+            return copy.deepcopy(self._day)
+
+    def close_day(self, z_number=None):
+        """
+        Closes the open fiscal day after a Z report.
+        """
+        with self._lock:
+            self._close_day(z_number)
+
+    def _close_day(self, z_number):
+        if self._day is None:
+            return
+        self._connection.execute(
+            "UPDATE fiscal_days SET closed_at = ?, z_number = ? WHERE day = ?",
+            (time.strftime('%Y-%m-%d %H:%M:%S'), z_number, self._day["day"]))
+        self._connection.commit()
+        logger.info(f"Fiscal day {self._day['day']} closed (Z report #{z_number}), {self._day['rollup']['receipts']} receipts")
+        self._day = None
+
+    def check_z_number(self, current_z):
+        """
+        Compares the printer's current Z report number with the one the open
+        fiscal day started with. A day opened without it takes this one; a
+        day whose number changed was closed by a Z report the hub did not
+        print, it is closed as Z report #opened_z. Returns True when the day
+        was closed.
+        """
+        with self._lock:
+            if self._day is None or current_z is None:
+                return False
+            if self._day["opened_z"] is None:
+                self._connection.execute("UPDATE fiscal_days SET opened_z = ? WHERE day = ?", (current_z, self._day["day"]))
+                self._connection.commit()
+                self._day["opened_z"] = current_z
+                return False
+            if self._day["opened_z"] == current_z:
+                return False
+
+            logger.warning(f"Z report number changed from #{self._day['opened_z']} to #{current_z} outside the hub, closing the stale fiscal day")
+            self._close_day(self._day["opened_z"])
+            return True
+
+    def days(self, limit=31):
+        """
+        Returns the latest fiscal days with their rollups, newest first.
+        """
+        with self._lock:
+            cursor = self._connection.execute(
+                "SELECT day, opened_at, closed_at, z_number, rollup FROM fiscal_days ORDER BY day DESC LIMIT ?", (limit,))
+            columns = [column[0] for column in cursor.description]
+            days = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        for day in days:
+            day["rollup"] = json.loads(day["rollup"])
+        return days
+
+    def recompute(self, day=None):
+        """
+        Rebuilds the rollups of one fiscal day (all when None) from the stored
+        receipt summaries. Returns the number of days rebuilt.
+        """
+        with self._lock:
+            if day is None:
+                days = [row[0] for row in self._connection.execute("SELECT day FROM fiscal_days")]
+            else:
+                days = [day]
+
+            for fiscal_day in days:
+                rollup = empty_rollup()
+                for (summary,) in self._connection.execute(
+                        "SELECT summary FROM receipts WHERE day = ? ORDER BY rowid", (fiscal_day,)):
+                    add_receipt(rollup, json.loads(summary))
+                self._connection.execute("UPDATE fiscal_days SET rollup = ? WHERE day = ?", (json.dumps(rollup), fiscal_day))
+                if self._day is not None and self._day["day"] == fiscal_day:
+                    self._day["rollup"] = rollup
+            self._connection.commit()
+
+        logger.info(f"Sales rollups recomputed for {len(days)} fiscal day(s)")
+        return len(days)
+
+
+_rollups = None
+_rollups_lock = threading.Lock()
+
+
+def get_rollups():
+    """
+    Returns the shared rollups, opened on first use.
+    """
+    global _rollups
+    with _rollups_lock:
+        if _rollups is None:
+            _rollups = SalesRollups()
+        return _rollups
+
+
+def render(day, fiscal_information=None):
+    """
+    Returns a plain text X report style summary of a fiscal day from
+    current() or days(). fiscal_information (the printer's tax1..tax10
+    rates) labels the tax lines with their percent.
+    """
+    def line(label, value=""):
+        return f"{label:<{render_width - len(str(value))}}{value}"
+
+    def amount(value):
+        return f"{value:,.2f}"
+
+    def tax_lines(taxes):
+        lines = []
+        for tax_id in sorted(taxes, key=int):
+            rate = (fiscal_information or {}).get(f"tax{tax_id}")
+            label = f"  Tax {tax_id} ({rate:g}%)" if rate else f"  Tax {tax_id}"
+            lines.append(line(label + " sales", amount(taxes[tax_id]["sales"])))
+            lines.append(line(label, amount(taxes[tax_id]["tax"])))
+        return lines
+
+    rollup = day["rollup"]
+    separator = "-" * render_width
+    lines = [
+        "SALES SUMMARY (NOT FISCAL)".center(render_width),
+        separator,
+        line("Fiscal day opened", day.get("opened_at") or "-"),
+    ]
+    if day.get("closed_at"):
+        lines.append(line("Closed", f"{day['closed_at']} (Z #{day.get('z_number')})"))
+    lines.append(line("Receipts", rollup["receipts"]))
+
+    lines += [separator, "DOCUMENTS"]
+    for doc_type, totals in sorted(rollup["doc_types"].items()):
+        lines.append(line(f"  {doc_type_names.get(doc_type, 'Type ' + doc_type)} ({totals['count']})", amount(totals["total"])))
+
+    lines += [separator, "SALES"]
+    lines += tax_lines(rollup["sales"]["taxes"])
+    lines.append(line("  Exempt", amount(rollup["sales"]["exempt"])))
+    lines.append(line("  Total", amount(rollup["sales"]["total"])))
+
+    credit_notes = rollup["credit_notes"]
+    lines += [separator, f"CREDIT NOTES ({credit_notes['count']})"]
+    lines += tax_lines(credit_notes["taxes"])
+    lines.append(line("  Exempt", amount(credit_notes["exempt"])))
+    lines.append(line("  Total", amount(credit_notes["total"])))
+
+    lines += [separator, "PAYMENTS"]
+    for method, value in sorted(rollup["payments"].items()):
+        lines.append(line(f"  {method.replace('_', ' ').capitalize()}", amount(value)))
+
+    lines += [
+        separator,
+        line("NET TOTAL", amount(rollup["net_total"])),
+        separator,
+    ]
+    return "\n".join(lines)
@@ -4,63 +4,40 @@ Opens from system tray icon - provides full salesbook functionality
 """
 
 import json
-import os
 import datetime
 from logger_module import logger
-import cts310ii
-
-
-CONFIG_FILE = "config.json"
-
-
-def load_config():
-    """Load configuration from bridge config.json"""
-    today = datetime.date.today().strftime("%Y-%m-%d")
-    default_fiscal_tools = {
-        "Z_report_from": today,
-        "last_z_report_print_time": None
-    }
-
-    if not os.path.exists(CONFIG_FILE):
-        logger.error(f"Config file not found: {CONFIG_FILE}")
-        return {"fiscal_tools": default_fiscal_tools}
-
-    try:
-        with open(CONFIG_FILE, encoding="utf-8") as f:
-            config = json.load(f)
-
-        # Ensure fiscal_tools section exists
-        if "fiscal_tools" not in config:
-            config["fiscal_tools"] = default_fiscal_tools
-            save_config(config)
-
-        return config
-    except Exception as e:
-        logger.error(f"Error loading config: {e}")
-        return {"fiscal_tools": default_fiscal_tools}
-
-
-def save_config(config):
-    """Save configuration to bridge config.json"""
-    try:
-        with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-            json.dump(config, f, indent=2)
-    except Exception as e:
-        logger.error(f"Error saving config: {e}")
+import config_service
+import registry
+import jobs
+import sales_rollup
+import z_archive
 
 
 class FiscalToolsAPI:
     """JavaScript API bridge for fiscal printer operations"""
 
     def __init__(self):
-        self.config = load_config()
         self.window = None  # Set after window creation
+        self._jobs = jobs.JobManager(on_event=self._push_job_event)
+
+    def _push_job_event(self, job):
+        """Sends job progress and results to the page (onJobEvent in the template)"""
+        if self.window:
+            self.window.evaluate_js(f"onJobEvent({json.dumps(job)})")
+
+    @property
+    def config(self):
+        return config_service.get()
+
+    @property
+    def printer(self):
+        return registry.get_printer(self.config['printer']['name'])
 
     def print_x_report(self):
         """Generate X report"""
         try:
             logger.info("X-Report triggered from webview UI")
-            response = cts310ii.print_x_report()
+            response = self.printer.print_x_report()
             if response.get("success"):
                 logger.info("X-Report printed successfully")
                 return {"success": True, "message": "X Report printed successfully"}
@@ -78,10 +55,16 @@ class FiscalToolsAPI:
 
             # Send command to printer with close_fiscal_day=True
             # This closes the fiscal period and prints the Z-report
-            response = cts310ii.print_z_report(close_fiscal_day=True)
+            response = self.printer.print_z_report(close_fiscal_day=True)
 
             if response.get("success"):
                 logger.info("Z-Report printed successfully (fiscal day closed)")
+                sales_rollup.get_rollups().close_day(response.get("report_number"))
+                z_archive.archive_after_close(self.printer, response.get("report_number"))
+                try:
+                    config_service.update_section("fiscal_tools", {"last_z_report_print_time": datetime.datetime.now().isoformat()})
+                except Exception as e:
+                    logger.error(f"Error saving last Z report time: {e}")
                 return {"success": True, "message": "Z Report printed - Fiscal day closed"}
             else:
                 logger.warning(f"Z-Report response: {response.get('error', 'Unknown error')}")
@@ -91,7 +74,7 @@ class FiscalToolsAPI:
             return {"success": False, "error": str(e)}
 
     def print_z_report_by_date(self, start_date, end_date):
-        """Generate Z reports by date range"""
+        """Start Z reports by date range as a background job"""
         try:
             logger.info(f"Z-Report by date range triggered: {start_date} to {end_date}")
 
@@ -99,14 +82,11 @@ class FiscalToolsAPI:
             start_date_obj = datetime.datetime.strptime(start_date, "%Y-%m-%d").date()
             end_date_obj = datetime.datetime.strptime(end_date, "%Y-%m-%d").date()
 
-            response = cts310ii.print_z_report_by_date(start_date_obj, end_date_obj)
+            if start_date_obj > end_date_obj:
+                return {"success": False, "error": "Start date must be before or equal to end date"}
 
-            if response.get("success"):
-                logger.info("Z-Reports by date printed successfully")
-                return {"success": True, "message": response.get("message", "Z Reports printed")}
-            else:
-                logger.warning(f"Z-Reports by date failed: {response.get('error')}")
-                return {"success": False, "error": response.get("error", "Failed to print Z Reports")}
+            job_id = self._jobs.start("z_report_by_date", self.printer.print_z_report_by_date, start_date_obj, end_date_obj)
+            return {"success": True, "job_id": job_id, "message": f"Printing Z Reports from {start_date} to {end_date}"}
         except Exception as e:
             logger.error(f"Error printing Z-Reports by date: {e}")
             return {"success": False, "error": str(e)}
@@ -115,7 +95,7 @@ class FiscalToolsAPI:
         """Generate Z report by number"""
         try:
             logger.info(f"Z-Report by number triggered: {number}")
-            response = cts310ii.print_z_report_by_number(int(number))
+            response = self.printer.print_z_report_by_number(int(number))
 
             if response.get("success"):
                 logger.info("Z-Report by number printed successfully")
@@ -128,7 +108,7 @@ class FiscalToolsAPI:
             return {"success": False, "error": str(e)}
 
     def print_z_report_by_number_range(self, start_number, end_number):
-        """Generate Z reports by number range"""
+        """Start Z reports by number range as a background job"""
         try:
             logger.info(f"Z-Report by number range triggered: {start_number} to {end_number}")
 
@@ -138,23 +118,79 @@ class FiscalToolsAPI:
             if start_num > end_num:
                 return {"success": False, "error": "Start number must be less than or equal to end number"}
 
-            response = cts310ii.print_z_report_by_number_range(start_num, end_num)
-
-            if response.get("success"):
-                logger.info("Z-Reports by number range printed successfully")
-                return {"success": True, "message": response.get("message", "Z Reports printed")}
-            else:
-                logger.warning(f"Z-Reports by number range failed: {response.get('error')}")
-                return {"success": False, "error": response.get("error", "Failed to print Z Reports")}
+            job_id = self._jobs.start("z_report_by_number_range", self.printer.print_z_report_by_number_range, start_num, end_num)
+            return {"success": True, "job_id": job_id, "message": f"Printing Z Reports #{start_num} to #{end_num}"}
         except Exception as e:
             logger.error(f"Error printing Z-Reports by number range: {e}")
             return {"success": False, "error": str(e)}
 
+    def archive_z_reports(self, start_number, end_number):
+        """Start reading a Z report number range into the local archive, without printing"""
+        try:
+            logger.info(f"Z-Report archive import triggered: {start_number} to {end_number}")
+
+            start_num = int(start_number)
+            end_num = int(end_number)
+
+            if start_num > end_num:
+                return {"success": False, "error": "Start number must be less than or equal to end number"}
+
+            job_id = self._jobs.start("archive_z_reports", z_archive.archive_z_reports, self.printer, start_num, end_num)
+            return {"success": True, "job_id": job_id, "message": f"Reading Z Reports #{start_num} to #{end_num}"}
+        except Exception as e:
+            logger.error(f"Error archiving Z-Reports: {e}")
+            return {"success": False, "error": str(e)}
+
+    def get_sales_summary(self):
+        """Return the X report style summary of the open fiscal day, from the local rollups"""
+        try:
+            day = sales_rollup.get_rollups().current()
+            fiscal_information = getattr(self.printer, 'fiscal_information', None)
+            return {"success": True, "day": day, "text": sales_rollup.render(day, fiscal_information)}
+        except Exception as e:
+            logger.error(f"Error reading sales summary: {e}")
+            return {"success": False, "error": str(e)}
+
+    def search_z_archive(self, query, date_from, date_to):
+        """Search archived Z reports by number, business date or NKK"""
+        try:
+            reports = z_archive.get_archive().search(query, date_from or None, date_to or None)
+            return {"success": True, "reports": reports}
+        except Exception as e:
+            logger.error(f"Error searching Z report archive: {e}")
+            return {"success": False, "error": str(e)}
+
+    def show_archived_z_report(self, number):
+        """Return a screen copy of an archived Z report"""
+        try:
+            report = z_archive.get_archive().get(int(number))
+            if report is None:
+                return {"success": False, "error": f"Z report #{number} is not archived"}
+
+            fiscal_information = getattr(self.printer, 'fiscal_information', None)
+            return {"success": True, "report": report, "text": z_archive.render(report, fiscal_information)}
+        except Exception as e:
+            logger.error(f"Error showing archived Z report: {e}")
+            return {"success": False, "error": str(e)}
+
+    def cancel_job(self, job_id):
+        """Stop a running job after its current report"""
+        if self._jobs.cancel(job_id):
+            return {"success": True, "message": "Cancelling..."}
+        return {"success": False, "error": "Job is not running"}
+
+    def get_job(self, job_id):
+        """Return the state, progress and result of a job"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return {"success": False, "error": "Unknown job"}
+        return {"success": True, "job": job}
+
     def reprint_document(self, doc_number):
         """Re-print ticket by number (NO SALE - copy only)"""
         try:
             logger.info(f"Reprint document triggered: {doc_number}")
-            response = cts310ii.reprint_document(str(doc_number))
+            response = self.printer.reprint_document(str(doc_number))
 
             if response.get("success"):
                 logger.info("Document reprinted successfully")
@@ -168,7 +204,7 @@ class FiscalToolsAPI:
 
     def get_config(self):
         """Return fiscal_tools config section"""
-        return self.config.get("fiscal_tools", {})
+        return config_service.thaw(self.config.get("fiscal_tools", {}))
 
     def get_min_date(self):
         """Return Z_report_from date"""
@@ -262,6 +298,15 @@ HTML_TEMPLATE = r'''
                 </div>
             </div>
 
+            <!-- Live Sales Summary -->
+            <div class="space-y-3">
+                <div class="flex items-center justify-between pb-2">
+                    <h2 class="text-lg font-bold text-gray-800">Sales Summary (Open Fiscal Day)</h2>
+                    <span class="text-xs text-gray-500">Live from printed receipts - no paper, not fiscal</span>
+                </div>
+                <pre id="sales-summary" class="border border-gray-200 rounded-xl p-3 text-xs bg-gray-50 max-h-80 overflow-y-auto whitespace-pre">Loading...</pre>
+            </div>
+
             <!-- Historical Reports -->
             <div class="space-y-3">
                 <h2 class="text-lg font-bold text-gray-800 pb-2">Historical Reports</h2>
@@ -305,11 +350,67 @@ HTML_TEMPLATE = r'''
                             <button onclick="printZByNumberRange()" class="w-full bg-red-600 hover:bg-red-700 text-white font-semibold py-2.5 rounded-lg transition duration-150 shadow-md text-sm">
                                 Print Number Range
                             </button>
+                            <button onclick="archiveZByNumberRange()" class="w-full bg-white text-gray-700 border border-gray-300 hover:bg-gray-50 font-semibold py-2 rounded-lg transition duration-150 text-sm">
+                                Copy Range to Archive (no paper)
+                            </button>
                         </div>
                     </div>
                 </div>
             </div>
 
+            <!-- Z Report Archive -->
+            <div class="space-y-3">
+                <h2 class="text-lg font-bold text-gray-800 pb-2">Z Report Archive</h2>
+
+                <div class="bg-white border border-gray-300 rounded-xl p-4 shadow-sm space-y-3">
+                    <div class="grid grid-cols-1 md:grid-cols-3 gap-3">
+                        <div>
+                            <label class="block text-xs font-medium text-gray-600 mb-1">Number, date or NKK</label>
+                            <input type="text" id="archive-query" oninput="searchArchive()" class="w-full p-2.5 border border-gray-300 rounded-lg focus:ring-2 focus:ring-red-500 focus:border-red-500 text-sm" placeholder="e.g. 120 or 2026-10">
+                        </div>
+                        <div>
+                            <label class="block text-xs font-medium text-gray-600 mb-1">From</label>
+                            <input type="date" id="archive-from" onchange="searchArchive()" class="w-full p-2.5 border border-gray-300 rounded-lg focus:ring-2 focus:ring-red-500 focus:border-red-500 text-sm">
+                        </div>
+                        <div>
+                            <label class="block text-xs font-medium text-gray-600 mb-1">To</label>
+                            <input type="date" id="archive-to" onchange="searchArchive()" class="w-full p-2.5 border border-gray-300 rounded-lg focus:ring-2 focus:ring-red-500 focus:border-red-500 text-sm">
+                        </div>
+                    </div>
+
+                    <div class="grid grid-cols-1 md:grid-cols-2 gap-3">
+                        <div class="border border-gray-200 rounded-lg max-h-72 overflow-y-auto">
+                            <table class="w-full text-sm">
+                                <thead class="bg-gray-50 text-xs text-gray-600 sticky top-0">
+                                    <tr>
+                                        <th class="text-left p-2">#</th>
+                                        <th class="text-left p-2">Business date</th>
+                                        <th class="text-right p-2">Sales</th>
+                                        <th class="text-right p-2">Credit notes</th>
+                                    </tr>
+                                </thead>
+                                <tbody id="archive-results"></tbody>
+                            </table>
+                            <p id="archive-empty" class="hidden p-3 text-sm text-gray-500">No archived Z reports found.</p>
+                        </div>
+                        <pre id="archive-report" class="border border-gray-200 rounded-lg p-3 text-xs bg-gray-50 max-h-72 overflow-y-auto whitespace-pre">Select a Z report to see its copy.</pre>
+                    </div>
+                </div>
+            </div>
+
+            <!-- Background Job Progress -->
+            <div id="job-progress" class="hidden p-4 rounded-lg bg-blue-50 border border-blue-200">
+                <div class="flex items-center justify-between mb-2">
+                    <span id="job-progress-text" class="text-sm font-medium text-blue-800"></span>
+                    <button onclick="cancelJob()" class="bg-white text-red-700 border border-red-300 hover:bg-red-50 font-semibold px-3 py-1 rounded-lg text-xs">
+                        Cancel
+                    </button>
+                </div>
+                <div class="w-full bg-blue-100 rounded-full h-2">
+                    <div id="job-progress-bar" class="bg-blue-600 h-2 rounded-full transition-all duration-300" style="width: 0%"></div>
+                </div>
+            </div>
+
             <!-- Status Display -->
             <div id="status-message" class="hidden p-4 rounded-lg text-sm font-medium"></div>
         </div>
@@ -366,6 +467,10 @@ HTML_TEMPLATE = r'''
                 document.getElementById('end-date').min = minDate;
                 document.getElementById('end-date').max = yesterdayStr;
                 document.getElementById('end-date').value = yesterdayStr;
+
+                searchArchive();
+                refreshSalesSummary();
+                setInterval(refreshSalesSummary, salesSummaryInterval);
             } catch (error) {
                 console.error('Error initializing UI:', error);
                 showStatus('Error loading configuration', 'error');
@@ -379,6 +484,7 @@ HTML_TEMPLATE = r'''
                 const result = await pywebview.api.print_z_report();
                 if (result.success) {
                     showStatus('✓ ' + result.message, 'success');
+                    refreshSalesSummary();
                 } else {
                     showStatus('✗ ' + result.error, 'error');
                 }
@@ -401,6 +507,74 @@ HTML_TEMPLATE = r'''
             }
         }
 
+        // Background jobs (long Z report ranges) push their progress through onJobEvent
+        let currentJobId = null;
+
+        const jobLabels = {
+            'z_report_by_date': 'Printing Z Reports',
+            'z_report_by_number_range': 'Printing Z Reports',
+            'archive_z_reports': 'Reading Z Reports',
+        };
+
+        function onJobEvent(job) {
+            if (job.id !== currentJobId) {
+                return;
+            }
+
+            const panel = document.getElementById('job-progress');
+            if (job.state === 'running') {
+                const expected = job.expected ? ` of ${job.expected}` : '';
+                const percent = job.expected ? Math.min(100, Math.round(job.done * 100 / job.expected)) : 0;
+                document.getElementById('job-progress-text').textContent = `${jobLabels[job.kind] || 'Working'}: ${job.done}${expected} done (${job.elapsed}s)`;
+                document.getElementById('job-progress-bar').style.width = percent + '%';
+                panel.classList.remove('hidden');
+                return;
+            }
+
+            currentJobId = null;
+            panel.classList.add('hidden');
+            if (job.kind === 'archive_z_reports') {
+                searchArchive();
+            }
+            if (job.state === 'done') {
+                showStatus('✓ ' + job.result.message, 'success');
+            } else if (job.state === 'cancelled') {
+                showStatus('Cancelled: ' + job.result.error, 'info');
+            } else {
+                showStatus('✗ ' + job.result.error, 'error');
+            }
+        }
+
+        async function startJob(result) {
+            if (!result.success) {
+                showStatus('✗ ' + result.error, 'error');
+                return;
+            }
+
+            currentJobId = result.job_id;
+            document.getElementById('job-progress-text').textContent = result.message + '...';
+            document.getElementById('job-progress-bar').style.width = '0%';
+            document.getElementById('job-progress').classList.remove('hidden');
+
+            // events sent before currentJobId was known are not replayed
+            const status = await pywebview.api.get_job(result.job_id);
+            if (status.success) {
+                onJobEvent(status.job);
+            }
+        }
+
+        async function cancelJob() {
+            if (!currentJobId) {
+                return;
+            }
+            try {
+                await pywebview.api.cancel_job(currentJobId);
+                document.getElementById('job-progress-text').textContent = 'Cancelling after the current report...';
+            } catch (error) {
+                showStatus('Error: ' + error, 'error');
+            }
+        }
+
         async function printZByDateRange() {
             const startDate = document.getElementById('start-date').value;
             const endDate = document.getElementById('end-date').value;
@@ -409,15 +583,13 @@ HTML_TEMPLATE = r'''
                 showStatus('Please select both start and end dates.', 'error');
                 return;
             }
+            if (currentJobId) {
+                showStatus('Z Reports are already being printed.', 'error');
+                return;
+            }
 
-            showStatus(`Processing Z Reports from ${startDate} to ${endDate}...`, 'info');
             try {
-                const result = await pywebview.api.print_z_report_by_date(startDate, endDate);
-                if (result.success) {
-                    showStatus('✓ ' + result.message, 'success');
-                } else {
-                    showStatus('✗ ' + result.error, 'error');
-                }
+                await startJob(await pywebview.api.print_z_report_by_date(startDate, endDate));
             } catch (error) {
                 showStatus('Error: ' + error, 'error');
             }
@@ -431,12 +603,100 @@ HTML_TEMPLATE = r'''
                 showStatus('Please enter both start and end numbers.', 'error');
                 return;
             }
+            if (currentJobId) {
+                showStatus('Z Reports are already being printed.', 'error');
+                return;
+            }
 
-            showStatus(`Processing Z Reports #${startNum} to #${endNum}...`, 'info');
             try {
-                const result = await pywebview.api.print_z_report_by_number_range(startNum, endNum);
+                await startJob(await pywebview.api.print_z_report_by_number_range(startNum, endNum));
+            } catch (error) {
+                showStatus('Error: ' + error, 'error');
+            }
+        }
+
+        async function archiveZByNumberRange() {
+            const startNum = document.getElementById('start-number').value;
+            const endNum = document.getElementById('end-number').value;
+
+            if (!startNum || !endNum) {
+                showStatus('Please enter both start and end numbers.', 'error');
+                return;
+            }
+            if (currentJobId) {
+                showStatus('Z Reports are already being printed.', 'error');
+                return;
+            }
+
+            try {
+                await startJob(await pywebview.api.archive_z_reports(startNum, endNum));
+            } catch (error) {
+                showStatus('Error: ' + error, 'error');
+            }
+        }
+
+        // Sales summary of the open fiscal day, read from the in-memory rollups
+        const salesSummaryInterval = 3000;  // ms
+
+        async function refreshSalesSummary() {
+            try {
+                const result = await pywebview.api.get_sales_summary();
+                const summaryEl = document.getElementById('sales-summary');
+                const text = result.success ? result.text : 'Sales summary not available: ' + result.error;
+                if (summaryEl.textContent !== text) {
+                    summaryEl.textContent = text;
+                }
+            } catch (error) {
+                console.error('Error refreshing sales summary:', error);
+            }
+        }
+
+        // Z report archive: searched and rendered locally, no printer round trip
+        let archiveSearch = 0;
+
+        async function searchArchive() {
+            const search = ++archiveSearch;
+            const query = document.getElementById('archive-query').value;
+            const dateFrom = document.getElementById('archive-from').value;
+            const dateTo = document.getElementById('archive-to').value;
+
+            try {
+                const result = await pywebview.api.search_z_archive(query, dateFrom, dateTo);
+                // an answer to an older keystroke is dropped
+                if (search !== archiveSearch) {
+                    return;
+                }
+                if (!result.success) {
+                    showStatus('✗ ' + result.error, 'error');
+                    return;
+                }
+
+                const rows = document.getElementById('archive-results');
+                rows.innerHTML = '';
+                for (const report of result.reports) {
+                    const row = document.createElement('tr');
+                    row.className = 'border-t border-gray-100 hover:bg-red-50 cursor-pointer';
+                    row.onclick = () => showArchivedZReport(report.number);
+                    for (const [value, align] of [[report.number, 'text-left'], [report.business_date, 'text-left'],
+                                                  [report.sales_total.toFixed(2), 'text-right'], [report.credit_notes_total.toFixed(2), 'text-right']]) {
+                        const cell = document.createElement('td');
+                        cell.className = 'p-2 ' + align;
+                        cell.textContent = value;
+                        row.appendChild(cell);
+                    }
+                    rows.appendChild(row);
+                }
+                document.getElementById('archive-empty').classList.toggle('hidden', result.reports.length > 0);
+            } catch (error) {
+                showStatus('Error: ' + error, 'error');
+            }
+        }
+
+        async function showArchivedZReport(number) {
+            try {
+                const result = await pywebview.api.show_archived_z_report(number);
                 if (result.success) {
-                    showStatus('✓ ' + result.message, 'success');
+                    document.getElementById('archive-report').textContent = result.text;
                 } else {
                     showStatus('✗ ' + result.error, 'error');
                 }
@@ -0,0 +1,100 @@
+"""
+In-memory trace of the last serial frames
+
+Every frame sent to or received from the printer is stored in a fixed size
+ring buffer (direction, command code, bytes, latency, outcome) at the cost of
+one tuple assignment. The buffer is written to a file only when something
+goes wrong (NAK, timeout, failed close) or when a dump is requested from the
+tray menu.
+"""
+
+import os
+import sys
+import time
+import threading
+from logger_module import logger
+
+
+if getattr(sys, 'frozen', False):
+    base_dir = os.path.dirname(sys.executable)
+
+elif __file__:
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+trace_size = 512  # frames kept in memory
+traces_dir = os.path.join(base_dir, 'serial_traces')
+auto_dump_interval = 60  # minimum seconds between automatic dumps
+traces_kept = 50  # oldest dump files are deleted above this count
+
+TX = 'tx'
+RX = 'rx'
+
+_slots = [None] * trace_size
+_next = 0
+_last_auto_dump = None
+_dump_lock = threading.Lock()
+
+
+def record(direction, code, data, latency=None, outcome=None):
+    """
+    Stores one frame, overwriting the oldest. Callers hold the serial lock.
+    """
+    global _next
+    _slots[_next % trace_size] = (time.time(), direction, code, data, latency, outcome)
+    _next += 1
+
+
+def frames():
+    """
+    Returns the buffered frames, oldest first.
+    """
+    end = _next
+    start = max(0, end - trace_size)
+    snapshot = list(_slots)
+    return [snapshot[i % trace_size] for i in range(start, end) if snapshot[i % trace_size] is not None]
+
+
+def dump(reason):
+    """
+    Writes the buffered frames to serial_traces/ and returns the file path.
+    """
+    buffered = frames()
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+
+    with _dump_lock:
+        os.makedirs(traces_dir, exist_ok=True)
+        path = os.path.join(traces_dir, f"serial-{stamp}-{_next}.txt")
+        with open(path, 'w', encoding='utf-8') as trace_file:
+            trace_file.write(f"# {reason}\n")
+            trace_file.write(f"# {len(buffered)} frames, {_next} recorded since start\n")
+            for timestamp, direction, code, data, latency, outcome in buffered:
+                when = time.strftime('%H:%M:%S', time.localtime(timestamp)) + f".{int(timestamp % 1 * 1000):03d}"
+                took = f"{latency * 1000:8.1f}ms" if latency is not None else " " * 10
+                trace_file.write(f"{when} {direction} {code or '--'} {took} {outcome or '':8} {data or ''}\n")
+
+        dumps = sorted(name for name in os.listdir(traces_dir) if name.startswith('serial-'))
+        for name in dumps[:-traces_kept]:
+            os.remove(os.path.join(traces_dir, name))
+
+    logger.info(f"Serial trace written ({reason}): {path}")
+    return path
+
+
+def auto_dump(reason):
+    """
+    Dumps in the background after a failure, at most once per auto_dump_interval.
+    """
+    global _last_auto_dump
+    now = time.monotonic()
+    if _last_auto_dump is not None and now - _last_auto_dump < auto_dump_interval:
+        return
+    _last_auto_dump = now
+
+    def run():
+        try:
+            dump(reason)
+        except Exception as e:
+            logger.error(f"Error writing serial trace: {e}")
+
+    threading.Thread(target=run, name="serial-trace-dump", daemon=True).start()
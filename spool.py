@@ -0,0 +1,143 @@
+"""
+Disk-backed print spool
+
+Built documents are written to one JSON file per job in base_dir/spool before
+they reach the printer, so receipts keep being accepted while the printer is
+offline and survive a restart. Jobs are handed out oldest first and removed
+only once they are finished.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from logger_module import logger
+
+
+if getattr(sys, 'frozen', False):
+    base_dir = os.path.dirname(sys.executable)
+
+elif __file__:
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class Spool:
+    def __init__(self, directory=None, high_water=50):
+        self.directory = directory or os.path.join(base_dir, 'spool')
+        self.high_water = high_water
+        self._condition = threading.Condition()
+        self._alerted = False
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        # job ids (zero padded sequence numbers) in FIFO order
+        self._jobs = sorted(int(name[:-5]) for name in os.listdir(self.directory)
+                            if name.endswith('.json') and name[:-5].isdigit())
+        self._next_id = self._jobs[-1] + 1 if self._jobs else 1
+
+        if self._jobs:
+            logger.info(f"Spool resumed with {len(self._jobs)} receipts")
+
+    def _job_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id:012d}.json")
+
+    def _write(self, job_id, job):
+        path = self._job_path(job_id)
+        with open(path + '.tmp', 'w', encoding='utf-8') as job_file:
+            json.dump(job, job_file)
+            job_file.flush()
+            os.fsync(job_file.fileno())
+        os.replace(path + '.tmp', path)
+
+    def _read(self, job_id):
+        with open(self._job_path(job_id), encoding='utf-8') as job_file:
+            return json.load(job_file)
+
+    def put(self, job):
+        """
+        Durably appends a job; never blocks on the printer.
+        """
+        with self._condition:
+            job_id = self._next_id
+            self._next_id += 1
+            job = dict(job, spooled_at=time.time(), attempts=0)
+            self._write(job_id, job)
+            self._jobs.append(job_id)
+            self._check_high_water()
+            self._condition.notify()
+
+        return job_id
+
+    def peek(self, timeout=None):
+        """
+        Returns (job_id, job) of the oldest job, waiting for one to arrive.
+        Returns (None, None) on timeout.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._jobs, timeout):
+                return None, None
+            job_id = self._jobs[0]
+
+        try:
+            return job_id, self._read(job_id)
+        except (OSError, ValueError) as e:
+            logger.error(f"Dropping unreadable spool job {job_id}: {e}")
+            self.remove(job_id)
+            return self.peek(timeout)
+
+    def update(self, job_id, job):
+        with self._condition:
+            if job_id in self._jobs:
+                self._write(job_id, job)
+
+    def remove(self, job_id):
+        with self._condition:
+            if job_id in self._jobs:
+                self._jobs.remove(job_id)
+            try:
+                os.remove(self._job_path(job_id))
+            except FileNotFoundError:
+                pass
+            self._check_high_water()
+
+    def jobs(self):
+        """
+        Returns all spooled jobs, oldest first.
+        """
+        with self._condition:
+            job_ids = list(self._jobs)
+
+        jobs = []
+        for job_id in job_ids:
+            try:
+                jobs.append(self._read(job_id))
+            except (OSError, ValueError):
+                pass
+        return jobs
+
+    def depth(self):
+        return len(self._jobs)
+
+    def stats(self):
+        with self._condition:
+            depth = len(self._jobs)
+            oldest = self._jobs[0] if self._jobs else None
+
+        oldest_age = None
+        if oldest is not None:
+            try:
+                oldest_age = round(time.time() - os.path.getmtime(self._job_path(oldest)), 1)
+            except OSError:
+                pass
+
+        return {"depth": depth, "high_water": self.high_water, "oldest_age": oldest_age}
+
+    def _check_high_water(self):
+        depth = len(self._jobs)
+        if self.high_water and depth >= self.high_water and not self._alerted:
+            self._alerted = True
+            logger.error(f"ALERT: print spool reached {depth} receipts (high water {self.high_water}), check the printer")
+        elif self._alerted and depth < self.high_water // 2:
+            self._alerted = False
+            logger.info(f"Print spool back to {depth} receipts")
@@ -0,0 +1,377 @@
+"""
+Synthetic TCPOS transaction generator
+
+Emits transaction XML shaped like the TCPOS 8.0.7 samples in `version807 xmls`
+so the parser and printer driver can be exercised with tickets of any size.
+
+Usage:
+    python tcpos_generator.py --out generated --count 20 --lines 150 --voids 0.1
+    python tcpos_generator.py --bench 2,10,50,100,300
+"""
+
+import argparse
+import copy
+import datetime
+import os
+import random
+import time
+import uuid
+import xml.etree.ElementTree as ET
+
+
+ROOT_TAG = "a7ac7e18-7a81-4a04-ba57-30e60aa5f368"
+SOFTWARE_VERSION = "8.0.7.669"
+TILL_ID = "15"
+
+BL = "TCPOS.FrontEnd.BusinessLogic."
+ARTICLE_TYPE = "DbArticle-db709ab2-6383-4f5a-b96d-bc7338239f55"
+PRICE_TYPE = "DbPrice-4f576f5c-e380-432f-b24d-3213093b04e1"
+MEASURE_UNIT_TYPE = "DbMeasureUnit-200dcb20-b4a9-4ead-b40e-d81488d317ae"
+DISCOUNT_TYPE = "DbDiscount-425d81d7-dbf8-4965-a92b-71e0d9f294d8"
+DISCOUNT_VALUE_TYPE = "DiscountValue-cdc574f5-c6e5-4c30-80ba-0cb67e208dc0"
+PAYMENT_TYPE = "DbPayment-b22bb99a-85a7-4974-a441-868e4dfea7d8"
+CUSTOMER_TYPE = "DbCustomer-3a8d6c49-0e0b-4a58-9c7b-1c2a3f6f1d2e"
+
+# code, description, price, vat percent (None = exempt, e.g. service lines)
+ARTICLES = [
+    ("2004", "Coca-Cola", "2.5", "9"),
+    ("2005", "Red Wine", "6.8", "9"),
+    ("2006", "Coffee", "1.2", "9"),
+    ("2008", "Cappuccino", "1.8", "9"),
+    ("3001", "Club Sandwich", "12.5", "9"),
+    ("3002", "Caesar Salad", "10.75", "9"),
+    ("3003", "Keshi Yena", "18.9", "9"),
+    ("3004", "Fish of the Day", "24.5", "9"),
+    ("4001", "Bottled Water", "1.5", "6"),
+    ("4002", "Daily Newspaper", "2.25", "7"),
+]
+
+PAYMENT_KINDS = [
+    ("1", "Cash payment", "Cash"),
+    ("2", "Cheques", "Cheque"),
+    ("3", "Credit Cards", "CreditCard"),
+    ("4", "Debit Cards", "DebitCard"),
+    ("6", "Voucher", "Voucher"),
+]
+
+WORDS = "table guest allergy extra ice no onions well done birthday window seat split bill later".split()
+
+
+def format_amount(value):
+    # TCPOS writes amounts without trailing zeros: 4.07, 5.5, 10
+    return f"{value:.2f}".rstrip("0").rstrip(".")
+
+
+def add_article(parent, item_id, timestamp, code, description, price, vat_percent,
+                quantity=1, voided=False, discount_percent=None):
+    attributes = {
+        "objectType": BL + "TransArticle",
+        "DefaultUOMFactor": "1",
+        "ValueOfRevertableQuantity": str(quantity),
+        "_usedPricelevelID": "2",
+        "_vatId": "1" if vat_percent else "0",
+        "creationTillID": TILL_ID,
+        "creationTimestamp": timestamp,
+        "itemID": str(item_id),
+        "operatorID": "1",
+        "printedStatus": "Analyzed",
+        "quantityWithPrecision": str(quantity),
+        "seatNumber": "",
+        "tillID": TILL_ID,
+    }
+    if vat_percent:
+        attributes["_vatPercent"] = vat_percent
+    else:
+        attributes["_enteredPrice"] = price
+        attributes["manualPrice"] = "true"
+    if voided:
+        attributes["deleteOperatorID"] = "1"
+        attributes["DeleteTimestamp"] = timestamp + ".000"
+
+    article = ET.SubElement(parent, BL + "TransArticle", attributes)
+    ET.SubElement(article, "Data", {
+        "objectType": ARTICLE_TYPE,
+        "Code": code,
+        "Description": description,
+        "ID": code,
+        "MeasureUnitID": "1",
+        "VisibilityCriteriaID": "1",
+    })
+
+    if discount_percent:
+        discount_amount = round(float(price) * quantity * discount_percent / 100, 2)
+        values = ET.SubElement(article, "DiscountValues", {"genericType": "List", "genericArgument": DISCOUNT_VALUE_TYPE})
+        ET.SubElement(values, DISCOUNT_VALUE_TYPE, {
+            "objectType": DISCOUNT_VALUE_TYPE,
+            "Amount": "-" + format_amount(discount_amount),
+            "AppliedOn": "LastArticle",
+            "Quantity": str(quantity),
+        })
+
+    ET.SubElement(article, "measureUnit", {
+        "objectType": MEASURE_UNIT_TYPE,
+        "Code": "pcs",
+        "Description": "Pieces",
+        "ID": "1",
+        "ShortDescription": "pcs",
+        "Type": "Count",
+    })
+    prices = ET.SubElement(article, "prices", {"objectType": PRICE_TYPE + "_x005B__x005D_", "length": "1"})
+    ET.SubElement(prices, "index_0", {"objectType": PRICE_TYPE, "ArticleID": code, "Price": price, "pricelevelId": "2"})
+
+    if discount_percent:
+        sub_items = ET.SubElement(article, "subItems", {"genericType": "List", "genericArgument": BL + "TransItem"})
+        add_discount(sub_items, item_id + 1, timestamp, discount_amount, discount_percent, "LastArticle")
+
+    return article
+
+
+def add_discount(parent, item_id, timestamp, amount, percent, applied_on):
+    discount = ET.SubElement(parent, BL + "TransDiscount", {
+        "objectType": BL + "TransDiscount",
+        "UnitDiscount": "-" + format_amount(amount),
+        "creationTillID": TILL_ID,
+        "creationTimestamp": timestamp,
+        "itemID": str(item_id),
+        "maximalDiscountAmount": "-" + format_amount(amount),
+        "operatorID": "1",
+        "quantity": "1",
+        "tillID": TILL_ID,
+    })
+    thresholds = ET.SubElement(discount, "AppliedThresholds", {"genericType": "List", "genericArgument": BL + "TransDiscount_x002B_AppliedThresholdItem"})
+    ET.SubElement(thresholds, BL + "TransDiscount_x002B_AppliedThresholdItem", {
+        "objectType": BL + "TransDiscount_x002B_AppliedThresholdItem",
+        "DiscountAmount": "-" + format_amount(amount),
+        "DiscountPercent": str(percent),
+    })
+    ET.SubElement(discount, "Data", {
+        "objectType": DISCOUNT_TYPE,
+        "AppliedOn": applied_on,
+        "Code": "001",
+        "Description": "Manual discount",
+        "ID": "1",
+        "IsValid": "true",
+        "Type": "PercentDiscount",
+    })
+    return discount
+
+
+def generate_transaction(line_count=10, void_ratio=0.0, item_discount_ratio=0.0, bill_discount_percent=0,
+                         payment_count=1, customer=False, comment_words=0, trans_num=1, seed=None):
+    """
+    Build one TCPOS transaction and return it as an XML string.
+
+    line_count: number of TransArticle lines, voided ones included
+    void_ratio: fraction of lines voided (deleteOperatorID set)
+    item_discount_ratio: fraction of sold lines carrying a 20% item discount
+    bill_discount_percent: whole-bill percent discount, 0 for none
+    payment_count: number of TransPayment entries splitting the total
+    customer: add a TransCustomer so the printer issues a fiscal credit invoice
+    comment_words: number of words in the transaction Comment (footer notes)
+    """
+    rng = random.Random(seed)
+    now = datetime.datetime.now()
+    timestamp = now.strftime("%Y%m%dT%H%M%S")
+    item_id = 1000
+
+    root = ET.Element(ROOT_TAG, {"objectType": ROOT_TAG, "version": "2"})
+    data_attributes = {
+        "objectType": BL + "Transaction",
+        "BookkeepingDate": now.strftime("%Y%m%d"),
+        "CashierID": "1",
+        "GUID": uuid.UUID(int=rng.getrandbits(128)).hex.upper(),
+        "SoftwareVersion": SOFTWARE_VERSION,
+        "TransNum": str(trans_num),
+        "closed": "true",
+        "creationTillID": TILL_ID,
+        "creationTimestamp": timestamp,
+        "operatorID": "1",
+        "tillID": TILL_ID,
+        "transDate": timestamp,
+        "vatIndex": "1",
+    }
+    if comment_words:
+        data_attributes["Comment"] = " ".join(rng.choice(WORDS) for _ in range(comment_words))
+    data = ET.SubElement(root, "data", data_attributes)
+    sub_items = ET.SubElement(data, "subItems", {"genericType": "List", "genericArgument": BL + "TransItem"})
+
+    if customer:
+        customer_element = ET.SubElement(sub_items, BL + "TransCustomer", {"objectType": BL + "TransCustomer", "itemID": str(item_id)})
+        ET.SubElement(customer_element, "Data", {
+            "objectType": CUSTOMER_TYPE,
+            "Code": str(rng.randint(100000000, 999999999)),
+            "Description": "Customer",
+            "FirstName": "Generated",
+        })
+
+    total = 0.0
+    for line in range(max(1, line_count)):
+        item_id += 10
+        code, description, price, vat_percent = rng.choice(ARTICLES)
+        quantity = rng.choice([1, 1, 1, 2, 3])
+        voided = rng.random() < void_ratio
+        discount_percent = 20 if (not voided and rng.random() < item_discount_ratio) else None
+        add_article(sub_items, item_id, timestamp, code, description, price, vat_percent,
+                    quantity=quantity, voided=voided, discount_percent=discount_percent)
+        if not voided:
+            line_total = float(price) * quantity
+            if discount_percent:
+                line_total -= round(line_total * discount_percent / 100, 2)
+            total += line_total
+
+    if bill_discount_percent:
+        item_id += 10
+        bill_discount = round(total * bill_discount_percent / 100, 2)
+        add_discount(sub_items, item_id, timestamp, bill_discount, bill_discount_percent, "WholeTransaction")
+        total -= bill_discount
+
+    total = round(total, 2)
+    data.set("total", format_amount(total))
+
+    # split the total over the payments, the last one takes the remainder
+    payment_count = max(1, payment_count)
+    remaining = total
+    for index in range(payment_count):
+        item_id += 10
+        if index == payment_count - 1:
+            amount = remaining
+        else:
+            amount = round(total / payment_count, 2)
+            remaining = round(remaining - amount, 2)
+        code, description, payment_type = PAYMENT_KINDS[index % len(PAYMENT_KINDS)]
+        payment_element = ET.SubElement(sub_items, BL + "TransPayment", {
+            "objectType": BL + "TransPayment",
+            "amount": format_amount(amount),
+            "creationTillID": TILL_ID,
+            "creationTimestamp": timestamp,
+            "itemID": str(item_id),
+            "operatorID": "1",
+            "positioning": "BottomBottom",
+            "tillID": TILL_ID,
+        })
+        ET.SubElement(payment_element, "Data", {
+            "objectType": PAYMENT_TYPE,
+            "Code": code,
+            "Description": description,
+            "ID": code,
+            "Type": payment_type,
+        })
+
+    ET.indent(root, space=" ")
+    return '<?xml version="1.0" encoding="utf-8" standalone="yes"?>\n' + ET.tostring(root, encoding="unicode")
+
+
+def write_transactions(folder, count, first_trans_num=1, **kwargs):
+    """
+    Write `count` generated transactions into `folder` using TCPOS file names.
+    Returns the list of written paths.
+    """
+    os.makedirs(folder, exist_ok=True)
+    seed = kwargs.pop("seed", None)
+    paths = []
+    for index in range(count):
+        trans_num = first_trans_num + index
+        xml_string = generate_transaction(trans_num=trans_num, seed=None if seed is None else seed + index, **kwargs)
+        filename = f"Trn {time.strftime('%H-%M-%S')} #{trans_num}.xml"
+        path = os.path.join(folder, filename)
+        with open(path, "w", encoding="utf-8") as xml_file:
+            xml_file.write(xml_string)
+        paths.append(path)
+
+    return paths
+
+
+def benchmark(line_counts, repeat=5, **kwargs):
+    """
+    Time get_sub_items, split_comment_into_lines and print_document (with the
+    printer in DEBUG mode, so no serial traffic) for each ticket size.
+    Returns a list of dicts with the best time in milliseconds per stage.
+    """
+    import logging
+    import xmltodict
+    import tcpos_parser
+    import cts310ii
+    from logger_module import logger
+
+    previous_level = logger.level
+    previous_debug = cts310ii.DEBUG
+    logger.setLevel(logging.CRITICAL)
+    cts310ii.DEBUG = True
+
+    results = []
+    try:
+        for line_count in line_counts:
+            xml_string = generate_transaction(line_count=line_count, comment_words=line_count, seed=line_count, **kwargs)
+            xml_json_object = xmltodict.parse(xml_string)
+            tcpos_parser.transaction_uuid = tcpos_parser.get_transaction_uuid(xml_json_object)
+            comment = xml_json_object[tcpos_parser.transaction_uuid]['data'].get('@Comment', '')
+
+            timings = {"parse": [], "sub_items": [], "comment": [], "print": []}
+            for _ in range(repeat):
+                start = time.perf_counter()
+                xmltodict.parse(xml_string)
+                timings["parse"].append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                items, tips = tcpos_parser.get_sub_items(xml_json_object)
+                timings["sub_items"].append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                cts310ii.split_comment_into_lines(comment)
+                timings["comment"].append(time.perf_counter() - start)
+
+                payments = tcpos_parser.get_payment_details(xml_json_object)
+                start = time.perf_counter()
+                cts310ii.print_document(copy.deepcopy(items), copy.deepcopy(payments), None, copy.deepcopy(tips),
+                                        "1", False, None, comment, None)
+                timings["print"].append(time.perf_counter() - start)
+
+            results.append({
+                "lines": line_count,
+                **{stage: round(min(values) * 1000, 3) for stage, values in timings.items()},
+            })
+    finally:
+        logger.setLevel(previous_level)
+        cts310ii.DEBUG = previous_debug
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic TCPOS transaction XML files")
+    parser.add_argument("--out", default="generated_transactions", help="output folder")
+    parser.add_argument("--count", type=int, default=10, help="number of transactions to write")
+    parser.add_argument("--lines", type=int, default=10, help="article lines per transaction")
+    parser.add_argument("--voids", type=float, default=0.0, help="fraction of voided lines")
+    parser.add_argument("--item-discounts", type=float, default=0.0, help="fraction of lines with a 20%% item discount")
+    parser.add_argument("--bill-discount", type=float, default=0, help="whole-bill discount percent")
+    parser.add_argument("--payments", type=int, default=1, help="payments per transaction")
+    parser.add_argument("--customer", action="store_true", help="attach a customer to every transaction")
+    parser.add_argument("--comment-words", type=int, default=0, help="words in the transaction comment")
+    parser.add_argument("--first", type=int, default=1, help="first TransNum")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for reproducible output")
+    parser.add_argument("--bench", default=None, help="comma separated line counts to benchmark instead of writing files")
+    args = parser.parse_args()
+
+    options = {
+        "void_ratio": args.voids,
+        "item_discount_ratio": args.item_discounts,
+        "bill_discount_percent": args.bill_discount,
+        "payment_count": args.payments,
+        "customer": args.customer,
+    }
+
+    if args.bench:
+        line_counts = [int(value) for value in args.bench.split(",")]
+        print(f"{'lines':>6} {'parse ms':>10} {'sub_items ms':>13} {'comment ms':>11} {'print ms':>10}")
+        for row in benchmark(line_counts, **options):
+            print(f"{row['lines']:>6} {row['parse']:>10} {row['sub_items']:>13} {row['comment']:>11} {row['print']:>10}")
+        return
+
+    paths = write_transactions(args.out, args.count, first_trans_num=args.first, seed=args.seed,
+                               comment_words=args.comment_words, line_count=args.lines, **options)
+    print(f"Wrote {len(paths)} transaction(s) to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
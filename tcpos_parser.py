@@ -6,8 +6,18 @@ import xml.etree.ElementTree as ET
 import json
 import xmltodict
 import os
+import queue
+import hashlib
+import re
 import sys
-from logger_module import logger
+from logger_module import logger, lazy_json
+import config_service
+import folder_watcher
+import metrics
+import processing_state
+import registry
+import sales_rollup
+import spool
 
 
 if getattr(sys, 'frozen', False):
@@ -20,6 +30,24 @@ elif __file__:
 transaction_uuid = None
 supported_version = "8.0"
 
+# write-completion detection
+write_check_interval = 0.05  # seconds between probes while a file is still being written
+write_wait_timeout = 5  # seconds tcpos_parse_transaction waits for an incomplete file
+write_settle_time = 2  # seconds a file without closing tag must stay unchanged before it is parsed anyway
+write_probes_limit = 1000  # files tracked for write_settle_time before settled ones are forgotten
+
+# folder watching
+watch_debounce = 0.05  # seconds a file must be quiet before it is picked up
+reconcile_interval = 60  # seconds between full rescans catching events the OS watcher missed
+scan_lookback_days = 31  # full scans skip subtrees unchanged for longer than this, 0 scans everything
+pipeline_queue_size = 4  # transactions buffered between the parse, build and print stages
+
+# print spool
+spool_high_water = 50  # spooled receipts that raise an alert
+spool_retry_delay = 1  # seconds before the first retry while the printer is offline
+spool_retry_max_delay = 30  # seconds, upper bound of the exponential backoff
+fiscal_day_check_interval = 300  # idle seconds between checks for a Z report closed outside the hub
+
 tax_ids = {
     "6": "1",  # tax percent : printer tax id
     "7": "2",
@@ -41,6 +69,18 @@ payment_methods = {
 }
 
 
+def use_printer_tax_ids(printer):
+    """
+    Takes the printer's current tax mapping for the next parse. The driver
+    replaces its mapping as a whole when the fiscal information changes, so
+    one parse always sees a complete one.
+    """
+    global tax_ids
+    mapping = getattr(printer, 'tax_ids', None)
+    if isinstance(mapping, dict):
+        tax_ids = mapping
+
+
 def get_transaction_uuid(xml_json_object):
     logger.debug("Getting transaction uuid...")
     # loop through keys values
@@ -57,7 +97,7 @@ def get_vat_information(xml_json_object):
     for vat in xml_json_object[transaction_uuid]['data']['VatDetails']['TCPOS.FrontEnd.BusinessLogic.VatDetail']:
         vat_information[vat['Data']['@ID']] = vat['Data']['@Percent']
 
-    # logger.debug(json.dumps(vat_information, indent=4))
+    # logger.debug("%s", lazy_json(vat_information))
     return vat_information
 
 
@@ -116,6 +156,229 @@ def split_printout_notes(printout_notes, max_chars=48):
     return (line1, line2)
 
 
+def read_root_tag(head):
+    """
+    Returns the root element name (bytes) from the first bytes of an XML file,
+    skipping the XML declaration and comments.
+    """
+    position = 0
+    while True:
+        start = head.find(b'<', position)
+        if start == -1 or start + 1 >= len(head):
+            return None
+
+        if head[start + 1:start + 2] in (b'?', b'!'):
+            position = start + 1
+            continue
+
+        match = re.match(rb'<([^\s/>]+)', head[start:])
+        return match.group(1) if match else None
+
+
+def has_closing_tag(filename):
+    """
+    Checks that the file ends with the closing tag of its root element,
+    which TCPOS writes last.
+    """
+    with open(filename, 'rb') as xml_file:
+        head = xml_file.read(512)
+        root_tag = read_root_tag(head)
+        if not root_tag:
+            return False
+
+        xml_file.seek(0, os.SEEK_END)
+        size = xml_file.tell()
+        xml_file.seek(max(0, size - 512))
+        tail = xml_file.read().rstrip()
+
+    return tail.endswith(b'</' + root_tag + b'>')
+
+
+_write_probes = {}  # path: ((size, mtime), first seen) of files without closing tag yet
+_write_probes_lock = threading.Lock()
+
+
+def is_write_complete(filename):
+    """
+    Non-blocking check whether TCPOS has finished writing a transaction file.
+
+    A file is complete when it is not held open by the writer (Windows only,
+    probed with a rename onto itself) and ends with its root closing tag.
+    Files that never get a closing tag are released once their size and mtime
+    have been stable for write_settle_time, so the parser can reject them.
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        _write_probes.pop(filename, None)
+        return False
+
+    # settled once size and mtime are unchanged since a probe write_settle_time ago
+    now = time.time()
+    signature = (stat.st_size, stat.st_mtime)
+    with _write_probes_lock:
+        probe = _write_probes.get(filename)
+        if probe is None or probe[0] != signature:
+            if len(_write_probes) >= write_probes_limit:
+                for path, (_, first_seen) in list(_write_probes.items()):
+                    if now - first_seen >= write_settle_time:
+                        del _write_probes[path]
+            _write_probes[filename] = probe = (signature, now)
+    settled = now - probe[1] >= write_settle_time
+
+    if os.name == 'nt':
+        try:
+            # fails with a sharing violation while TCPOS still has the file open
+            os.rename(filename, filename)
+        except PermissionError:
+            return False
+        except OSError:
+            pass
+
+    if stat.st_size == 0:
+        return settled
+
+    try:
+        if has_closing_tag(filename):
+            _write_probes.pop(filename, None)
+            return True
+    except OSError:
+        return False
+
+    return settled
+
+
+def wait_until_written(filename, timeout=None):
+    """
+    Waits until is_write_complete() or the timeout expires.
+    Returns True when the file is complete.
+    """
+    if timeout is None:
+        timeout = write_wait_timeout
+
+    deadline = time.time() + timeout
+    while not is_write_complete(filename):
+        if time.time() >= deadline:
+            return False
+        time.sleep(write_check_interval)
+
+    return True
+
+
+def sniff_transaction_header(filename, chunk_size=4096, min_version=None):
+    """
+    Fast pre-scan of a transaction file without building the full tree.
+
+    Reads only until the transaction's subItems start and returns a dict with
+    uuid, software_version, trans_num, guid, total, storno_type, supported
+    and is_credit_note, or None when the file is empty or not a TCPOS transaction.
+    The full parse in tcpos_parse_transaction stays authoritative; the header
+    is meant for early rejection and ordering.
+    """
+    header = None
+    depth = 0
+    parser = ET.XMLPullParser(events=('start', 'end'))
+
+    try:
+        with open(filename, 'rb') as xml_file:
+            while True:
+                chunk = xml_file.read(chunk_size)
+                if not chunk:
+                    break
+                parser.feed(chunk)
+
+                for event, element in parser.read_events():
+                    if event == 'end':
+                        depth -= 1
+                        continue
+
+                    depth += 1
+                    if depth == 1:
+                        header = {"uuid": element.tag}
+
+                    elif depth == 2 and element.tag == 'data' and header is not None and "software_version" not in header:
+                        header["software_version"] = element.get('SoftwareVersion', '')
+                        header["trans_num"] = element.get('TransNum', '')
+                        header["guid"] = element.get('GUID', '')
+                        header["total"] = element.get('total', '0')
+                        header["storno_type"] = ''
+
+                    elif depth == 3 and element.tag == 'StornoDetails':
+                        header["storno_type"] = element.get('StornoType', '')
+
+                    elif depth == 3 and element.tag == 'subItems':
+                        # everything we need is in front of the sub items
+                        chunk = b''
+                        break
+
+                if not chunk:
+                    break
+
+    except (OSError, ET.ParseError) as e:
+        logger.debug("Header sniff failed for %s: %s", filename, e)
+        return None
+
+    if header is None or "software_version" not in header:
+        return None
+
+    try:
+        header["supported"] = Version(header["software_version"]) >= Version(min_version or supported_version)
+    except Exception:
+        header["supported"] = False
+
+    try:
+        header["is_credit_note"] = float(header["total"]) < 0 or header["storno_type"] == 'StornoChild'
+    except (ValueError, TypeError):
+        header["is_credit_note"] = header["storno_type"] == 'StornoChild'
+
+    return header
+
+
+def transaction_sort_key(header):
+    """
+    Orders pending files by TCPOS transaction number, unknown numbers last.
+    """
+    trans_num = header.get("trans_num", '') if header else ''
+    return (0, int(trans_num)) if trans_num.isdigit() else (1, 0)
+
+
+def file_content_hash(filename):
+    with open(filename, 'rb') as xml_file:
+        return hashlib.sha256(xml_file.read()).hexdigest()
+
+
+def receipt_key(header, content_hash):
+    """
+    Idempotency key of a printed receipt: the transaction GUID (data@GUID; the
+    root tag is the same type GUID for every transaction) plus the content hash,
+    so a rewritten transaction is printed again and a copied one is not.
+    """
+    guid = header.get("guid") or f"{header['uuid']}#{header['trans_num']}"
+    return f"{guid}:{content_hash}"
+
+
+def reconcile_receipt(state, receipt, printer):
+    """
+    Resolves a receipt left in the prepared state by a crash or a failed print.
+
+    Without a document number the printer never opened the document, so it
+    cannot have been closed. Otherwise the document is searched in the
+    printer's transaction memory. Returns the updated receipt, which stays
+    prepared when the printer cannot be asked.
+    """
+    if not receipt["document_number"]:
+        new_state = processing_state.ABORTED
+    else:
+        found = printer.search_document(receipt["document_number"], receipt["doc_type"])
+        if found is None:
+            return receipt
+        new_state = processing_state.COMMITTED if found else processing_state.ABORTED
+
+    state.update_receipt(receipt["key"], new_state)
+    logger.info("Receipt for TransNum %s (document %s) reconciled as %s", receipt['trans_num'], receipt['document_number'], new_state)
+    return dict(receipt, state=new_state)
+
+
 def check_file_version(xml_json_object):
     version = xml_json_object[transaction_uuid]['data']["@SoftwareVersion"]
 
@@ -413,7 +676,7 @@ def get_sub_items(xml_json_object):
                 # Convert gross to net price for tax-exempt items
                 if item_data['tax_id'] == "0" and original_vat_rate > 0:
                     paid_unit_price = round(paid_unit_price / (1 + original_vat_rate), 2)
-                    logger.info(f"Tax-exempt item: converted gross price to net (÷ {1 + original_vat_rate:.2f}), new price: {paid_unit_price}")
+                    logger.info("Tax-exempt item: converted gross price to net (÷ %.2f), new price: %s", 1 + original_vat_rate, paid_unit_price)
 
                 # Get item-level discount/surcharge (if any positive quantity item has one)
                 item_discount = None
@@ -440,10 +703,10 @@ def get_sub_items(xml_json_object):
                 }
 
                 if item_discount:
-                    logger.info(f"Item {product_code} has {'discount' if item_discount['type'] == '1' else 'surcharge'} - type: {item_discount['type']}, amount: {item_discount['amount']}, percent: {item_discount['percent']}")
+                    logger.info("Item %s has %s - type: %s, amount: %s, percent: %s", product_code, 'discount' if item_discount['type'] == '1' else 'surcharge', item_discount['type'], item_discount['amount'], item_discount['percent'])
 
                 sub_items.append(item_dict)
-                logger.info(f"Item {product_code} ({product_title}) - Paid: {paid_quantity}x @ {paid_unit_price}, tax_id: {item_dict['tax']}")
+                logger.info("Item %s (%s) - Paid: %sx @ %s, tax_id: %s", product_code, product_title, paid_quantity, paid_unit_price, item_dict['tax'])
 
             # Add voided items (negative quantities) as separate line with price 0
             if negative_quantities:
@@ -463,7 +726,7 @@ def get_sub_items(xml_json_object):
                     "discount_amount": "000",
                     "discount_percent": "000",
                 })
-                logger.info(f"Item {product_code} ({product_title}) - Voided: {voided_quantity}x @ 0.00")
+                logger.info("Item %s (%s) - Voided: %sx @ 0.00", product_code, product_title, voided_quantity)
 
         # Process TransMenu (combo deals/menus)
         if "TCPOS.FrontEnd.BusinessLogic.TransMenu" in xml_json_object[transaction_uuid]['data']['subItems']:
@@ -564,9 +827,9 @@ def get_sub_items(xml_json_object):
                 })
 
         logger.debug("Sub items:")
-        logger.debug(json.dumps(sub_items, indent=4))
+        logger.debug("%s", lazy_json(sub_items))
         logger.debug("Tips:")
-        logger.debug(json.dumps(tips, indent=4))
+        logger.debug("%s", lazy_json(tips))
         return sub_items, tips
 
     except Exception as e:
@@ -588,7 +851,7 @@ def get_service_charge(xml_json_object):
         }
 
         logger.debug("Service charge:")
-        logger.debug(json.dumps(service, indent=4))
+        logger.debug("%s", lazy_json(service))
 
         return service
 
@@ -622,7 +885,7 @@ def get_customer_info(xml_json_object):
             else:
                 return None
 
-            logger.info(f"Customer found: {full_name}, Code: {code}")
+            logger.info("Customer found: %s, Code: %s", full_name, code)
             return {
                 "name": full_name,
                 "code": code
@@ -695,8 +958,8 @@ def get_discount(xml_json_object):
                     "percent": "000",  # Not using percent for fixed amount
                 }
 
-            logger.debug(f"Transaction {'surcharge' if is_surcharge else 'discount'}:")
-            logger.debug(json.dumps(discount, indent=4))
+            logger.debug("Transaction %s:", 'surcharge' if is_surcharge else 'discount')
+            logger.debug("%s", lazy_json(discount))
 
             return discount
 
@@ -719,7 +982,7 @@ def get_payment_details(xml_json_object):
                 amount_str = str(payment['@amount'])
                 if amount_str.startswith('-'):
                     amount_str = amount_str[1:]  # Remove leading minus
-                    logger.debug(f"Credit note payment: stripped negative sign from {payment['@amount']} -> {amount_str}")
+                    logger.debug("Credit note payment: stripped negative sign from %s -> %s", payment['@amount'], amount_str)
 
                 payment_details.append({
                     "type": "1",
@@ -733,7 +996,7 @@ def get_payment_details(xml_json_object):
             amount_str = str(xml_json_object[transaction_uuid]['data']['subItems']['TCPOS.FrontEnd.BusinessLogic.TransPayment']['@amount'])
             if amount_str.startswith('-'):
                 amount_str = amount_str[1:]  # Remove leading minus
-                logger.debug(f"Credit note payment: stripped negative sign from {xml_json_object[transaction_uuid]['data']['subItems']['TCPOS.FrontEnd.BusinessLogic.TransPayment']['@amount']} -> {amount_str}")
+                logger.debug("Credit note payment: stripped negative sign from %s -> %s", xml_json_object[transaction_uuid]['data']['subItems']['TCPOS.FrontEnd.BusinessLogic.TransPayment']['@amount'], amount_str)
 
             payment_details.append({
                 "type": "1",
@@ -743,7 +1006,7 @@ def get_payment_details(xml_json_object):
             })
 
         logger.debug("Payment details:")
-        logger.debug(json.dumps(payment_details, indent=4))
+        logger.debug("%s", lazy_json(payment_details))
         return payment_details
 
     except Exception as e:
@@ -762,13 +1025,21 @@ def tcpos_parse_transaction(filename):
         if not os.path.exists(filename):
             raise Exception(f"File does not exist: {filename}")
 
+        # Returns immediately for complete files, only waits while TCPOS is still writing
+        if not wait_until_written(filename):
+            raise Exception(f"File is still being written: {filename}")
+
         file_size = os.path.getsize(filename)
         if file_size == 0:
             raise Exception(f"File is empty (0 bytes): {filename}")
 
-        # Check if file is still being written to by trying to open it exclusively
-        # Wait a bit to ensure TCPOS has finished writing
-        time.sleep(0.5)
+        # Reject files that are not supported transactions before the full parse
+        header = sniff_transaction_header(filename)
+        if header is None:
+            raise Exception(f"Not a TCPOS transaction file: {filename}")
+
+        if not header["supported"]:
+            raise Exception(f"Unsupported version: {header['software_version']}, file: {filename}")
 
         with open(filename, 'r', encoding='utf-8') as xml_file:
             # Read content first to check if it's valid
@@ -787,7 +1058,7 @@ def tcpos_parse_transaction(filename):
         xml_data = xml_tree.getroot()
         xmlstr = ET.tostring(xml_data, encoding='utf-8', method='xml')
         xml_json_object = xmltodict.parse(xmlstr)
-        logger.info(f"File: {filename}")
+        logger.info("File: %s", filename)
 
         if 0:
             # save to file
@@ -796,14 +1067,10 @@ def tcpos_parse_transaction(filename):
 
 
         transaction_uuid = get_transaction_uuid(xml_json_object)
-        logger.debug(f"Transaction UUID: {transaction_uuid}")
+        logger.debug("Transaction UUID: %s", transaction_uuid)
         # vat_information = get_vat_information(xml_json_object)
         # logger.debug(f"VAT information: {vat_information}")
-        # check version
-        version = xml_json_object[transaction_uuid]['data']["@SoftwareVersion"]
-
-        if Version(version) < Version(supported_version):
-            raise Exception(f"Unsupported version: {xml_json_object[transaction_uuid]['data']['@SoftwareVersion']}, file: {filename}")
+        # version was already checked by sniff_transaction_header
 
         items, tips = get_sub_items(xml_json_object)
         payments = get_payment_details(xml_json_object)
@@ -828,7 +1095,7 @@ def tcpos_parse_transaction(filename):
             total_amount = float(total_str)
             if total_amount < 0:
                 is_credit_note = True
-                logger.info(f"Credit note detected via negative total: {total_amount}")
+                logger.info("Credit note detected via negative total: %s", total_amount)
         except (ValueError, TypeError):
             pass
 
@@ -839,7 +1106,7 @@ def tcpos_parse_transaction(filename):
                 storno_type = storno_details.get('@StornoType', '')
                 if storno_type == 'StornoChild':
                     is_credit_note = True
-                    logger.info(f"Credit note detected via StornoType: {storno_type}")
+                    logger.info("Credit note detected via StornoType: %s", storno_type)
 
         return items, payments, service_charge, tips, trans_num, is_credit_note, discount, comment, customer
 
@@ -849,9 +1116,53 @@ def tcpos_parse_transaction(filename):
     return None, None, None, None, None, False, None, None, None
 
 
+def transaction_from_model(model):
+    """
+    Builds the tcpos_parse_transaction result from the JSON model accepted by
+    the ingest API: an object with items and payments (same shape as the
+    parser output) and optional service_charge, tips, trans_num,
+    is_credit_note, discount, comment and customer.
+    """
+    if not isinstance(model, dict):
+        raise ValueError("transaction must be an object")
+    if not model.get("items") or not isinstance(model["items"], list):
+        raise ValueError("transaction has no items")
+    if not model.get("payments") or not isinstance(model["payments"], list):
+        raise ValueError("transaction has no payments")
+
+    return (model["items"], model["payments"], model.get("service_charge"), model.get("tips", []),
+            str(model.get("trans_num", "")), bool(model.get("is_credit_note", False)),
+            model.get("discount"), model.get("comment", ""), model.get("customer"))
+
+
+def ingest_header(path, min_version=None):
+    """
+    Returns the pipeline header of a transaction stored by the ingest API,
+    raising ValueError when it cannot be printed.
+    """
+    if path.endswith('.json'):
+        with open(path, encoding='utf-8') as model_file:
+            model = json.load(model_file)
+        transaction = transaction_from_model(model)
+        return {
+            "uuid": None,
+            "guid": model.get("guid") or "ingest:" + os.path.splitext(os.path.basename(path))[0],
+            "trans_num": transaction[4],
+            "is_credit_note": transaction[5],
+            "supported": True,
+        }
+
+    header = sniff_transaction_header(path, min_version=min_version)
+    if header is None:
+        raise ValueError("not a TCPOS transaction")
+    if not header["supported"]:
+        raise ValueError(f"unsupported version {header['software_version']}")
+    return header
+
+
 def migrate_renamed_files(transactions_folder):
     """
-    One-time migration: Convert old renamed files back to original names
+    Migration 1: Convert old renamed files back to original names
     and create marker files instead
     """
     for root, dirs, files in os.walk(transactions_folder):
@@ -887,55 +1198,543 @@ def migrate_renamed_files(transactions_folder):
                     logger.info(f"Migrated: {file} -> {original_name}")
 
 
-def files_watchdog():
-    config = json.load(open('config.json'))
+def find_transaction_files(transactions_folder, state, lookback_days=None):
+    """
+    Scans the transactions folder for .xml files that are not done yet.
 
-    if config['printer']['name'] == 'cts310ii':
-        import cts310ii
+    Uses the directory watermarks kept in the processing state: a directory
+    whose mtime did not change since a scan that found nothing left to do is
+    not listed again (only its known subdirectories are checked), and a
+    subtree with no change inside the lookback window is skipped entirely.
+    Changes in pruned subtrees are still picked up through watcher events.
+    """
+    cutoff = time.time() - lookback_days * 86400 if lookback_days else None
+    paths = []
+    updates = {}
 
-    # Run one-time migration
-    logger.info("Running file migration...")
-    migrate_renamed_files(config['pos']['transactions_folder'])
-    logger.info("File migration complete")
+    def scan(directory, mtime):
+        """
+        Returns the newest directory mtime in the subtree.
+        """
+        cached = state.get_directory(directory)
 
-    while True:
-        for root, dirs, files in os.walk(config['pos']['transactions_folder']):
-            for file in files:
+        if cached and cached["mtime"] == mtime and cached["settled"]:
+            if cutoff and cached["subtree_mtime"] < cutoff:
+                return cached["subtree_mtime"]
+
+            subtree_mtime = mtime
+            for child in cached["children"]:
+                try:
+                    subtree_mtime = max(subtree_mtime, scan(child, os.stat(child).st_mtime))
+                except OSError:
+                    pass  # removed, the parent mtime changes with it
+
+            if subtree_mtime != cached["subtree_mtime"]:
+                updates[directory] = dict(cached, subtree_mtime=subtree_mtime)
+            return subtree_mtime
+
+        children = []
+        settled = True
+        with os.scandir(directory) as entries:
+            for entry in entries:
                 try:
-                    if file.endswith('.xml'):
-                        # Skip if already processed or skipped (marker file exists)
-                        marker_processed = os.path.join(root, file + '.processed')
-                        marker_skipped = os.path.join(root, file + '.skipped')
+                    if entry.is_dir():
+                        children.append((entry.path, entry.stat().st_mtime))
+                    elif entry.name.endswith('.xml') and not state.is_done(entry.path) and state.can_retry(entry.path):
+                        # failed ones wait for their retry delay, the directory stays unsettled meanwhile
+                        if state.retry_due(entry.path):
+                            paths.append(entry.path)
+                        settled = False
+                except OSError:
+                    settled = False
+
+        subtree_mtime = mtime
+        for child, child_mtime in children:
+            try:
+                subtree_mtime = max(subtree_mtime, scan(child, child_mtime))
+            except OSError:
+                settled = False
+
+        updates[directory] = {
+            "mtime": mtime,
+            "subtree_mtime": subtree_mtime,
+            "settled": settled,
+            "children": [child for child, _ in children],
+        }
+        return subtree_mtime
+
+    # mtime is read before the listing so files added meanwhile mark the directory changed
+    scan(transactions_folder, os.stat(transactions_folder).st_mtime)
+
+    if updates:
+        state.save_directories(updates)
+
+    return paths
+
+
+def watched_subdirectories(state, lookback_days=None):
+    """
+    Returns a FolderWatcher subdirectories callback that takes a directory's
+    subdirectories from the watermark of the last scan while its mtime is
+    unchanged, so starting the watcher does not list every file of the
+    transactions tree. Below a subtree with no change inside the lookback
+    window nothing is watched, like the scan skips it; the directory itself
+    stays watched and is scanned again once its mtime changes.
+    """
+    cutoff = time.time() - lookback_days * 86400 if lookback_days else None
+
+    def subdirectories(directory):
+        cached = state.get_directory(directory)
+        try:
+            if cached is None or cached["mtime"] != os.stat(directory).st_mtime:
+                return None
+        except OSError:
+            return None
+
+        if cutoff and cached["settled"] and cached["subtree_mtime"] < cutoff:
+            return []
+        return cached["children"]
+
+    return subdirectories
+
+
+def get_sources(pos_config):
+    """
+    Returns the transaction sources from the pos config section.
+
+    pos.sources is a list of {name, transactions_folder, priority} that may
+    override the per-source settings (supported_version, scan_lookback_days,
+    watch_debounce, reconcile_interval) set for all sources in pos. Without it
+    pos.transactions_folder is a single source named 'default'.
+    """
+    defaults = {
+        "priority": 1,
+        "supported_version": supported_version,
+        "scan_lookback_days": scan_lookback_days,
+        "watch_debounce": watch_debounce,
+        "reconcile_interval": reconcile_interval,
+    }
+    for key in defaults:
+        if key in pos_config and key != "priority":
+            defaults[key] = pos_config[key]
+
+    configured = pos_config.get('sources') or [{"name": "default", "transactions_folder": pos_config['transactions_folder']}]
+
+    sources = []
+    for index, source_config in enumerate(configured):
+        source = dict(defaults, name=f"source{index + 1}")
+        source.update(source_config)
+        source["priority"] = max(1, int(source["priority"]))
+        sources.append(source)
+
+    return sources
 
-                        if os.path.exists(marker_processed) or os.path.exists(marker_skipped):
-                            continue  # Already processed, skip
 
-                        logger.debug("File found: " + os.path.join(root, file))
-                        items, payments, service_charge, tips, trans_num, is_credit_note, discount, comment, customer = tcpos_parse_transaction(os.path.join(root, file))
+def files_watchdog(printer_ready=None):
+    """
+    Watches the transaction sources and prints new receipts. With printer_ready
+    (a threading.Event) files are picked up and spooled right away, and
+    printing starts once the event is set by the printer initialization.
+    """
+    config = config_service.get()
+    sources = get_sources(config['pos'])
+
+    printer = registry.get_printer(config['printer']['name'])
+
+    # Processing state lives in one store instead of marker files next to each XML
+    state = processing_state.ProcessingState()
+    rollups = sales_rollup.get_rollups()
+
+    # One-time migrations, each runs once per transactions folder
+    for source in sources:
+        state.run_migrations(processing_state.normalize_path(source['transactions_folder']), [
+            (1, "restore renamed .xml.processed/.xml.skipped files", migrate_renamed_files),
+            (2, "import legacy marker files", state.import_marker_files),
+        ])
+
+    # Staged pipeline: discovery (one thread per source) -> fair merge (this thread)
+    # -> parse -> build -> spool -> print.
+    # Bounded queues let the next receipt be parsed while the current one prints;
+    # the disk spool keeps accepting receipts while the printer is offline.
+    parse_queue = queue.Queue(maxsize=pipeline_queue_size)
+    build_queue = queue.Queue(maxsize=pipeline_queue_size)
+    print_spool = spool.Spool(high_water=config.get('spool', {}).get('high_water', spool_high_water))
+
+    # paths handed to the pipeline that have no final state yet, spooled ones included;
+    # normalized like the processing state keys, so one file is never queued twice
+    in_flight = set(processing_state.normalize_path(job["path"]) for job in print_spool.jobs())
+    in_flight_lock = threading.Lock()
+
+    ingest = None  # loopback ingest API, see ingest_api.py
+
+    def finish(path, status, trans_num=None, document_number=None, error=None, content_hash=None):
+        state.record(path, status, trans_num, document_number, error, content_hash)
+        with in_flight_lock:
+            in_flight.discard(processing_state.normalize_path(path))
+        if ingest is not None:
+            ingest.finished(path)
+
+    def parse_stage():
+        # tax ids are chosen while parsing, wait for the tax rates read from the printer
+        if printer_ready is not None:
+            printer_ready.wait()
+
+        while True:
+            header, path = parse_queue.get()
+            file = os.path.basename(path)
+            try:
+                use_printer_tax_ids(printer)
+                logger.debug("File found: %s (TransNum %s%s)", path, header['trans_num'], ', credit note' if header['is_credit_note'] else '')
+                started = time.perf_counter()
+                content_hash = file_content_hash(path)
+                if path.endswith('.json'):
+                    with open(path, encoding='utf-8') as model_file:
+                        transaction = transaction_from_model(json.load(model_file))
+                else:
+                    transaction = tcpos_parse_transaction(path)
+                items, payments = transaction[0], transaction[1]
+                header["timings"]["parse"] = time.perf_counter() - started
 
-                        if items and payments:
-                            cts310ii.print_document(items, payments, service_charge, tips, trans_num, is_credit_note, discount, comment, customer)
+                if items and payments:
+                    build_queue.put((header, path, content_hash, transaction))
+                else:
+                    logger.debug("File skipped: " + path)
+                    finish(path, processing_state.SKIPPED, header['trans_num'], error="no items or payments", content_hash=content_hash)
+                    logger.info("File skipped: %s", file)
 
-                            # Create marker file (keep original for TCPOS refunds)
-                            with open(marker_processed, 'w') as f:
-                                f.write(f"Processed at {time.strftime('%Y-%m-%d %H:%M:%S')}")
-                            logger.info(f"File processed: {file}")
+            except Exception as e:
+                logger.error("Watchdog error: " + str(e))
+                finish(path, processing_state.FAILED, header['trans_num'], error=str(e))
 
-                        else:
-                            logger.debug("File skipped: " + os.path.join(root, file))
-                            # Create skipped marker file
-                            with open(marker_skipped, 'w') as f:
-                                f.write(f"Skipped at {time.strftime('%Y-%m-%d %H:%M:%S')}")
-                            logger.info(f"File skipped: {file}")
+    def build_stage():
+        while True:
+            header, path, content_hash, transaction = build_queue.get()
+            try:
+                started = time.perf_counter()
+                document = printer.build_document(*transaction)
+                header["timings"]["build"] = time.perf_counter() - started
+                print_spool.put({"header": header, "path": path, "content_hash": content_hash, "document": document})
 
-                        time.sleep(1)
+            except Exception as e:
+                logger.error("Watchdog error while building document: " + str(e))
+                finish(path, processing_state.FAILED, header['trans_num'], error=str(e))
+
+    def print_job(job):
+        """
+        Prints one spooled receipt. Returns False when the printer cannot be
+        reached and the job has to stay at the head of the spool.
+        """
+        header, path, content_hash, document = job["header"], job["path"], job["content_hash"], job["document"]
+        file = os.path.basename(path)
+        key = receipt_key(header, content_hash)
+        timings = dict(header.get("timings", {}), queue_wait=time.time() - job["spooled_at"])
+        try:
+            # Exactly once: never print a transaction whose receipt is (or may be) on paper
+            receipt = state.get_receipt(key)
+            if receipt and receipt["state"] == processing_state.PREPARED:
+                receipt = reconcile_receipt(state, receipt, printer)
+
+            if receipt and receipt["state"] == processing_state.COMMITTED:
+                finish(path, processing_state.PROCESSED, header['trans_num'], receipt["document_number"], content_hash=content_hash)
+                logger.info("File already printed as document %s: %s", receipt['document_number'], file)
+                metrics.increment("duplicates_skipped")
+                return True
+
+            if receipt and receipt["state"] == processing_state.PREPARED:
+                if getattr(printer, 'serial_error', None):
+                    return False
+                finish(path, processing_state.REJECTED, header['trans_num'], error="previous print could not be confirmed by the printer", content_hash=content_hash)
+                logger.warning("File not printed, previous attempt unconfirmed: %s", file)
+                return True
+
+            state.prepare_receipt(key, path, header['trans_num'], document["doc_type"])
+            result = printer.print_built_document(document, on_opened=lambda number: state.update_receipt(key, document_number=number))
+
+            if not result.get("success"):
+                # the close may have reached the printer even though its answer did not
+                receipt = reconcile_receipt(state, state.get_receipt(key), printer)
+                if receipt["state"] == processing_state.COMMITTED:
+                    result = {"success": True, "document_number": receipt["document_number"]}
+                elif getattr(printer, 'serial_error', None):
+                    return False
+
+            # Original file is kept for TCPOS refunds
+            if result.get("success"):
+                state.update_receipt(key, processing_state.COMMITTED, result.get("document_number"))
+                if result.get("summary"):
+                    try:
+                        rollups.record(key, result["summary"], result.get("document_number"), header['trans_num'])
+                    except Exception as e:
+                        logger.error(f"Error adding receipt to the sales rollups: {e}")
+                finish(path, processing_state.PROCESSED, header['trans_num'], result.get("document_number"), content_hash=content_hash)
+                logger.info("File processed: %s", file)
+
+                timings.update(result.get("timings", {}))
+                if "written_at" in header:
+                    timings["total"] = time.time() - header["written_at"]
+                metrics.record_receipt(header.get("source"), header['trans_num'], timings)
+            else:
+                # rejected by the printer: every retry would leave one more cancelled document in
+                # the fiscal memory, so it is final until the file is rewritten
+                finish(path, processing_state.REJECTED, header['trans_num'], error=result.get("error"), content_hash=content_hash)
+                logger.warning("File rejected by the printer: %s", file)
+                metrics.increment("failed")
+
+        except Exception as e:
+            logger.error("Watchdog error: " + str(e))
+            finish(path, processing_state.FAILED, header['trans_num'], error=str(e))
+            metrics.increment("failed")
+
+        return True
+
+    def check_fiscal_day():
+        """
+        Closes the open sales rollup day when the printer's Z report number
+        changed, i.e. a Z report was closed from the keypad or another program.
+        """
+        get_current_z_number = getattr(printer, 'get_current_z_number', None)
+        if get_current_z_number is None or getattr(printer, 'serial_error', None):
+            return
+        if rollups.current()["day"] is None:
+            return
+        try:
+            rollups.check_z_number(get_current_z_number())
+        except Exception as e:
+            logger.error(f"Error checking the fiscal day: {e}")
+
+    def print_stage():
+        if printer_ready is not None and not printer_ready.is_set():
+            logger.info("Holding receipts until the printer is initialized")
+            printer_ready.wait()
+
+        # Resolve receipts a crash left between the first printer command and the commit
+        for receipt in state.prepared_receipts():
+            reconcile_receipt(state, receipt, printer)
+        check_fiscal_day()
+
+        retry_delay = 0
+        while True:
+            job_id, job = print_spool.peek(timeout=fiscal_day_check_interval)
+            if job_id is None:
+                check_fiscal_day()
+                continue
+
+            if print_job(job):
+                print_spool.remove(job_id)
+                retry_delay = 0
+                # a new fiscal day takes the printer's Z report number once, after its first receipt
+                if rollups.current()["opened_z"] is None:
+                    check_fiscal_day()
+                continue
+
+            # Printer offline: keep the receipt at the head of the spool and back off
+            metrics.increment("printer_retries")
+            job["attempts"] = job.get("attempts", 0) + 1
+            print_spool.update(job_id, job)
+            while True:
+                retry_delay = min(max(retry_delay * 2, spool_retry_delay), config_service.get().get('spool', {}).get('retry_max_delay', spool_retry_max_delay))
+                logger.warning(f"Printer unavailable ({getattr(printer, 'serial_error', None)}), {print_spool.depth()} receipts spooled, retrying in {retry_delay}s")
+                time.sleep(retry_delay)
+
+                # the receipt is only sent again once the printer answers a probe, it may be back on another port
+                if not hasattr(printer, 'spot_printer') or printer.spot_printer():
+                    break
+
+    for stage in (parse_stage, build_stage, print_stage):
+        threading.Thread(target=stage, name=f"tcpos-{stage.__name__}", daemon=True).start()
+
+    metrics.register_gauge("spool_depth", print_spool.depth)
+    metrics.register_gauge("in_flight", lambda: len(in_flight))
+    metrics.start_stats_writer(config.get('metrics', {}).get('stats_interval'))
+
+    # one bounded queue per source, a busy terminal only blocks its own discovery
+    source_queues = {source['name']: queue.Queue(maxsize=pipeline_queue_size) for source in sources}
+    source_ready = threading.Condition()
+
+    watchers = {}  # source name: FolderWatcher
+
+    def watch_source(source):
+        transactions_folder = source['transactions_folder']
+        source_queue = source_queues[source['name']]
+
+        # Change notifications instead of polling; None requests a full reconciliation scan
+        changes = queue.Queue()
+        watcher = folder_watcher.FolderWatcher(
+            transactions_folder,
+            changes.put,
+            debounce=source['watch_debounce'],
+            reconcile_interval=source['reconcile_interval'],
+            subdirectories=watched_subdirectories(state, source['scan_lookback_days'])
+        )
+        watchers[source['name']] = watcher
+        watcher.start()
+
+        full_scan = True  # catch up with everything written while we were not running
+        changed = set()
+        still_writing = set()
+
+        while True:
+            events = changed | still_writing
+            candidates = set(events)
+            if full_scan:
+                candidates.update(find_transaction_files(transactions_folder, state, source['scan_lookback_days']))
+            changed = set()
+            still_writing = set()
+
+            pending = []
+            for path in candidates:
+                file = os.path.basename(path)
+                try:
+                    # Skip if queued, already processed or skipped, or deleted since the event
+                    if processing_state.normalize_path(path) in in_flight:
+                        continue
+                    if state.is_done(path) and path not in events:
+                        continue  # Already processed, skip
+                    if not state.retry_due(path) and path not in events:
+                        continue  # Failed recently or too often, a change to the file retries it
+                    if not os.path.exists(path):
+                        continue
+
+                    # Still being written by TCPOS, check again shortly
+                    if not is_write_complete(path):
+                        logger.debug("File still being written: " + path)
+                        still_writing.add(path)
+                        continue
+
+                    # A change event for a finished file: only a rewrite with new content is processed again
+                    if state.is_done(path):
+                        stored_hash = state.get(path)["content_hash"]
+                        if stored_hash is None or stored_hash == file_content_hash(path):
+                            continue
+                        logger.info(f"File rewritten after processing: {file}")
+
+                    # Cheap header pre-scan: reject empty/unsupported files without a full parse
+                    header = sniff_transaction_header(path, min_version=source['supported_version'])
+                    if header is None or not header["supported"]:
+                        reason = "not a TCPOS transaction" if header is None else f"unsupported version {header['software_version']}"
+                        state.record(path, processing_state.SKIPPED, error=reason)
+                        logger.info(f"File skipped ({reason}): {file}")
+                        continue
+
+                    header["source"] = source['name']
+                    header["written_at"] = os.path.getmtime(path)
+                    header["timings"] = {"detect": time.time() - header["written_at"]}
+                    pending.append((header, path))
 
                 except Exception as e:
-                    logger.error("Watchdog error: " + str(e))
-                    pass
+                    logger.error(f"Watchdog error ({source['name']}): " + str(e))
 
-        time.sleep(1)
+            # Print in TCPOS transaction order; blocks while this source's queue is full
+            pending.sort(key=lambda entry: transaction_sort_key(entry[0]))
+
+            for header, path in pending:
+                with in_flight_lock:
+                    in_flight.add(processing_state.normalize_path(path))
+                source_queue.put((header, path))
+                with source_ready:
+                    source_ready.notify()
+
+            # Block until the next change; poll briefly only while a file is still being written
+            full_scan = False
+            try:
+                path = changes.get(timeout=write_check_interval if still_writing else None)
+                while True:
+                    if path is None:
+                        full_scan = True
+                    else:
+                        changed.add(path)
+                    path = changes.get_nowait()
+            except queue.Empty:
+                pass
+
+    for source in sources:
+        logger.info(f"Watching source {source['name']} (priority {source['priority']}): {source['transactions_folder']}")
+        threading.Thread(target=watch_source, args=(source,), name=f"tcpos-source-{source['name']}", daemon=True).start()
+
+    watched_sources = list(sources)
+
+    def apply_config(old, new):
+        """
+        Applies the settings that can change while running: per source
+        priority, supported_version, scan_lookback_days, watch_debounce and
+        reconcile_interval, and spool.high_water. Adding or removing sources,
+        moving a transactions folder and the ingest_api section need a restart.
+        """
+        updated = {source['name']: source for source in get_sources(new['pos'])}
+        for source in watched_sources:
+            new_source = updated.get(source['name'])
+            if new_source is None or new_source['transactions_folder'] != source['transactions_folder']:
+                continue
+            for key in ('priority', 'supported_version', 'scan_lookback_days', 'watch_debounce', 'reconcile_interval'):
+                source[key] = new_source[key]
+            watcher = watchers.get(source['name'])
+            if watcher is not None:
+                watcher.debounce = source['watch_debounce']
+                watcher.reconcile_interval = source['reconcile_interval']
+
+        print_spool.high_water = new.get('spool', {}).get('high_water', spool_high_water)
+
+        folders = {source['name']: source['transactions_folder'] for source in watched_sources}
+        if {name: source['transactions_folder'] for name, source in updated.items()} != folders:
+            logger.warning("Transaction sources changed, restart BAB PrintHub to watch the new folders")
+        if old.get('ingest_api') != new.get('ingest_api'):
+            logger.warning("ingest_api settings changed, restart BAB PrintHub to apply them")
+
+    config_service.on_change(apply_config)
+
+    # Transactions posted to the loopback API skip the watcher and join the merge as one more source
+    ingest_config = config.get('ingest_api', {})
+    if ingest_config.get('enabled'):
+        import ingest_api
+
+        api_source = {"name": "api", "priority": max(1, int(ingest_config.get('priority', 1)))}
+        source_queues[api_source['name']] = queue.Queue()  # unbounded, an HTTP request never waits for the printer
+        sources = sources + [api_source]
+
+        def submit(path):
+            header = ingest_header(path, config['pos'].get('supported_version', supported_version))
+            header["source"] = api_source['name']
+            header["written_at"] = time.time()
+            header["timings"] = {"detect": 0}
+            with in_flight_lock:
+                if processing_state.normalize_path(path) in in_flight:
+                    return False
+                in_flight.add(processing_state.normalize_path(path))
+            source_queues[api_source['name']].put((header, path))
+            with source_ready:
+                source_ready.notify()
+            return True
+
+        ingest = ingest_api.IngestAPI(submit, state, port=ingest_config.get('port', ingest_api.port))
+
+        # accepted before a restart but not finished yet
+        for path in ingest.pending():
+            try:
+                submit(path)
+            except Exception as e:
+                finish(path, processing_state.SKIPPED, error=str(e))
+                logger.warning(f"Stored ingest transaction skipped ({e}): {os.path.basename(path)}")
+
+        ingest.start()
+
+    # Fair merge into the single printer queue: smooth weighted round robin over
+    # the sources with waiting transactions, weighted by priority
+    credit = {source['name']: 0 for source in sources}
+    while True:
+        with source_ready:
+            source_ready.wait_for(lambda: any(not source_queue.empty() for source_queue in source_queues.values()))
+
+        waiting = [source for source in sources if not source_queues[source['name']].empty()]
+        for source in waiting:
+            credit[source['name']] += source['priority']
+        chosen = max(waiting, key=lambda source: credit[source['name']])
+        credit[chosen['name']] -= sum(source['priority'] for source in waiting)
+
+        parse_queue.put(source_queues[chosen['name']].get())
 
+# POS source interface, see registry.py
+watch = files_watchdog
+parse = tcpos_parse_transaction
 
 if 0:
     tcpos_thread = threading.Thread(target=files_watchdog, daemon=True)
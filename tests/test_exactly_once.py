@@ -0,0 +1,97 @@
+import pytest
+
+import processing_state
+import tcpos_parser
+
+
+class FakePrinter:
+    """search_document answers from a fixed set; None when the printer cannot be asked"""
+
+    def __init__(self, documents=(), online=True):
+        self.documents = set(documents)
+        self.online = online
+        self.searched = []
+
+    def search_document(self, document_number, doc_type):
+        self.searched.append((document_number, doc_type))
+        if not self.online:
+            return None
+        return document_number in self.documents
+
+
+@pytest.fixture
+def state(tmp_path):
+    return processing_state.ProcessingState(str(tmp_path / "processing_state.db"))
+
+
+def prepare(state, tmp_path, key="guid:hash", document_number=None):
+    state.prepare_receipt(key, str(tmp_path / "t1.xml"), "17", "1")
+    if document_number:
+        state.update_receipt(key, document_number=document_number)
+    return state.get_receipt(key)
+
+
+def test_receipt_key_uses_guid_and_content_hash():
+    header = {"guid": "4F59", "uuid": "type-guid", "trans_num": "17"}
+    assert tcpos_parser.receipt_key(header, "abc") == "4F59:abc"
+    assert tcpos_parser.receipt_key(header, "def") != tcpos_parser.receipt_key(header, "abc")
+
+
+def test_receipt_key_without_guid_falls_back_to_trans_num():
+    header = {"guid": None, "uuid": "type-guid", "trans_num": "17"}
+    assert tcpos_parser.receipt_key(header, "abc") == "type-guid#17:abc"
+
+
+def test_prepare_then_commit(state, tmp_path):
+    receipt = prepare(state, tmp_path)
+    assert receipt["state"] == processing_state.PREPARED
+    assert receipt["document_number"] is None
+    assert [r["key"] for r in state.prepared_receipts()] == ["guid:hash"]
+
+    state.update_receipt("guid:hash", document_number="00042")
+    state.update_receipt("guid:hash", processing_state.COMMITTED)
+
+    receipt = state.get_receipt("guid:hash")
+    assert receipt["state"] == processing_state.COMMITTED
+    assert receipt["document_number"] == "00042"  # kept when only the state changes
+    assert state.prepared_receipts() == []
+
+
+def test_prepare_again_resets_an_aborted_receipt(state, tmp_path):
+    prepare(state, tmp_path, document_number="00042")
+    state.update_receipt("guid:hash", processing_state.ABORTED)
+
+    receipt = prepare(state, tmp_path)
+    assert receipt["state"] == processing_state.PREPARED
+    assert receipt["document_number"] is None
+
+
+def test_reconcile_without_document_number_aborts_without_asking(state, tmp_path):
+    printer = FakePrinter()
+    receipt = tcpos_parser.reconcile_receipt(state, prepare(state, tmp_path), printer)
+
+    assert receipt["state"] == processing_state.ABORTED
+    assert printer.searched == []
+    assert state.get_receipt("guid:hash")["state"] == processing_state.ABORTED
+
+
+def test_reconcile_found_in_printer_memory_commits(state, tmp_path):
+    printer = FakePrinter(documents={"00042"})
+    receipt = tcpos_parser.reconcile_receipt(state, prepare(state, tmp_path, document_number="00042"), printer)
+
+    assert receipt["state"] == processing_state.COMMITTED
+    assert printer.searched == [("00042", "1")]
+    assert state.get_receipt("guid:hash")["state"] == processing_state.COMMITTED
+
+
+def test_reconcile_not_found_aborts(state, tmp_path):
+    receipt = tcpos_parser.reconcile_receipt(state, prepare(state, tmp_path, document_number="00042"), FakePrinter())
+    assert receipt["state"] == processing_state.ABORTED
+
+
+def test_reconcile_with_printer_offline_stays_prepared(state, tmp_path):
+    receipt = tcpos_parser.reconcile_receipt(
+        state, prepare(state, tmp_path, document_number="00042"), FakePrinter(online=False))
+
+    assert receipt["state"] == processing_state.PREPARED
+    assert state.get_receipt("guid:hash")["state"] == processing_state.PREPARED
@@ -0,0 +1,153 @@
+import pytest
+
+import sales_rollup
+
+
+def summary(total, credit_note=False, cash=None, card=0.0):
+    tax = round(total * 0.18 / 1.18, 2)
+    payments = {"cash": total if cash is None else cash}
+    if card:
+        payments["credit_card"] = card
+    return {
+        "doc_type": "3" if credit_note else "1",
+        "is_credit_note": credit_note,
+        "total": total,
+        "exempt": 1.0,
+        "taxes": {"1": {"sales": round(total - 1.0 - tax, 2), "tax": tax}},
+        "payments": payments,
+    }
+
+
+@pytest.fixture
+def rollups(tmp_path):
+    return sales_rollup.SalesRollups(str(tmp_path / "sales_rollup.db"))
+
+
+def test_add_receipt():
+    rollup = sales_rollup.empty_rollup()
+    sales_rollup.add_receipt(rollup, summary(118.0, cash=100.0, card=18.0))
+    sales_rollup.add_receipt(rollup, summary(11.8))
+    sales_rollup.add_receipt(rollup, summary(23.6, credit_note=True))
+
+    assert rollup["receipts"] == 3
+    assert rollup["net_total"] == 106.2
+    assert rollup["doc_types"] == {"1": {"count": 2, "total": 129.8}, "3": {"count": 1, "total": 23.6}}
+    assert rollup["sales"] == {"total": 129.8, "exempt": 2.0, "taxes": {"1": {"sales": 108.0, "tax": 19.8}}}
+    assert rollup["credit_notes"] == {"count": 1, "total": 23.6, "exempt": 1.0, "taxes": {"1": {"sales": 19.0, "tax": 3.6}}}
+    # refunds of credit notes are subtracted from the payments
+    assert rollup["payments"] == {"cash": 88.2, "credit_card": 18.0}
+
+
+def test_record_opens_a_day(rollups):
+    assert rollups.current()["day"] is None
+    assert rollups.record("a", summary(11.8), document_number="1", trans_num="1")
+
+    current = rollups.current()
+    assert current["day"] is not None
+    assert current["opened_z"] is None
+    assert current["rollup"]["receipts"] == 1
+
+
+def test_record_ignores_a_recorded_key(rollups):
+    assert rollups.record("a", summary(11.8))
+    assert not rollups.record("a", summary(11.8))
+    assert rollups.current()["rollup"]["receipts"] == 1
+
+
+def test_current_is_a_copy(rollups):
+    rollups.record("a", summary(11.8))
+    rollups.current()["rollup"]["receipts"] = 99
+    assert rollups.current()["rollup"]["receipts"] == 1
+
+
+def test_open_day_survives_a_restart(rollups):
+    rollups.record("a", summary(11.8))
+    rollups.check_z_number(7)
+
+    reopened = sales_rollup.SalesRollups(rollups.db_path)
+    assert reopened.current() == rollups.current()
+    assert not reopened.record("a", summary(11.8))
+
+
+def test_recompute_matches_the_incremental_rollup(rollups):
+    rollups.record("a", summary(118.0, cash=100.0, card=18.0))
+    rollups.record("b", summary(23.6, credit_note=True))
+    rollups.close_day(1)
+    rollups.record("c", summary(11.8))
+    before = rollups.days()
+
+    assert rollups.recompute() == 2
+    assert rollups.days() == before
+    assert rollups.current()["rollup"] == before[0]["rollup"]
+
+
+def test_recompute_one_day(rollups):
+    rollups.record("a", summary(11.8))
+    day = rollups.current()["day"]
+    rollups._connection.execute("UPDATE fiscal_days SET rollup = ?", ('{"receipts": 0}',))
+
+    assert rollups.recompute(day) == 1
+    assert rollups.days()[0]["rollup"] == rollups.current()["rollup"]
+    assert rollups.current()["rollup"]["receipts"] == 1
+
+
+def test_close_day(rollups):
+    rollups.record("a", summary(11.8))
+    rollups.close_day(5)
+
+    assert rollups.current()["day"] is None
+    closed = rollups.days()[0]
+    assert closed["z_number"] == 5
+    assert closed["closed_at"]
+
+    rollups.record("b", summary(23.6))
+    assert [day["rollup"]["receipts"] for day in rollups.days()] == [1, 1]
+    assert rollups.days()[0]["closed_at"] is None
+
+
+def test_close_day_without_an_open_day(rollups):
+    rollups.close_day(5)
+    assert rollups.days() == []
+
+
+def test_check_z_number_without_an_open_day(rollups):
+    assert not rollups.check_z_number(7)
+    rollups.record("a", summary(11.8))
+    assert not rollups.check_z_number(None)
+    assert rollups.current()["opened_z"] is None
+
+
+def test_check_z_number_stamps_the_open_day(rollups):
+    rollups.record("a", summary(11.8))
+
+    assert not rollups.check_z_number(7)
+    assert rollups.current()["opened_z"] == 7
+    assert not rollups.check_z_number(7)
+    assert rollups.current()["rollup"]["receipts"] == 1
+
+
+def test_check_z_number_closes_a_stale_day(rollups):
+    rollups.record("a", summary(11.8))
+    rollups.check_z_number(7)
+
+    # a Z report printed from the keypad closed #7
+    assert rollups.check_z_number(8)
+    assert rollups.current()["day"] is None
+    assert rollups.days()[0]["z_number"] == 7
+
+
+def test_check_z_number_after_a_restart(rollups):
+    rollups.record("a", summary(11.8))
+    rollups.check_z_number(7)
+
+    reopened = sales_rollup.SalesRollups(rollups.db_path)
+    assert not reopened.check_z_number(7)
+    assert reopened.check_z_number(8)
+    assert reopened.days()[0]["z_number"] == 7
+
+
+def test_render(rollups):
+    rollups.record("a", summary(118.0, cash=100.0, card=18.0))
+    text = sales_rollup.render(rollups.current(), {"tax1": 18.0})
+    assert "Tax 1 (18%)" in text
+    assert "Credit card" in text
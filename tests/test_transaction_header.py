@@ -0,0 +1,85 @@
+import pytest
+
+import tcpos_generator
+import tcpos_parser
+
+
+def write(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_text(content, encoding="utf-8")
+    return str(path)
+
+
+def transaction(total="12.50", storno="", tail="<subItems><item/></subItems></data></Root>"):
+    storno_details = f'<StornoDetails StornoType="{storno}"/>' if storno else ""
+    return ('<?xml version="1.0" encoding="utf-8"?><!-- TCPOS -->'
+            '<Root><data SoftwareVersion="8.0.7.669" TransNum="17" GUID="4F59" total="' + total + '">'
+            + storno_details + tail)
+
+
+def test_generated_transaction(tmp_path):
+    path = write(tmp_path, "t.xml", tcpos_generator.generate_transaction(line_count=3, trans_num=42, seed=7))
+    header = tcpos_parser.sniff_transaction_header(path)
+
+    assert header["trans_num"] == "42"
+    assert header["software_version"] == tcpos_generator.SOFTWARE_VERSION
+    assert header["guid"]
+    assert header["supported"] is True
+    assert header["is_credit_note"] is False
+
+
+@pytest.mark.parametrize("chunk_size", [7, 4096])
+def test_fields_before_sub_items(tmp_path, chunk_size):
+    header = tcpos_parser.sniff_transaction_header(write(tmp_path, "t.xml", transaction()), chunk_size=chunk_size)
+
+    assert header == {
+        "uuid": "Root",
+        "software_version": "8.0.7.669",
+        "trans_num": "17",
+        "guid": "4F59",
+        "total": "12.50",
+        "storno_type": "",
+        "supported": True,
+        "is_credit_note": False,
+    }
+
+
+def test_stops_reading_at_sub_items(tmp_path):
+    # everything after the sub items start is never parsed, a cut off tail does not matter
+    header = tcpos_parser.sniff_transaction_header(write(tmp_path, "t.xml", transaction(tail="<subItems><item a=")))
+    assert header["trans_num"] == "17"
+
+
+def test_credit_note_by_negative_total(tmp_path):
+    header = tcpos_parser.sniff_transaction_header(write(tmp_path, "t.xml", transaction(total="-12.50")))
+    assert header["is_credit_note"] is True
+
+
+def test_credit_note_by_storno_child(tmp_path):
+    header = tcpos_parser.sniff_transaction_header(write(tmp_path, "t.xml", transaction(storno="StornoChild")))
+    assert header["storno_type"] == "StornoChild"
+    assert header["is_credit_note"] is True
+
+
+def test_unparsable_total_falls_back_to_storno_type(tmp_path):
+    header = tcpos_parser.sniff_transaction_header(write(tmp_path, "t.xml", transaction(total="n/a")))
+    assert header["is_credit_note"] is False
+
+
+def test_older_version_is_unsupported(tmp_path):
+    header = tcpos_parser.sniff_transaction_header(write(tmp_path, "t.xml", transaction()), min_version="9.0")
+    assert header["supported"] is False
+
+
+@pytest.mark.parametrize("content", [
+    "",
+    "<foo><bar/></foo>",
+    "<Root><data SoftwareVersion=",
+    "not xml at all",
+])
+def test_not_a_transaction(tmp_path, content):
+    assert tcpos_parser.sniff_transaction_header(write(tmp_path, "t.xml", content)) is None
+
+
+def test_missing_file(tmp_path):
+    assert tcpos_parser.sniff_transaction_header(str(tmp_path / "missing.xml")) is None
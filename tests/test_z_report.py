@@ -0,0 +1,115 @@
+import pytest
+
+import cts310ii
+import z_archive
+
+
+def amounts(first):
+    """12 amounts for one section: total, tax1..tax10, accumulated"""
+    return ["%012d" % (first * 100 + index) for index in range(12)]
+
+
+def z_report_frame(number=12, report_date="05102026", report_time="231500", business_date="05102026",
+                   initial_nkk="0000000100 ", final_nkk="0000000150 "):
+    fields = ["76", "%04d" % number, report_date, report_time, business_date, initial_nkk, final_nkk]
+    for section in range(4):
+        fields += amounts(section + 1)
+    fields += ["3", "2"]
+    body = cts310ii.FS.join(cts310ii.string_to_hex(field) for field in fields)
+    # the printer answers in lower case hex
+    return (cts310ii.STX + body + cts310ii.ETX + cts310ii.ACK).lower()
+
+
+def test_decode_z_report():
+    report = cts310ii.decode_z_report(z_report_frame())
+
+    assert report["number"] == 12
+    assert report["report_datetime"] == "2026-10-05 23:15:00"
+    assert report["business_date"] == "2026-10-05"
+    assert report["initial_nkk"] == "0000000100"
+    assert report["final_nkk"] == "0000000150"
+    assert report["no_sale_documents"] == 3
+    assert report["cancelled_documents"] == 2
+
+    for index, section in enumerate(cts310ii.z_report_sections):
+        first = (index + 1) * 100
+        assert report[section]["total"] == first / 100
+        assert report[section]["taxes"] == [(first + tax_id) / 100 for tax_id in range(1, 11)]
+        assert report[section]["accumulated"] == (first + 11) / 100
+
+
+@pytest.mark.parametrize("data", [
+    "",
+    cts310ii.STX + cts310ii.ETX + cts310ii.ACK,
+    z_report_frame(report_date="31022026"),
+    z_report_frame()[:200] + cts310ii.ETX + cts310ii.ACK,
+])
+def test_decode_malformed_z_report(data):
+    assert cts310ii.decode_z_report(data) is None
+
+
+def report(number, business_date, final_nkk):
+    year, month, day = business_date.split("-")
+    return cts310ii.decode_z_report(z_report_frame(number=number, business_date=day + month + year, final_nkk=final_nkk))
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = z_archive.ZArchive(str(tmp_path / "z_archive.db"))
+    archive.store([
+        report(10, "2026-09-30", "0000000905"),
+        report(11, "2026-10-01", "0000001005"),
+        report(12, "2026-10-02", "0000002205"),
+    ])
+    return archive
+
+
+def test_store_and_get(archive):
+    assert archive.last_number() == 12
+    assert archive.get(11)["final_nkk"] == "0000001005"
+    assert archive.get("11")["number"] == 11
+    assert archive.get(99) is None
+
+
+def test_store_again_replaces(archive):
+    archive.store([report(11, "2026-10-01", "0000001099")])
+    assert archive.get(11)["final_nkk"] == "0000001099"
+    assert len(archive.search()) == 3
+
+
+def test_summary_totals(archive):
+    summary = archive.search("12")[0]
+    assert summary["sales_total"] == 3
+    assert summary["credit_notes_total"] == 7
+
+
+def test_empty_archive(tmp_path):
+    archive = z_archive.ZArchive(str(tmp_path / "z_archive.db"))
+    assert archive.last_number() is None
+    assert archive.search() == []
+
+
+@pytest.mark.parametrize("query, date_from, date_to, numbers", [
+    ("", None, None, [12, 11, 10]),
+    ("11", None, None, [11]),
+    ("2026-10", None, None, [12, 11]),
+    ("0000001005", None, None, [11]),
+    ("00000009", None, None, [10]),
+    ("", "2026-10-01", None, [12, 11]),
+    ("", None, "2026-10-01", [11, 10]),
+    ("", "2026-10-01", "2026-10-01", [11]),
+    ("2026-09", "2026-10-01", None, []),
+])
+def test_search(archive, query, date_from, date_to, numbers):
+    assert [row["number"] for row in archive.search(query, date_from, date_to)] == numbers
+
+
+def test_search_limit(archive):
+    assert [row["number"] for row in archive.search(limit=2)] == [12, 11]
+
+
+def test_render():
+    text = z_archive.render(cts310ii.decode_z_report(z_report_frame()), {"tax1": 18.0})
+    assert "Z REPORT #0012" in text
+    assert "Tax 1 (18%)" in text
+    assert "Tax 2" in text
@@ -0,0 +1,225 @@
+"""
+Local archive of closed Z reports
+
+Right after a Z report closes the fiscal day its totals are read back from the
+fiscal memory (the printer driver's read_z_reports, nothing is printed) and
+stored in z_archive.db in base_dir. Fiscal Tools searches the archive and
+renders a screen copy without a printer round trip; a paper reprint is only
+needed when one is actually required.
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+from logger_module import logger
+
+
+if getattr(sys, 'frozen', False):
+    base_dir = os.path.dirname(sys.executable)
+
+elif __file__:
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+backfill_limit = 31  # missing older reports read along with a new one (e.g. closed from the printer keypad)
+search_limit = 100  # rows returned by one search
+render_width = 48  # characters per line, as on the receipt paper
+
+section_titles = {
+    "invoice_final_consumer": "Invoice Final Consumer",
+    "invoice_fiscal_credit": "Invoice Fiscal Credit",
+    "credit_note_final_consumer": "Credit Note Final Consumer",
+    "credit_note_fiscal_credit": "Credit Note Fiscal Credit",
+}
+
+SUMMARY_COLUMNS = "number, report_datetime, business_date, initial_nkk, final_nkk, sales_total, credit_notes_total"
+
+
+class ZArchive:
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.path.join(base_dir, 'z_archive.db')
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS z_reports (
+                number INTEGER PRIMARY KEY,
+                report_datetime TEXT NOT NULL,
+                business_date TEXT NOT NULL,
+                initial_nkk TEXT,
+                final_nkk TEXT,
+                sales_total REAL NOT NULL,
+                credit_notes_total REAL NOT NULL,
+                report TEXT NOT NULL,
+                archived_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS z_reports_business_date ON z_reports (business_date);
+        """)
+        self._connection.commit()
+
+    def store(self, reports):
+        """
+        Stores decoded Z reports; a report archived again replaces the old row.
+        """
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        rows = []
+        for report in reports:
+            sales_total = report["invoice_final_consumer"]["total"] + report["invoice_fiscal_credit"]["total"]
+            credit_notes_total = report["credit_note_final_consumer"]["total"] + report["credit_note_fiscal_credit"]["total"]
+            rows.append((report["number"], report["report_datetime"], report["business_date"], report["initial_nkk"],
+                         report["final_nkk"], round(sales_total, 2), round(credit_notes_total, 2), json.dumps(report), now))
+
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO z_reports (number, report_datetime, business_date, initial_nkk, final_nkk, "
+                "sales_total, credit_notes_total, report, archived_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._connection.commit()
+
+    def last_number(self):
+        with self._lock:
+            return self._connection.execute("SELECT MAX(number) FROM z_reports").fetchone()[0]
+
+    def get(self, number):
+        """
+        Returns the decoded Z report archived under number, or None.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT report FROM z_reports WHERE number = ?", (int(number),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def search(self, query="", date_from=None, date_to=None, limit=search_limit):
+        """
+        Returns report summaries, newest first. query matches a report number,
+        the start of a business date (2026-10) or part of an NKK; dates limit
+        the business date range (YYYY-MM-DD, inclusive).
+        """
+        conditions, parameters = [], []
+        query = (query or "").strip()
+        if query.isdigit():
+            conditions.append("(number = ? OR initial_nkk LIKE ? OR final_nkk LIKE ?)")
+            parameters += [int(query), f"%{query}%", f"%{query}%"]
+        elif query:
+            conditions.append("(business_date LIKE ? OR initial_nkk LIKE ? OR final_nkk LIKE ?)")
+            parameters += [f"{query}%", f"%{query}%", f"%{query}%"]
+        if date_from:
+            conditions.append("business_date >= ?")
+            parameters.append(date_from)
+        if date_to:
+            conditions.append("business_date <= ?")
+            parameters.append(date_to)
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            cursor = self._connection.execute(
+                f"SELECT {SUMMARY_COLUMNS} FROM z_reports {where} ORDER BY number DESC LIMIT ?", parameters + [limit])
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive():
+    """
+    Returns the shared archive, opened on first use.
+    """
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            _archive = ZArchive()
+        return _archive
+
+
+def archive_z_reports(printer, start_number, end_number, progress=None, cancel=None):
+    """
+    Reads a range of Z reports from the printer's fiscal memory into the
+    archive. Reports read before a failure or cancel are kept.
+    """
+    read_z_reports = getattr(printer, 'read_z_reports', None)
+    if read_z_reports is None:
+        return {"success": False, "error": "The printer driver cannot read Z reports back"}
+
+    result = read_z_reports(start_number, end_number, progress=progress, cancel=cancel)
+    reports = result.get("reports") or []
+    if reports:
+        get_archive().store(reports)
+        logger.info(f"Archived {len(reports)} Z report(s): #{reports[0]['number']} to #{reports[-1]['number']}")
+
+    if not result.get("success"):
+        return result
+
+    return {
+        "success": True,
+        "message": f"Archived {len(reports)} Z Report(s) (#{start_number} to #{end_number})",
+        "archived": len(reports)
+    }
+
+
+def archive_after_close(printer, report_number):
+    """
+    Archives the Z report that was just closed in the background, along with
+    the ones missing since the last archived report.
+    """
+    if report_number is None:
+        logger.warning("Z report number unknown, the report was not archived")
+        return
+
+    def run():
+        try:
+            last_number = get_archive().last_number()
+            start_number = report_number if last_number is None else last_number + 1
+            start_number = min(max(start_number, report_number - backfill_limit + 1), report_number)
+            result = archive_z_reports(printer, start_number, report_number)
+            if not result.get("success"):
+                logger.warning(f"Z report #{report_number} not archived: {result.get('error')}")
+        except Exception as e:
+            logger.error(f"Error archiving Z report #{report_number}: {e}")
+
+    threading.Thread(target=run, name="z-archive", daemon=True).start()
+
+
+def render(report, fiscal_information=None):
+    """
+    Returns a plain text screen copy of a Z report. fiscal_information (the
+    printer's tax1..tax10 rates) labels the tax lines with their percent.
+    """
+    def line(label, value=""):
+        return f"{label:<{render_width - len(str(value))}}{value}"
+
+    def amount(value):
+        return f"{value:,.2f}"
+
+    separator = "-" * render_width
+    lines = [
+        f"Z REPORT #{report['number']:04d}".center(render_width),
+        separator,
+        line("Date", report["report_datetime"]),
+        line("Business date", report["business_date"]),
+        line("Initial NKK", report["initial_nkk"]),
+        line("Final NKK", report["final_nkk"]),
+    ]
+
+    for section, title in section_titles.items():
+        totals = report[section]
+        lines += [separator, title.upper()]
+        for tax_id, tax in enumerate(totals["taxes"], start=1):
+            if not tax:
+                continue
+            rate = (fiscal_information or {}).get(f"tax{tax_id}")
+            label = f"  Tax {tax_id} ({rate:g}%)" if rate else f"  Tax {tax_id}"
+            lines.append(line(label, amount(tax)))
+        lines.append(line("  Total", amount(totals["total"])))
+        lines.append(line("  Accumulated", amount(totals["accumulated"])))
+
+    lines += [
+        separator,
+        line("No sale documents", report["no_sale_documents"]),
+        line("Cancelled documents", report["cancelled_documents"]),
+        separator,
+    ]
+    return "\n".join(lines)